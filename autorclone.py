@@ -2,13 +2,26 @@ import os
 import json
 import time
 import glob
-import psutil
+import gzip
+import shutil
+import signal
+import socket
+import struct
+import sqlite3
+import asyncio
 import logging
 import subprocess
 import configparser
 import argparse
-
-import filelock
+import re
+import array
+import calendar
+import bisect
+import shlex
+import threading
+import itertools
+import collections
+import concurrent.futures
 
 from logging.handlers import RotatingFileHandler
 
@@ -19,10 +32,10 @@ script_location = os.path.dirname(os.path.abspath(__file__))
 def parse_args():
     parser = argparse.ArgumentParser(description="Move/Sync or Copy from source remote or local path "
                                                  "to destination remote.")
-    parser.add_argument('-s', '--source', type=str, required=True,
+    parser.add_argument('-s', '--source', type=str,
                         help='The source remote name or local file path.')
 
-    parser.add_argument('-d', '--destination', type=str, required=True,
+    parser.add_argument('-d', '--destination', type=str,
                         help='The destination remote name.')
 
     parser.add_argument('-sa', '--service_accounts', type=str, default=script_location + "/service_accounts",
@@ -31,12 +44,81 @@ def parse_args():
     parser.add_argument('-p', '--port', type=int, default=5572,
                         help="The port # to run 'rclone rc' on. Set it to different one if you want to run another instance.")
 
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="The number of rclone processes to run at once. Each worker transfers a shard of the source "
+                             "with its own service account and uses the port 'PORT + worker number'.")
+
+    parser.add_argument('--shard-by', type=str, default='size', choices=['dir', 'size'],
+                        help="How to split the source between the workers, by top-level entries (dir) or by balanced "
+                             "byte totals of the top-level entries (size).")
+
+    parser.add_argument('--warm-standby', action='store_true',
+                        help="Start the rclone of the next service account before the current one hits its limit, "
+                             "so that switching accounts only takes a few seconds (implies --manifest, the standby gets "
+                             "a batch of its own).")
+
+    parser.add_argument('--manifest', action='store_true',
+                        help="List the source once a run, skip what is already at the destination and give each rclone "
+                             "a batch of files filling the quota left of its service account with '--files-from-raw'.")
+
+    parser.add_argument('--index', action='store_true',
+                        help="Keep an index of the destination on disk and diff the source against it instead of listing "
+                             "the destination at every run (implies --manifest).")
+
+    parser.add_argument('--refresh-index', action='store_true',
+                        help="List the whole destination again to rebuild its index.")
+
+    parser.add_argument('--rate-control', action='store_true',
+                        help="Tune the tpslimit and the transfers of every new rclone, lower after a rate limit error "
+                             "and higher while it makes rclone faster (see rate_control_* in the script).")
+
+    parser.add_argument('--verify', action='store_true',
+                        help="Once the transfer is complete, check only the files it has transferred with several "
+                             "'rclone check' at once, the ones which are missing or differ are transferred again by "
+                             "the next run (see verify_* in the script).")
+
+    parser.add_argument('--rules', type=str, default=None,
+                        help="A json file with the rules which make a switch to the next service account, "
+                             "instead of switch_rules.json next to the script or the rules in the script.")
+
+    parser.add_argument('--preflight', action='store_true',
+                        help="Get an access token with every service account key at start and quarantine the keys "
+                             "which are refused (sa_preflight), a token request per key.")
+
+    parser.add_argument('--leases', type=str, default=None,
+                        help="Lease the service accounts in use so that several hosts sharing them never use the same "
+                             "one at once: 'file:/shared/folder' or 'sqlite:/shared/leases.db' (sa_lease_backend).")
+
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus metrics of the transfer and the account switches on "
+                             "'http://METRICS_HOST:METRICS_PORT/metrics'.")
+
+    parser.add_argument('--state-dir', type=str, default=None,
+                        help="Keep the lock, state files and rclone logs of this run in STATE_DIR instead of /tmp, "
+                             "so that several runs with different ports can work at once.")
+
+    parser.add_argument('--daemon', type=str, default=None, metavar='QUEUE_DIR',
+                        help="Run the transfer jobs queued as json files in QUEUE_DIR (source, destination, mode, "
+                             "priority...) with one shared pool of service accounts, until stopped.")
+
+    parser.add_argument('--max-jobs', type=int, default=2,
+                        help="The number of jobs the daemon runs at once.")
+
+    parser.add_argument('--report', type=str, nargs='?', const='', default=None, metavar='HISTORY_DIR',
+                        help="Print the efficiency report of the recorded history (stats_history_path, in --state-dir "
+                             "if given, or HISTORY_DIR) and exit.")
+
+    parser.add_argument('--plan', type=str, default=None, metavar='LISTING',
+                        help="Print how many service accounts and how much time the transfer of the files of LISTING "
+                             "would take and exit: a local folder, a manifest (.gz), or the output of 'rclone lsjson -R' "
+                             "or 'rclone size --json' of the source (see plan_* in the script). "
+                             "--workers, --warm-standby, --manifest and --rules are taken into account.")
+
     args = parser.parse_args()
+    if args.daemon is None and args.report is None and args.plan is None and (not args.source or not args.destination):
+        parser.error('the following arguments are required: -s/--source, -d/--destination')
     return args
 
-# Initialize the arguments
-args = parse_args()
-
 # Time
 def get_TotalTime(time_start):
     time_stop = time.time()
@@ -45,38 +127,120 @@ def get_TotalTime(time_start):
     str_timeTotal = "Total elapsed time: {:0>2}:{:0>2}:{:05.2f}".format(int(hours), int(minutes), sec)
     return str_timeTotal
 
-# Check the rclone log size, if bigger than 125MB then clear it.
-def getRcloneLogSize():
-    rclone_log = "/tmp/rclone.log"
-    if os.path.exists(rclone_log):
-        file_info = os.stat(rclone_log)
-        file_inMB = int(file_info.st_size / (1024 * 1024))
-        if file_inMB > 125:
-            tmpLog = open(rclone_log, 'w')
-            tmpLog.write("")
-            tmpLog.close()
+# Check the rclone log size, if bigger than rclone_log_max_size then rotate it, the old logs are compressed in the background
+# Only call it when no rclone is writing to the log
+def rotateRcloneLog(rclone_log):
+    if os.path.exists(rclone_log) and os.stat(rclone_log).st_size > rclone_log_max_size:
+        for i in range(rclone_log_backups - 1, 0, -1):
+            if os.path.exists('%s.%s.gz' % (rclone_log, i)):
+                os.replace('%s.%s.gz' % (rclone_log, i), '%s.%s.gz' % (rclone_log, i + 1))
+        rotated_log = '%s.%s' % (rclone_log, time.strftime('%Y%m%d%H%M%S'))
+        os.replace(rclone_log, rotated_log)
+        threading.Thread(target=compressRcloneLog, args=(rotated_log, '%s.1.gz' % rclone_log), daemon=True).start()
+
+
+def compressRcloneLog(rotated_log, compressed_log):
+    with open(rotated_log, 'rb') as f_in, gzip.open(compressed_log, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(rotated_log)
 
 # ------------ Start of configuration items ------------------
 
+# Rclone executable, a full path if it is not in PATH
+rclone_bin = 'rclone'
+
 # Rclone run command
 # 1. Fill in what you are using or want to use. It can also be move, copy or sync ...
 # 2. It is recommended to add '--rc', it is fine if you don't add it, the script will automatically add it
-# 3. To follow the output of rclone, run 'tail -f /tmp/rclone.log' in another terminal.
-cmd_rclone = "rclone sync {} {} --drive-server-side-across-configs --fast-list --tpslimit 5 --max-backlog 2000000 -vv --log-file /tmp/rclone.log".format(args.source, args.destination)
+# 3. The script adds '--log-file' itself, to follow the output of rclone, run 'tail -f /tmp/rclone.log' in another terminal.
+# 4. Every job (the one of the command line, of the daemon or of a Supervisor) runs
+#    'rclone_bin rclone_mode SOURCE DESTINATION rclone_flags' without a shell, rclone_flags is split like a shell would do
+#    (quote a flag value with spaces) while the paths are given to rclone as they are
+rclone_mode = 'sync'
+rclone_flags = '--drive-server-side-across-configs --fast-list --tpslimit 5 --max-backlog 2000000 -vv'
+
+# Rclone log file, worker N (when --workers is bigger than 1) logs to /tmp/rclone.N.log
+# The script adds '--use-json-log' and follows the log as it is written to react to errors right away
+rclone_log_file = r'/tmp/rclone.log'
+rclone_log_max_size = 125 * 1024 * 1024  # Rotate the rclone log before starting rclone when it is bigger than xx bytes
+rclone_log_backups = 5  # Keep xx compressed rotated logs (/tmp/rclone.log.1.gz is the newest one)
+log_follow_interval = 0.05  # Read what rclone added to its log every xx seconds
 
 # Check rclone interval (s)
-check_after_start = 60  # After the rclone process has started, check the rclone status after xx seconds to prevent 'rclone rc core/stats' from exiting with an error.
-check_interval = 10  # Main process, run a check for 'rclone rc core/stats' every xx seconds
-check_after_restart = 30 # Wait xx seconds before restarting a new rclone process after switching to a new service account
+check_interval = 10  # Main process, run a check for rc 'core/stats' every xx seconds (fractions such as 0.5 are allowed)
+
+# Start and stop of rclone (s), the script goes on as soon as rclone is up or has exited
+rclone_start_timeout = 60  # After the rclone process has started, wait at most xx seconds for its rc to answer
+rclone_quit_timeout = 10  # After rc 'core/quit', wait at most xx seconds for rclone to exit before sending SIGTERM
+rclone_term_timeout = 10  # After SIGTERM, wait at most xx seconds for rclone to exit before killing it
+rclone_stop_timeout = 30  # After killing the rclone process, wait at most xx seconds for it to exit
+ready_backoff_initial = 0.1  # First delay between two readiness probes of rc, doubled after every probe
+ready_backoff_max = 2  # Longest delay between two readiness probes of rc
+
+# Warm standby (--warm-standby, implies --manifest), the rclone of the next SA gets a batch of its own, lists and checks it
+# with '--check-first' in the background and is paused as soon as it would start transferring, switching then only stops
+# the old rclone and resumes the standby. It writes to the rclone log with '.standby' before its extension, and the
+# rclone which runs next after a standby takes over uses the other log.
+standby_lead_time = 600  # Start the standby when the current SA would reach its quota within xx seconds at its current speed
+standby_check_interval = 0.5  # Check the standby every xx seconds until it is paused
+standby_bwlimit = '1'  # Bandwidth limit of the standby before it is paused (1 KiB/s), removed when it takes over
+standby_port_offset = 100  # The standby uses the rc port 'PORT + xx' (or PORT when the current rclone uses that one)
+
+# Drain before a switch made only by the rules below (the quota is about to run out, not gone yet): rclone starts
+# no new transfer ('MaxTransfer' with the soft 'CutoffMode' set by rc), the transfers in progress which fit in the quota
+# left finish, then rclone quits. The others would have to start over with the next SA anyway.
+# rclone is stopped at once when it starts a new transfer anyway or when the bytes of the drain reach the quota left.
+drain_switch_rules = ['up_than_750', 'quota_forecast']  # [] to never drain
+drain_timeout = 900  # Wait at most xx seconds for the transfers to finish
+
+# rclone rc connection (the script talks to the rclone rc HTTP API directly, no 'rclone rc' subprocess is started)
+rc_host = '127.0.0.1'  # Address used to reach the rc server started by '--rc-addr=:PORT'
+rc_timeout = 5  # Timeout (s) of a single rc request, it can be lower than check_interval for sub-second polling
+rc_retries = 3  # Retry a failed rc request xx times (with a growing delay) before giving up on this check
+rc_retry_backoff = 0.5  # First delay (s) between two retries, doubled after every failed retry
+rc_max_failed_time = 40  # If rclone rc keeps failing for xx seconds, consider the rclone process as ended
 
 # rclone account change monitoring conditions
-switch_sa_level = 1  # The number of rules to be met. The larger the number is, the stricter the switching conditions must be.
-switch_sa_rules = {
-    'up_than_750': True,  # The current account has been passed 750G
-    'error_user_rate_limit': True,  # Rclone directly prompt rate limit error
-    'zero_transferred_between_check_interval': False,  # 100 rclone transfers during the 100 check interval
-    'all_transfers_in_zero': False,  # All transfers currently have a size of 0
-}
+# Every check adds the core/stats of rclone to a window of samples, and the rules look at the last `window` seconds of it.
+# A rule has a `name` (shown in the log and the metrics, used by quota_exhausted_rules), a `kind`, a `weight` (1 by default),
+# `enabled` (true by default) and a `window` (s). The kinds are:
+#   quota_used        The current account has passed its quota (sa_daily_quota)
+#   quota_forecast    The current account would pass its quota within the next `polls` checks at its current speed
+#   error_message     lastError matches the regex `pattern`, or the rclone log has events of the types `log_events`
+#                     (quota, rate_limit, retry, error) in the window (0 for since rclone started)
+#   error_rate_above  More than `rate` errors per minute in the window (core/stats `errors`, or the `log_events` if given)
+#   speed_below       At most `speed` bytes per second on average in the window (rclone doesn't transfer while listing)
+#   transfers_idle    No transfer moved in the window (0 for the last check only)
+# The rules and the level can also be given without editing the script, in a json file
+# {"switch_sa_level": 2, "switch_sa_rules": [{"name": "stalled", "kind": "speed_below", "speed": 1048576, "window": 90}, ...]}
+switch_sa_level = 1  # Switch when the weights of the rules hit add up to xx. The larger the number is, the stricter the switching conditions must be.
+switch_sa_rules = [
+    {'name': 'up_than_750', 'kind': 'quota_used'},  # The current account has been passed 750G
+    {'name': 'error_user_rate_limit', 'kind': 'error_message', 'pattern': 'userRateLimitExceeded',
+     'log_events': ['quota']},  # Rclone directly prompt rate limit error
+    {'name': 'zero_transferred_between_check_interval', 'kind': 'speed_below', 'speed': 0, 'window': 1000,
+     'enabled': False},  # Nothing transferred in 1000s (100 checks)
+    {'name': 'all_transfers_in_zero', 'kind': 'transfers_idle', 'enabled': False},  # All transfers currently have a size of 0
+    {'name': 'stalled', 'kind': 'speed_below', 'speed': pow(1024, 2), 'window': 90, 'enabled': False},  # Below 1 MiB/s for 90s
+    {'name': 'error_rate', 'kind': 'error_rate_above', 'rate': 30, 'window': 60, 'enabled': False},  # Above 30 errors a minute
+    {'name': 'quota_forecast', 'kind': 'quota_forecast', 'polls': 1, 'enabled': False},  # Quota runs out before the next check
+]
+switch_rules_path = script_location + '/switch_rules.json'  # Used instead of the rules above when it exists
+stats_window_max_samples = 10000  # Keep at most xx core/stats samples of the current rclone
+
+# Adaptive rate control (--rate-control), an AIMD controller of the '--tpslimit' and '--transfers' of the rclone processes
+# rclone only reads them when it starts: a rate limit error (403 rateLimitExceeded in the log or lastError, not the daily
+# quota) multiplies both by rate_control_decrease and restarts the running rclone with them (same SA) right away,
+# a rclone without one gets the next rclone (at a switch or a new batch) rate_control_step more of both as long as each
+# increase makes the next rclone faster than the one before it.
+rate_control_tpslimit = (1, 50)  # Bounds of the tpslimit, an unset tpslimit starts from the highest one
+rate_control_transfers = (1, 32)  # Bounds of the transfers, an unset transfers starts from 4 like rclone
+rate_control_decrease = 0.5  # Multiply the limits by xx after a rate limit error
+rate_control_step = 1  # Add xx to the limits of the next rclone after a rclone without rate limit errors
+rate_control_increase_after = 60  # A rclone must transfer for xx seconds for its speed to count, also the wait after a decrease
+rate_control_min_gain = 0.05  # An increase which makes rclone less than 5% faster (bytes or files per second) is undone
+rate_control_retry_after = 600  # Try to increase again xx seconds after an undone increase
+rate_control_restart_after = 30  # Restart rclone for a decrease at most once every xx seconds, the next rclone gets the others
 
 # rclone account switching method (runtime or config)
 # runtime is to modify the rclone command and add the follow parameter to it '--drive-service-account-file'
@@ -87,10 +251,88 @@ switch_sa_way = 'runtime'
 rclone_config_path = '/root/.config/rclone/rclone.conf'  # Rclone configuration file location
 rclone_dest_name = 'GDrive'  # Rclone destination name (same as corresponding in cmd_rclone, and ensure that SA has been added)
 
+# Source manifest (--manifest), the source is listed once a run and rclone only checks the files of its batch instead of
+# listing everything at each switch. A `sync` becomes a `copy` as the batches can't delete the extra files of the destination
+manifest_path = r'/tmp/autorclone.manifest.gz'  # Files, sizes, modification times and md5 of the last listing of the source
+manifest_hashes = True  # List the md5 of the files of a remote source too ('--hash', free on Drive, other remotes may read the files)
+manifest_modtime_window = 1  # A file at the destination with the same size and modification time (within xx seconds) is done
+batch_files_path = r'/tmp/autorclone.batch.%s.txt'  # File list of the rclone on rc port %s given with '--files-from-raw'
+
+# Destination index (--index), kept up to date with the files transferred by the script and between runs
+# with the Drive changes of the destination (if google-api-python-client is installed), instead of listing it again
+destination_index_path = r'/tmp/autorclone.index'  # SQLite database of the files at the destination
+destination_index_max_age = 7 * 24 * 3600  # List the whole destination again when its index is older than xx seconds
+drive_changes = True  # Follow the Drive changes of the destination between runs, it needs read access of the first SA
+
+# Journal of the transferred files (from the rclone log and rc 'core/transferred'), kept until the transfer is complete
+# The rclone of the next SA (or of the next run) excludes them, with --manifest they are left out of the batches
+transfer_journal_path = r'/tmp/autorclone.journal'  # SQLite database
+journal_exclude_max = 100000  # rclone matches every file against every exclude rule, exclude at most the xx newest files
+
+# Verification (--verify), after a complete transfer `rclone check` compares only the files of the journal,
+# verify_processes at once with an account each. The files missing or different at the destination are written to
+# the retry list, the next run of the job transfers them again ('--ignore-times') before anything else.
+# The job still ends with the exit code of its transfer. A move isn't verified, its files are gone from the source.
+verify_processes = 4  # Run xx rclone check at once
+verify_flags = '--one-way'  # Added to 'rclone check', e.g. '--one-way --download' to compare files without hashes
+verify_files_path = r'/tmp/autorclone.verify.%s.txt'  # Files checked by the rclone check %s
+verify_result_path = r'/tmp/autorclone.verify.%s.result'  # Its '--combined' report
+verify_retry_path = r'/tmp/autorclone.retry.txt'  # Files to transfer again at the next run
+
+# History of the checks (rc 'core/stats' samples) and switches for the efficiency report (--report)
+# A file of fixed size records per UTC day, the old days only keep a sample every stats_history_downsample seconds
+stats_history_path = r'/tmp/autorclone.history'  # Folder of the history, None to not record it
+stats_history_full_days = 7  # Keep every sample of the last xx days
+stats_history_downsample = 60  # Keep a sample every xx seconds (and the samples where a quota error or a transfer starts) after that
+stats_history_keep_days = 400  # Delete the days older than xx days
+
+# Capacity planner (--plan LISTING), simulates a job over a listing of its source without transferring anything,
+# with the switch rules, check_interval, sa_daily_quota and sa_quota_window above and this model of a rclone
+plan_sa_speed = 100 * pow(1024, 2)  # Bytes per second uploaded by a rclone (a server side copy can be much faster)
+plan_files_per_second = 2  # Files finished by a rclone per second at most (Drive API limits), 0 for no limit
+plan_start_time = 60  # Seconds a new rclone lists and checks before it transfers
+plan_batch_start_time = 5  # Seconds the rclone of a batch (--manifest) takes before it transfers
+
 # The script's temporary file
+shard_filter_path = r'/tmp/autorclone.shard.%s.filter'  # Top-level entries of the shard of each worker
+filter_path = r'/tmp/autorclone.filter.%s.txt'  # Filter file given with '--filter-from' to the rclone on rc port %s
 instance_lock_path = r'/tmp/autorclone.lock'
 instance_config_path = r'/tmp/autorclone.conf'
 
+# Service account quota ledger, it remembers what every SA uploaded to start with the one with the most quota left
+# The accounts are known by their email, hosts sharing the accounts can share the ledger on a shared filesystem
+quota_ledger_path = r'/tmp/autorclone.ledger'  # SQLite database
+sa_daily_quota = 750 * pow(1000, 3)  # Upload quota of a SA in the rolling window (750GB instead of 750GiB)
+sa_quota_window = 24 * 3600  # Length (s) of the rolling quota window
+quota_exhausted_rules = ['up_than_750', 'error_user_rate_limit']  # A switch by one of these rules marks the SA as exhausted
+
+# Service accounts, the json files are read once at start and the broken ones are quarantined, never given to rclone
+sa_preflight = False  # Get an access token with every key before the transfer starts (--preflight, needs google-auth)
+sa_token_uri = None  # Token endpoint of the preflight, None for the token_uri of each key
+sa_preflight_threads = 32  # Run the preflight of xx keys at once
+sa_preflight_timeout = 10  # Timeout (s) of a token request of the preflight
+
+# Service account leases (--leases), so that several hosts (or runs) sharing the accounts never use the same one at once
+# None keeps the accounts in use in the process, 'file:/shared/folder' uses a lease file per account in the folder,
+# 'sqlite:/shared/leases.db' a table of a SQLite database. A lease expires when its node stops renewing it (crash, lost network)
+sa_lease_backend = None
+sa_lease_ttl = 300  # A lease is held for xx seconds after its last renewal
+sa_lease_renew_interval = 60  # Renew the leases of the accounts in use every xx seconds
+
+# Daemon (--daemon QUEUE_DIR), a job is a json file in the queue folder, moved to QUEUE_DIR/done or QUEUE_DIR/failed when it ends
+# e.g. {"source": "remoteA:", "destination": "remoteB:backup", "mode": "copy", "priority": 10}
+# with the optional keys workers, shard_by, warm_standby, manifest, index, rate_control, verify (like the arguments)
+# and flags (added to rclone_flags). Write a job file as NAME.json.tmp and rename it to NAME.json, only *.json is read
+# and a file which can't be read is given some time to be written to the end before it is moved to QUEUE_DIR/failed
+daemon_state_dir = r'/tmp/autorclone.jobs'  # The state files and rclone logs of a job are kept in daemon_state_dir/<job file name>
+daemon_poll_interval = 5  # Look for new jobs every xx seconds
+daemon_job_write_time = 30  # A job file which can't be read is moved to failed/ xx seconds after it was last changed
+job_port_stride = 200  # The nth running job uses the rc ports from PORT + n * xx (its workers and their standby)
+
+# Prometheus metrics (--metrics-port)
+metrics_host = '0.0.0.0'  # Address the /metrics endpoint listens on
+metrics_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]  # Histogram buckets (s)
+
 # The script's run log
 script_log_file = r'/tmp/autorclone.log'
 logging_datefmt = "%m/%d/%Y %I:%M:%S %p"
@@ -98,47 +340,166 @@ logging_format = "%(asctime)s - %(levelname)s - %(funcName)s - %(message)s"
 
 # ------------ End of configuration items ------------------
 
-# Run variables
-instance_config = {}
-sa_jsons = []
-
-# Log related
-logFormatter = logging.Formatter(fmt=logging_format, datefmt=logging_datefmt)
-
-logger = logging.getLogger()
-logger.setLevel(logging.NOTSET)
-while logger.handlers:  # Remove un-format logging in Stream, or all of messages will appear more than once.
-    logger.handlers.pop()
-
-if script_log_file:
-    fileHandler = RotatingFileHandler(filename=script_log_file, mode='a',
-                                      backupCount=2, maxBytes=5 * 1024 * 1024,
-                                      encoding=None, delay=0)
-    fileHandler.setFormatter(logFormatter)
-    logger.addHandler(fileHandler)
-
-consoleHandler = logging.StreamHandler()
-consoleHandler.setFormatter(logFormatter)
-logger.addHandler(consoleHandler)
-
-
-def write_config(name, value):
-    instance_config[name] = value
-    with open(instance_config_path, 'w') as f:
-        json.dump(instance_config, f, sort_keys=True)
+# The configuration items above, the names configure() takes (an item added above is added here too)
+config_names = frozenset((
+    'rclone_bin', 'rclone_mode', 'rclone_flags', 'rclone_log_file', 'rclone_log_max_size', 'rclone_log_backups',
+    'log_follow_interval', 'check_interval', 'rclone_start_timeout', 'rclone_quit_timeout', 'rclone_term_timeout',
+    'rclone_stop_timeout', 'ready_backoff_initial', 'ready_backoff_max', 'standby_lead_time',
+    'standby_check_interval', 'standby_bwlimit', 'standby_port_offset', 'drain_switch_rules', 'drain_timeout',
+    'rc_host', 'rc_timeout', 'rc_retries', 'rc_retry_backoff', 'rc_max_failed_time', 'switch_sa_level',
+    'switch_sa_rules', 'switch_rules_path', 'stats_window_max_samples', 'rate_control_tpslimit',
+    'rate_control_transfers', 'rate_control_decrease', 'rate_control_step', 'rate_control_increase_after',
+    'rate_control_min_gain', 'rate_control_retry_after', 'rate_control_restart_after', 'switch_sa_way',
+    'rclone_config_path', 'rclone_dest_name', 'manifest_path', 'manifest_hashes', 'manifest_modtime_window',
+    'batch_files_path', 'destination_index_path', 'destination_index_max_age', 'drive_changes',
+    'transfer_journal_path', 'journal_exclude_max', 'verify_processes', 'verify_flags', 'verify_files_path',
+    'verify_result_path', 'verify_retry_path', 'stats_history_path', 'stats_history_full_days',
+    'stats_history_downsample', 'stats_history_keep_days', 'plan_sa_speed', 'plan_files_per_second',
+    'plan_start_time', 'plan_batch_start_time', 'shard_filter_path', 'filter_path', 'instance_lock_path',
+    'instance_config_path', 'quota_ledger_path', 'sa_daily_quota', 'sa_quota_window', 'quota_exhausted_rules',
+    'sa_preflight', 'sa_token_uri', 'sa_preflight_threads', 'sa_preflight_timeout', 'sa_lease_backend',
+    'sa_lease_ttl', 'sa_lease_renew_interval', 'daemon_state_dir', 'daemon_poll_interval', 'daemon_job_write_time',
+    'job_port_stride', 'metrics_host', 'metrics_buckets', 'script_log_file', 'logging_datefmt', 'logging_format',
+))
+
+# Run variables, shared by the jobs of the process
+sa_pool = None
+sa_in_use = set()
+sa_leases = None
+quota_ledger = None
+background_tasks = set()  # Keep a reference to the tasks which run until the end
+rule_engine = None
+supervisor = None  # The Supervisor running in the process
+
+# A program importing the script configures the logging itself, the command line logs to the console and script_log_file
+logger = logging.getLogger('autorclone')
+
+
+def setup_logging():
+    logFormatter = logging.Formatter(fmt=logging_format, datefmt=logging_datefmt)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.NOTSET)
+    while root_logger.handlers:  # Remove un-format logging in Stream, or all of messages will appear more than once.
+        root_logger.handlers.pop()
+
+    if script_log_file:
+        fileHandler = RotatingFileHandler(filename=script_log_file, mode='a',
+                                          backupCount=2, maxBytes=5 * 1024 * 1024,
+                                          encoding=None, delay=0)
+        fileHandler.setFormatter(logFormatter)
+        root_logger.addHandler(fileHandler)
+
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setFormatter(logFormatter)
+    root_logger.addHandler(consoleHandler)
+    logging.getLogger('urllib3').setLevel(logging.INFO)  # Not a line for every connection of the Service Account preflight
+
+
+# Set configuration items, e.g. configure(check_interval=5, rclone_flags='--fast-list'), before starting a Supervisor
+def configure(**items):
+    unknown = set(items) - config_names
+    if unknown:
+        raise TypeError('unknown configuration items: %s' % ', '.join(sorted(unknown)))
+    globals().update(items)
+
+
+# Name of a value in the state of a job for a worker, worker 0 keeps the names used before --workers existed
+def worker_config_key(name, worker_id):
+    if worker_id == 0:
+        return name
+    return '%s_%s' % (name, worker_id)
 
 
 # Get the next Service Account Credentials JSON file path
 def get_next_sa_json_path(_last_sa):
-    if _last_sa not in sa_jsons:  # Empty string or wrong sa_json_path
-        next_sa_index = 0
-    else:
-        _last_sa_index = sa_jsons.index(_last_sa)
-        next_sa_index = _last_sa_index + 1
-    # Exceed the list length and start from the beginning
-    if next_sa_index > len(sa_jsons):
-        next_sa_index = next_sa_index - len(sa_jsons)
-    return sa_jsons[next_sa_index]
+    return sa_pool.paths[sa_pool.get_next_index(_last_sa)]
+
+
+# The Service Accounts not used by another worker or node: the free ones with the most quota left first, then the
+# exhausted ones with the time they get their quota back, None when the leases can't be read
+# Accounts with the same quota left are taken in the order of the pool, starting after the last one
+def get_sa_candidates(_last_sa):
+    used = quota_ledger.get_used_bytes()
+    exhausted = quota_ledger.get_exhausted()
+    try:
+        leased = sa_leases.get_held_by_others()
+    except (OSError, sqlite3.Error) as error:
+        logger.warning('Can\'t read the Service Account leases: %s\n' % error)
+        return None
+    sa_paths = sa_pool.paths
+    start = sa_pool.get_next_index(_last_sa)
+    free_sas = []
+    exhausted_sas = []
+    for i in range(len(sa_paths)):
+        sa = sa_paths[(start + i) % len(sa_paths)]
+        email = sa_pool.get_email(sa)
+        if sa in sa_in_use or email in leased:
+            continue
+        if email in exhausted:
+            exhausted_sas.append((exhausted[email], i, sa))
+        else:
+            # The last account comes after all the others
+            free_sas.append((sa == _last_sa, -(sa_daily_quota - used.get(email, 0)), i, sa))
+    return [candidate[-1] for candidate in sorted(free_sas)], [(until, sa) for until, _, sa in sorted(exhausted_sas)]
+
+
+# Take the Service Account with the most quota left which is not used by another worker or node, and give back the last one
+# An exhausted account is only taken with allow_exhausted (for what doesn't upload), None when no account can be taken
+def acquire_next_sa_json_path(_last_sa, release_last=True, allow_exhausted=False):
+    if release_last:
+        release_sa_json_path(_last_sa)
+    candidates = get_sa_candidates(_last_sa)
+    if candidates is None:
+        return None
+    free_sas, exhausted_sas = candidates
+    if allow_exhausted:
+        free_sas += [sa for _, sa in exhausted_sas]
+
+    # Another node may lease the same account in the meantime, then take the next one
+    for next_sa in free_sas:
+        try:
+            if not sa_leases.acquire(sa_pool.get_email(next_sa)):
+                continue
+        except (OSError, sqlite3.Error) as error:
+            logger.warning('Can\'t lease %s: %s\n' % (next_sa, error))
+            continue
+        sa_in_use.add(next_sa)
+        return next_sa
+    return None  # All the accounts are exhausted or used by other workers or nodes
+
+
+def release_sa_json_path(sa):
+    if sa in sa_in_use:
+        sa_in_use.discard(sa)
+        try:
+            sa_leases.release(sa_pool.get_email(sa))
+        except (OSError, sqlite3.Error) as error:
+            logger.warning('Can\'t release the lease of %s: %s\n' % (sa, error))
+
+
+# Take the next Service Account, wait while all of them are used by the other workers and jobs
+# When the only accounts left are exhausted, wait until the first of them gets its quota back instead of using it
+async def acquire_next_sa_json_path_waiting(_last_sa, worker_logger, allow_exhausted=False):
+    next_sa = acquire_next_sa_json_path(_last_sa, allow_exhausted=allow_exhausted)
+    waiting = None
+    while next_sa is None:
+        candidates = get_sa_candidates(_last_sa)
+        if candidates and not candidates[0] and candidates[1]:
+            until = candidates[1][0][0]
+            if waiting != until:
+                worker_logger.warning('All Service Accounts are exhausted, wait until %s\n' % (
+                    time.strftime('%m/%d/%Y %I:%M:%S %p', time.localtime(until))))
+            waiting = until
+            await asyncio.sleep(max(until - time.time(), check_interval))
+        else:
+            if waiting != 'in use':
+                worker_logger.warning('All Service Accounts are in use or leased, wait for one to be released\n')
+            waiting = 'in use'
+            await asyncio.sleep(check_interval)
+        # Another worker may have taken it
+        next_sa = acquire_next_sa_json_path(_last_sa, release_last=False, allow_exhausted=allow_exhausted)
+    return next_sa
 
 
 def switch_sa_by_config(cur_sa):
@@ -162,181 +523,3162 @@ def switch_sa_by_config(cur_sa):
     logger.info('Change SA information in rclone.conf Success\n')
 
 
-def get_email_from_sa(sa):
-    return json.load(open(sa, 'r'))['client_email']
+class RcError(Exception):
+    pass
 
 
-# Forcibly kill Rclone
-def force_kill_rclone_subproc_by_parent_pid(sh_pid):
-    if psutil.pid_exists(sh_pid):
-        sh_proc = psutil.Process(sh_pid)
-        logger.info('Get The Process information - pid: %s, name: %s\n' % (sh_pid, sh_proc.name()))
-        for child_proc in sh_proc.children():
-            if child_proc.name().find('rclone') > -1:
-                logger.info('Force Killed rclone process which pid: %s\n' % child_proc.pid)
-                child_proc.kill()
-                logger.info('Waiting %s seconds before restarting\n' % check_after_restart)
-                time.sleep(check_after_restart)
+# Client of the rclone rc HTTP API, it keeps one connection open to the '--rc-addr' endpoint
+class RcClient:
+    def __init__(self, port, host=None, timeout=None, retries=None, retry_backoff=None):
+        # The configuration items are read here, configure() may have changed them since the script was loaded
+        self.host = rc_host if host is None else host
+        self.port = port
+        self.timeout = rc_timeout if timeout is None else timeout
+        self.retries = rc_retries if retries is None else retries
+        self.retry_backoff = rc_retry_backoff if retry_backoff is None else retry_backoff
+        self._reader = None
+        self._writer = None
 
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
 
-if __name__ == '__main__':
-    instance_check = filelock.FileLock(instance_lock_path)
+    async def _read_body(self, headers):
+        if headers.get('transfer-encoding', '').lower() != 'chunked':
+            return await self._reader.readexactly(int(headers.get('content-length', 0)))
+        body = b''
+        while True:
+            size = int((await self._reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await self._reader.readline()).strip():
+                    pass  # Trailers
+                return body
+            body += await self._reader.readexactly(size)
+            await self._reader.readline()
+
+    async def _request(self, method, params):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(params or {}).encode('utf-8')
+        self._writer.write(('POST /%s HTTP/1.1\r\nHost: %s:%s\r\nContent-Type: application/json\r\n'
+                            'Content-Length: %s\r\n\r\n' % (method, self.host, self.port, len(body))).encode('ascii') + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('rc closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self._reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await self._read_body(headers)
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        if status != 200:
+            raise RcError('rc %s returned HTTP %s: %s' % (method, status, data.decode('utf-8', 'replace')))
+        return json.loads(data.decode('utf-8'))
+
+    # Call a rc method, retry on connection errors and return the decoded json response
+    async def call(self, method, params=None, retries=None):
+        retries = self.retries if retries is None else retries
+        delay = self.retry_backoff
+        attempt = 0
+        while True:
+            time_request = time.time()
+            try:
+                response_json = await asyncio.wait_for(self._request(method, params), self.timeout)
+                metrics.observe('autorclone_rc_request_duration_seconds', time.time() - time_request, method=method)
+                return response_json
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError, RcError) as error:
+                metrics.inc('autorclone_rc_failures_total', method=method)
+                # The connection may be broken (rclone restarted, keep-alive closed), open a new one next time
+                self.close()
+                attempt += 1
+                if attempt > retries:
+                    raise RcError('rc %s failed after %s attempts: %s' % (method, attempt, error or type(error).__name__))
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def stats(self):
+        return await self.call('core/stats')
+
+    async def pid(self):
+        return (await self.call('core/pid')).get('pid')
+
+    async def memstats(self):
+        return await self.call('core/memstats')
+
+    async def quit(self, exit_code=0):
+        try:
+            await self.call('core/quit', {'exitCode': exit_code}, retries=0)
+        except RcError:
+            pass  # rclone may exit before answering
+        finally:
+            self.close()
+
+
+# The usable Service Accounts in the order they are taken, looked up by json file path or by email
+class SaPool:
+    def __init__(self, accounts):
+        self.emails = {}  # json file path -> client_email
+        self.paths = []
+        for path, info in accounts:
+            self.emails[path] = info['client_email']
+            self.paths.append(path)
+        self.by_email = {email: path for path, email in self.emails.items()}
+        self.position = {path: i for i, path in enumerate(self.paths)}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.position
+
+    def get_email(self, path):
+        return self.emails.get(path, '')
+
+    def get_path(self, email):
+        return self.by_email.get(email)
+
+    # Index of the account after this one, the first one for an unknown path
+    def get_next_index(self, path):
+        if path not in self.position:
+            return 0
+        return (self.position[path] + 1) % len(self.paths)
+
+    # Start the order with this account
+    def rotate(self, path):
+        start = self.position[path]
+        self.paths = self.paths[start:] + self.paths[:start]
+        self.position = {path: i for i, path in enumerate(self.paths)}
+
+
+# Leases of the Service Accounts used by this node (a process of a host), by email
+# The base class only knows the accounts of this process, the subclasses share the leases with the other nodes
+class SaLeases:
+    kind = None
+
+    def __init__(self, location, node, ttl):
+        self.location = location
+        self.node = node
+        self.ttl = ttl
+
+    # Take the lease of an account, False when another node holds it
+    def acquire(self, email):
+        return True
+
+    # Extend the leases of this node, return the emails of the ones which are lost
+    def renew(self, emails):
+        return []
+
+    def release(self, email):
+        pass
+
+    # Emails of the accounts leased by other nodes
+    def get_held_by_others(self):
+        return set()
+
+    def close(self):
+        pass
+
+
+# A lease file per account in a shared folder, with the node which holds it and when it expires
+class FileSaLeases(SaLeases):
+    kind = 'file'
+
+    def __init__(self, location, node, ttl):
+        SaLeases.__init__(self, location, node, ttl)
+        os.makedirs(location, exist_ok=True)
+
+    def _get_path(self, email):
+        return os.path.join(self.location, email + '.lease')
+
+    # Node and expiry of a lease, a file being written (or left empty by a crash) expires ttl after it was created
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                lease = json.load(f)
+            return lease['node'], lease['expires']
+        except (ValueError, KeyError, TypeError):
+            try:
+                return None, os.stat(path).st_mtime + self.ttl
+            except OSError:
+                return None
+        except OSError:
+            return None
+
+    def _write(self, path):
+        tmp_path = '%s.%s.tmp' % (path, self.node)
+        with open(tmp_path, 'w') as f:
+            json.dump({'node': self.node, 'expires': time.time() + self.ttl}, f)
+        os.replace(tmp_path, path)
+
+    def acquire(self, email):
+        path = self._get_path(email)
+        lease = self._read(path)
+        if lease is not None:
+            if lease[0] == self.node:
+                self._write(path)
+                return True
+            if lease[1] > time.time():
+                return False
+            # The lease has expired, only the node which renames it away can take the account
+            stale_path = '%s.%s.stale' % (path, self.node)
+            try:
+                os.rename(path, stale_path)
+            except OSError:
+                return False
+            # The holder may have renewed it (or another node taken it) between the read and the rename, give it back
+            if self._read(stale_path) != lease:
+                try:
+                    os.link(stale_path, path)
+                except OSError:
+                    pass  # The holder has written it again in the meantime
+                os.remove(stale_path)
+                return False
+            os.remove(stale_path)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'node': self.node, 'expires': time.time() + self.ttl}, f)
+        return True
+
+    def renew(self, emails):
+        lost = []
+        for email in emails:
+            path = self._get_path(email)
+            lease = self._read(path)
+            # Another node may be taking over an expired lease, it isn't renewed
+            if lease is None or lease[0] != self.node or lease[1] <= time.time():
+                lost.append(email)
+            else:
+                self._write(path)
+        return lost
+
+    def release(self, email):
+        path = self._get_path(email)
+        lease = self._read(path)
+        if lease is not None and lease[0] == self.node:
+            os.remove(path)
+
+    def get_held_by_others(self):
+        held = set()
+        now = time.time()
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.lease'):
+                lease = self._read(entry.path)
+                if lease is not None and lease[0] != self.node and lease[1] > now:
+                    held.add(entry.name[:-len('.lease')])
+        return held
+
+
+# A table of leases in a shared SQLite database, a lease is taken or renewed in a single statement
+class SqliteSaLeases(SaLeases):
+    kind = 'sqlite'
+
+    def __init__(self, location, node, ttl):
+        SaLeases.__init__(self, location, node, ttl)
+        self._lock = threading.Lock()  # Renewed from a thread of the executor
+        self._db = sqlite3.connect(location, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS leases (sa TEXT PRIMARY KEY, node TEXT, expires REAL)')
+
+    def acquire(self, email):
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute('INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (sa) DO UPDATE SET '
+                                      'node = excluded.node, expires = excluded.expires '
+                                      'WHERE leases.node = excluded.node OR leases.expires < ?',
+                                      (email, self.node, now + self.ttl, now))
+            return cursor.rowcount == 1
+
+    def renew(self, emails):
+        lost = []
+        with self._lock, self._db:
+            for email in emails:
+                cursor = self._db.execute('UPDATE leases SET expires = ? WHERE sa = ? AND node = ?',
+                                          (time.time() + self.ttl, email, self.node))
+                if cursor.rowcount != 1:
+                    lost.append(email)
+        return lost
+
+    def release(self, email):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM leases WHERE sa = ? AND node = ?', (email, self.node))
+
+    def get_held_by_others(self):
+        with self._lock:
+            rows = self._db.execute('SELECT sa FROM leases WHERE node != ? AND expires > ?', (self.node, time.time()))
+            return set(row[0] for row in rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+sa_lease_kinds = {leases.kind: leases for leases in (FileSaLeases, SqliteSaLeases)}
+
+
+# Leases of a backend such as 'file:/shared/folder' or 'sqlite:/shared/leases.db', only in this process for None
+def open_sa_leases(backend):
+    node = '%s:%s' % (socket.gethostname(), os.getpid())
+    if not backend:
+        return SaLeases(None, node, sa_lease_ttl)
+    kind, _, location = backend.partition(':')
+    if kind not in sa_lease_kinds or not location:
+        raise ValueError('unknown lease backend %r, use %s' % (
+            backend, ' or '.join('%s:PATH' % kind for kind in sorted(sa_lease_kinds))))
+    logger.info('Lease the Service Accounts in %s as %s\n' % (backend, node))
+    return sa_lease_kinds[kind](location, node, sa_lease_ttl)
+
+
+# Renew the leases of the accounts in use while they transfer
+async def renew_sa_leases():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(sa_lease_renew_interval)
+        emails = [sa_pool.get_email(sa) for sa in sa_in_use]
+        try:
+            lost = await loop.run_in_executor(None, sa_leases.renew, emails)
+        except (OSError, sqlite3.Error) as error:
+            logger.warning('Can\'t renew the Service Account leases: %s\n' % error)
+            continue
+        for email in lost:
+            logger.error('The lease of %s has been lost, another node may use it at the same time\n' % email)
+
+
+# What is wrong with the content of a Service Account json file, None when rclone can use it
+def check_sa_info(info):
+    if not isinstance(info, dict):
+        return 'not a json object'
+    if info.get('type') != 'service_account':
+        return 'type is %r instead of service_account' % info.get('type')
+    for key in ('client_email', 'private_key', 'token_uri'):
+        if not isinstance(info.get(key), str) or not info[key]:
+            return 'no %s' % key
+    return None
+
+
+_preflight_local = threading.local()
+
+
+# Credentials of a Service Account for the preflight
+# The RSA key isn't validated when it is loaded (60ms each, holding the GIL), the token endpoint checks the signature anyway
+def get_sa_credentials(info, token_uri):
+    from google.auth.crypt import RSASigner
+    from google.oauth2.service_account import Credentials
+    try:
+        from cryptography.hazmat.primitives import serialization
+        private_key = serialization.load_pem_private_key(info['private_key'].encode('utf-8'), password=None,
+                                                         unsafe_skip_rsa_key_validation=True)
+        signer = RSASigner(private_key, info.get('private_key_id'))
+    except (ImportError, TypeError):  # No cryptography (google-auth uses python-rsa) or an older one
+        signer = RSASigner.from_string(info['private_key'], info.get('private_key_id'))
+    return Credentials(signer, info['client_email'], token_uri, scopes=['https://www.googleapis.com/auth/drive'])
+
+
+# Get an access token with a Service Account, return why it failed and if the account is broken (not a network error)
+def preflight_sa(info):
+    from google.auth.exceptions import RefreshError, TransportError
+    from google.auth.transport.requests import Request
+
+    if not hasattr(_preflight_local, 'request'):
+        _preflight_local.request = Request()  # A session per thread reuses its connection to the token endpoint
+    try:
+        credentials = get_sa_credentials(info, sa_token_uri or info['token_uri'])
+        credentials.refresh(lambda *a, **kw: _preflight_local.request(*a, timeout=sa_preflight_timeout, **kw))
+    except (ValueError, KeyError) as error:
+        return 'bad private key: %s' % error, True
+    except RefreshError as error:
+        return 'token refused: %s' % error, not getattr(error, 'retryable', False)
+    except TransportError as error:
+        return 'token endpoint unreachable: %s' % error, False
+    return None, False
+
+
+# Read the Service Account json files once, quarantine the ones which are broken, duplicated or refused by the token endpoint
+def load_sa_pool(folder):
+    accounts = []
+    quarantined = {}
+    emails = {}
+    for path in sorted(glob.glob(os.path.join(folder, '*.json'))):
+        try:
+            with open(path) as f:
+                info = json.load(f)
+        except (OSError, ValueError) as error:
+            quarantined[path] = 'unreadable: %s' % error
+            continue
+        problem = check_sa_info(info)
+        if problem is None and info['client_email'] in emails:
+            problem = 'same client_email as %s' % emails[info['client_email']]
+        if problem is not None:
+            quarantined[path] = problem
+            continue
+        emails[info['client_email']] = path
+        accounts.append((path, info))
+
+    if sa_preflight and accounts:
+        logger.info('Preflight of %s Service Accounts\n' % len(accounts))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=sa_preflight_threads) as executor:
+                results = list(executor.map(lambda account: preflight_sa(account[1]), accounts))
+        except ImportError:
+            logger.warning('google-auth isn\'t installed, skip the preflight of the Service Accounts\n')
+            results = []
+        # The same refusal for every key is a problem of this host (e.g. its clock), not of the keys
+        problems = set(problem for problem, _ in results)
+        if len(results) > 1 and len(problems) == 1 and all(broken for _, broken in results):
+            raise ValueError('The preflight failed for every Service Account with: %s' % problems.pop())
+        unreachable = 0
+        for (path, _), (problem, broken) in zip(accounts, results):
+            if broken:
+                quarantined[path] = problem
+            elif problem is not None:
+                unreachable += 1
+        if unreachable:
+            logger.warning('The preflight of %s Service Accounts failed on the token endpoint, they are kept\n'
+                           % unreachable)
+        accounts = [account for account in accounts if account[0] not in quarantined]
+
+    for path, problem in sorted(quarantined.items()):
+        logger.warning('Quarantine %s: %s\n' % (path, problem))
+    metrics.set('autorclone_service_accounts', len(accounts), state='usable')
+    metrics.set('autorclone_service_accounts', len(quarantined), state='quarantined')
+    return SaPool(accounts)
+
+
+# Bytes uploaded by every Service Account (by email), stored per minute in a SQLite database
+class QuotaLedger:
+    def __init__(self, path, window=None):
+        self.window = window = sa_quota_window if window is None else window
+        self._db = sqlite3.connect(path, timeout=30)  # Other hosts may write to a shared ledger
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS usage (sa TEXT, ts INTEGER, bytes INTEGER, PRIMARY KEY (sa, ts))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS exhausted (sa TEXT PRIMARY KEY, until REAL)')
+            # Forget what is out of the window
+            self._db.execute('DELETE FROM usage WHERE ts < ?', (time.time() - window,))
+            self._db.execute('DELETE FROM exhausted WHERE until < ?', (time.time(),))
+
+    def close(self):
+        self._db.close()
+
+    # Add bytes uploaded by a SA
+    def record(self, sa, size, ts=None):
+        minute = int((ts or time.time()) // 60 * 60)
+        with self._db:
+            self._db.execute('INSERT INTO usage VALUES (?, ?, ?) '
+                             'ON CONFLICT (sa, ts) DO UPDATE SET bytes = bytes + excluded.bytes', (sa, minute, size))
+
+    # Mark a SA as out of quota until the window is over, a later time it was already marked until is kept
+    def mark_exhausted(self, sa, until=None):
+        with self._db:
+            self._db.execute('INSERT INTO exhausted VALUES (?, ?) '
+                             'ON CONFLICT (sa) DO UPDATE SET until = MAX(until, excluded.until)',
+                             (sa, until or time.time() + self.window))
+
+    # Bytes uploaded by every SA in the window
+    def get_used_bytes(self):
+        rows = self._db.execute('SELECT sa, SUM(bytes) FROM usage WHERE ts >= ? GROUP BY sa',
+                                (time.time() - self.window,)).fetchall()
+        return dict(rows)
+
+    # Exhausted SA and the time they get their quota back
+    def get_exhausted(self):
+        rows = self._db.execute('SELECT sa, until FROM exhausted WHERE until > ?', (time.time(),)).fetchall()
+        return dict(rows)
+
+
+# Counters, gauges and histograms shown in the Prometheus text format
+class Metrics:
+    def __init__(self):
+        self._kinds = {}
+        self._help = {}
+        self._values = {}  # name -> {labels: value}, a histogram value is [bucket counts, sum, count]
+
+    def define(self, name, kind, help_text):
+        self._kinds[name] = kind
+        self._help[name] = help_text
+        self._values[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[name][key] = self._values[name].get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        histogram = self._values[name].setdefault(key, [[0] * len(metrics_buckets), 0, 0])
+        for i, bucket in enumerate(metrics_buckets):
+            if value <= bucket:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for name, value in labels)
+
+    def render(self):
+        lines = []
+        for name, kind in self._kinds.items():
+            lines.append('# HELP %s %s' % (name, self._help[name]))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(self._values[name].items()):
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (name, self._format_labels(labels), value))
+                    continue
+                for bucket, bucket_count in zip(metrics_buckets, value[0]):
+                    lines.append('%s_bucket%s %s' % (name, self._format_labels(labels + (('le', bucket),)), bucket_count))
+                lines.append('%s_bucket%s %s' % (name, self._format_labels(labels + (('le', '+Inf'),)), value[2]))
+                lines.append('%s_sum%s %s' % (name, self._format_labels(labels), value[1]))
+                lines.append('%s_count%s %s' % (name, self._format_labels(labels), value[2]))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.define('autorclone_transferred_bytes_total', 'counter', 'Bytes transferred by rclone.')
+metrics.define('autorclone_transferred_files_total', 'counter', 'Files transferred by rclone.')
+metrics.define('autorclone_speed_bytes', 'gauge', 'Average transfer speed of the current rclone in bytes per second.')
+metrics.define('autorclone_transferring', 'gauge', 'Transfers in progress in the current rclone.')
+metrics.define('autorclone_service_accounts', 'gauge', 'Service accounts of the pool, by state (usable or quarantined).')
+metrics.define('autorclone_sa_used_bytes', 'gauge', 'Bytes uploaded by a service account in the quota window.')
+metrics.define('autorclone_switches_total', 'counter', 'Service account switches, by way (standby or restart).')
+metrics.define('autorclone_switch_reasons_total', 'counter', 'Rules of switch_sa_rules which made a switch.')
+metrics.define('autorclone_switch_downtime_seconds', 'histogram',
+               'Time from the switch decision until the next rclone transfers.')
+metrics.define('autorclone_rc_request_duration_seconds', 'histogram', 'Duration of the successful rc requests.')
+metrics.define('autorclone_rc_failures_total', 'counter', 'Failed rc requests (before retrying).')
+metrics.define('autorclone_tpslimit', 'gauge', 'tpslimit of the current rclone set by the rate control.')
+metrics.define('autorclone_transfers_limit', 'gauge', 'Transfers of the current rclone set by the rate control.')
+metrics.define('autorclone_rclone_rss_bytes', 'gauge', 'Resident memory of the current rclone process.')
+
+
+# Answer the scrapes of the /metrics endpoint
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()).strip():
+            pass  # Headers
+        if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?')[0] == '/metrics':
+            for email, used in quota_ledger.get_used_bytes().items():
+                metrics.set('autorclone_sa_used_bytes', used, sa=email)
+            status, body = '200 OK', metrics.render().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                      'Content-Length: %s\r\nConnection: close\r\n\r\n' % (status, len(body))).encode('ascii') + body)
+        await writer.drain()
+    except (OSError, UnicodeError) as error:
+        logger.debug('Metrics request failed: %s\n' % error)
+    finally:
+        writer.close()
+
+
+# Parse a line of the rclone log (json with '--use-json-log' or text) into an event
+# The event type is 'quota' (daily limit of the SA), 'rate_limit' (other 403), 'retry', 'copied' (a file is done),
+# 'error' or None for the other lines
+def parse_rclone_log_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        level, obj, msg = entry.get('level', ''), entry.get('object', ''), entry.get('msg', '')
+    else:
+        match = re.match(r'^\d{4}/\d\d/\d\d \d\d:\d\d:\d\d(?:\.\d+)? (\w+)\s*: (?:(.+?): )?(.*)$', line)
+        if match is None:
+            return None
+        level, obj, msg = match.group(1).lower(), match.group(2) or '', match.group(3)
+
+    if 'userRateLimitExceeded' in msg or 'dailyLimitExceeded' in msg:
+        event_type = 'quota'
+    elif 'rateLimitExceeded' in msg or 'Error 403' in msg:
+        event_type = 'rate_limit'
+    elif 'low level retry' in msg or re.search(r'Attempt \d+/\d+ failed', msg):
+        event_type = 'retry'
+    elif obj and (msg.startswith('Copied') or msg.startswith('Moved')):
+        event_type = 'copied'
+    elif level == 'error':
+        event_type = 'error'
+    else:
+        event_type = None
+    return {'type': event_type, 'level': level, 'object': obj, 'msg': msg}
+
+
+# Follow the rclone log from a position (inode, offset) and put the parsed events into a queue
+# It goes on with the new file when the log is rotated and from the start when it is truncated
+class LogFollower:
+    def __init__(self, path, position=None):
+        self.path = path
+        self.events = asyncio.Queue()
+        self._file = None
+        self._inode = None
+        self._buffer = b''
+        self._task = None
+        self._open(position)
+
+    def _open(self, position=None):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._buffer = b''
+        if position is None:
+            return
+        inode, offset = position
+        if inode == self._inode and offset <= os.fstat(self._file.fileno()).st_size:
+            self._file.seek(offset)
+        elif inode is not None:
+            self._file.seek(0, os.SEEK_END)  # Another log, skip what was written before
+
+    # Current position, to go on from there next time
+    def get_position(self):
+        if self._file is None:
+            return None
+        return [self._inode, self._file.tell() - len(self._buffer)]
+
+    def _read_lines(self):
+        data = self._file.read()
+        if not data:
+            return
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            event = parse_rclone_log_line(line.decode('utf-8', 'replace'))
+            if event is not None and event['type'] is not None:
+                self.events.put_nowait(event)
+
+    # Read everything which was written to the log until now
+    def read(self):
+        if self._file is None:
+            self._open()
+            if self._file is None:
+                return
+        self._read_lines()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return  # Rotated, the new log isn't created yet
+        if stat.st_ino != self._inode:
+            self._read_lines()  # The rest of the rotated log
+            self._open()
+            self._read_lines()
+        elif stat.st_size < self._file.tell():
+            self._file.seek(0)  # Truncated
+            self._buffer = b''
+            self._read_lines()
+
+    # Forget the events which are not handled yet
+    def clear(self):
+        self.read()
+        while not self.events.empty():
+            self.events.get_nowait()
+
+    # Follow another log from its end, the log of a standby rclone which takes over
+    def follow(self, path):
+        self.path = path
+        self._open()
+        if self._file is not None:
+            self._file.seek(0, os.SEEK_END)
+
+    async def _run(self):
+        while True:
+            try:
+                self.read()
+            except OSError as error:
+                logger.warning('Can\'t read the rclone log %s: %s\n' % (self.path, error))
+            await asyncio.sleep(log_follow_interval)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# The last core/stats samples of a rclone, with the counts of the events of its log
+class StatsWindow:
+    def __init__(self, keep_time, max_samples=None):
+        self.keep_time = keep_time
+        self.samples = collections.deque(maxlen=stats_window_max_samples if max_samples is None else max_samples)
+
+    def add(self, response_json, log_events, ts=None):
+        # Handle the case where `bytes` or` speed` does not exist (the transfer is considered complete) @ yezi1000
+        active = any(transfer.get('bytes', 0) != 0 and transfer.get('speed', 0) > 0
+                     for transfer in response_json.get('transferring') or [])
+        sample = {
+            't': ts or time.time(),
+            'bytes': response_json.get('bytes', 0),
+            'speed': response_json.get('speed', 0),
+            'errors': response_json.get('errors', 0),
+            'transfers': response_json.get('transfers', 0),
+            'last_error': response_json.get('lastError', '') or '',
+            'active': active,
+            'log': dict(log_events),
+        }
+        self.samples.append(sample)
+        # Forget what no rule looks at anymore, but keep one sample from before the longest window
+        # and the check before the last one (new errors are seen by comparing them)
+        while len(self.samples) > 2 and self.samples[1]['t'] <= sample['t'] - self.keep_time:
+            self.samples.popleft()
+
+    def last(self):
+        return self.samples[-1]
+
+    # The newest sample taken `window` seconds before the last one, None if the samples don't go back that far
+    def since(self, window):
+        time_from = self.samples[-1]['t'] - window
+        for sample in reversed(self.samples):
+            if sample['t'] <= time_from:
+                return sample
+        return None
+
+    # The samples of the last `window` seconds
+    def within(self, window):
+        time_from = self.samples[-1]['t'] - window
+        return [sample for sample in self.samples if sample['t'] >= time_from]
+
+
+# A rule which makes a switch to the next SA, see switch_sa_rules
+class SwitchRule:
+    kind = None
+
+    def __init__(self, name, weight=1, enabled=True, window=0, log_events=None):
+        self.name = name
+        self.weight = weight
+        self.enabled = enabled
+        self.window = window
+        self.log_events = log_events or []
+
+    def check(self, stats_window, sa_left):
+        raise NotImplementedError
+
+    # Count of the log events of the rule in the window
+    def count_log_events(self, stats_window):
+        last = stats_window.last()
+        base = stats_window.since(self.window) if self.window else None
+        return sum(last['log'].get(event, 0) - (base['log'].get(event, 0) if base else 0) for event in self.log_events)
+
+
+class QuotaUsedRule(SwitchRule):
+    kind = 'quota_used'
+
+    def check(self, stats_window, sa_left):
+        return sa_left < 0
+
+
+class QuotaForecastRule(SwitchRule):
+    kind = 'quota_forecast'
+
+    def __init__(self, name, polls=1, **kwargs):
+        super().__init__(name, **kwargs)
+        self.polls = polls
+
+    def check(self, stats_window, sa_left):
+        samples = stats_window.samples
+        speed = stats_window.last()['speed']
+        if len(samples) > 1 and samples[-1]['t'] > samples[-2]['t']:
+            speed = (samples[-1]['bytes'] - samples[-2]['bytes']) / (samples[-1]['t'] - samples[-2]['t'])
+        return sa_left <= speed * check_interval * self.polls
+
+
+class ErrorMessageRule(SwitchRule):
+    kind = 'error_message'
+
+    def __init__(self, name, pattern=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def check(self, stats_window, sa_left):
+        if self.pattern and self.pattern.search(stats_window.last()['last_error']):
+            return True
+        return self.count_log_events(stats_window) > 0
+
+
+class ErrorRateRule(SwitchRule):
+    kind = 'error_rate_above'
+
+    def __init__(self, name, rate, window=60, **kwargs):
+        super().__init__(name, window=window, **kwargs)
+        self.rate = rate
+
+    def check(self, stats_window, sa_left):
+        base = stats_window.since(self.window)
+        if base is None:
+            return False
+        last = stats_window.last()
+        if self.log_events:
+            errors = self.count_log_events(stats_window)
+        else:
+            errors = last['errors'] - base['errors']
+        return errors * 60 / (last['t'] - base['t']) > self.rate
+
+
+class SpeedBelowRule(SwitchRule):
+    kind = 'speed_below'
 
-    # Start Time
-    time_start = time.time()
-    str_timeStart = "Started at: {}\n".format(time.strftime("%H:%M:%S"))
-    logger.info(str_timeStart) # Log the start time
+    def __init__(self, name, speed, window=60, **kwargs):
+        super().__init__(name, window=window, **kwargs)
+        self.speed = speed
 
-    with instance_check.acquire(timeout=0):
-        # Load account information
-        sa_jsons = glob.glob(os.path.join(args.service_accounts, '*.json'))
-        if len(sa_jsons) == 0:
-            logger.error('No Service Account Credentials JSON file exists.\n')
-            exit(1)
+    def check(self, stats_window, sa_left):
+        base = stats_window.since(self.window)
+        if base is None:
+            return False
+        last = stats_window.last()
+        return (last['bytes'] - base['bytes']) / (last['t'] - base['t']) <= self.speed
 
-        # Load instance configuration
-        if os.path.exists(instance_config_path):
-            logger.info('Instance config exist, Load it...\n')
-            config_raw = open(instance_config_path).read()
-            instance_config = json.loads(config_raw)
 
-        # Check the last recorded pid information
-        if 'last_pid' in instance_config:
-            last_pid = instance_config.get('last_pid')
-            logger.debug('Last PID exist, Start to check if it is still alive\n')
-            force_kill_rclone_subproc_by_parent_pid(last_pid)
+class TransfersIdleRule(SwitchRule):
+    kind = 'transfers_idle'
 
-        # Check the sa information recorded last time, if any, rearrange sa_jsons
-        # So we start with a new 750G every time
-        last_sa = instance_config.get('last_sa', '')
-        if last_sa in sa_jsons:
-            logger.info('Get `last_sa` from config, resort list `sa_jsons`\n')
-            last_sa_index = sa_jsons.index(last_sa)
-            sa_jsons = sa_jsons[last_sa_index:] + sa_jsons[:last_sa_index]
+    def check(self, stats_window, sa_left):
+        if self.window and stats_window.since(self.window) is None:
+            return False
+        return not any(sample['active'] for sample in stats_window.within(self.window))
+
+
+switch_rule_kinds = {rule.kind: rule for rule in (QuotaUsedRule, QuotaForecastRule, ErrorMessageRule, ErrorRateRule,
+                                                  SpeedBelowRule, TransfersIdleRule)}
+
+
+# Weigh the rules which are hit against the switch level
+class RuleEngine:
+    def __init__(self, rules, level):
+        self.level = level
+        self.rules = []
+        for rule in rules:
+            rule = dict(rule)
+            kind = rule.pop('kind', None)
+            if kind not in switch_rule_kinds:
+                raise ValueError('Unknown kind `%s` of the switch rule `%s`' % (kind, rule.get('name')))
+            rule = switch_rule_kinds[kind](**rule)
+            if rule.enabled:
+                self.rules.append(rule)
+        self.max_window = max([rule.window for rule in self.rules] + [0])
+        # A new event of these types in the rclone log makes a check right away
+        self.log_event_types = set(event for rule in self.rules for event in rule.log_events)
+
+    def new_window(self):
+        return StatsWindow(self.max_window)
 
-        # Fixed cmd_rclone to prevent missing `--rc`
-        if cmd_rclone.find('--rc') == -1:
-            logger.warning('Lost important param `--rc` in rclone commands, AutoAdd it.\n')
-            cmd_rclone += ' --rc'
+    # Return the weight of the rules hit and their names
+    def evaluate(self, stats_window, sa_left):
+        rules_hit = [rule for rule in self.rules if rule.check(stats_window, sa_left)]
+        return sum(rule.weight for rule in rules_hit), [rule.name for rule in rules_hit]
 
-        # Rclone port number
-        cmd_rclone += " --rc-addr=:{}".format(args.port)
+    def should_switch(self, weight):
+        return weight >= self.level
 
+
+# Read the switch rules from a json file if there is one
+def load_rule_engine(path):
+    if path:
+        logger.info('Load the switch rules from %s\n' % path)
+        with open(path) as f:
+            rules_config = json.load(f)
+        return RuleEngine(rules_config.get('switch_sa_rules', switch_sa_rules),
+                          rules_config.get('switch_sa_level', switch_sa_level))
+    return RuleEngine(switch_sa_rules, switch_sa_level)
+
+
+# Forcibly kill Rclone, return the killed processes
+def force_kill_rclone_subproc_by_parent_pid(sh_pid):
+    import psutil
+    killed_procs = []
+    if psutil.pid_exists(sh_pid):
+        sh_proc = psutil.Process(sh_pid)
+        logger.info('Get The Process information - pid: %s, name: %s\n' % (sh_pid, sh_proc.name()))
+        # rclone is started without a shell, sh_pid is rclone itself (unless an older version of the script started it)
+        for child_proc in [sh_proc] + sh_proc.children():
+            if child_proc.name().find('rclone') > -1:
+                logger.info('Force Killed rclone process which pid: %s\n' % child_proc.pid)
+                child_proc.kill()
+                killed_procs.append(child_proc)
+    return killed_procs
+
+
+# Wait until killed processes which are not children of the script have exited
+async def wait_procs_exit(procs):
+    import psutil
+    time_start = time.time()
+    while procs and time.time() - time_start < rclone_stop_timeout:
+        _, procs = psutil.wait_procs(procs, timeout=0)
+        await asyncio.sleep(0.05)
+    for child_proc in procs:
+        logger.error('rclone process %s is still alive %s seconds after it was killed\n' % (child_proc.pid, rclone_stop_timeout))
+
+
+# Start rclone from its command (a list of arguments), without a shell, in a process group of its own
+async def start_rclone(cmd):
+    return await asyncio.create_subprocess_exec(*cmd, start_new_session=True)
+
+
+# The value of a flag of a rclone command, given as '--name value' or '--name=value', None when it isn't there
+def get_rclone_flag(cmd, name):
+    for i, arg in enumerate(cmd):
+        if arg == name and i + 1 < len(cmd):
+            return cmd[i + 1]
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return None
+
+
+# The rclone command without the flags `names` and their values
+def remove_rclone_flags(cmd, names):
+    result = []
+    args = iter(cmd)
+    for arg in args:
+        if arg in names:
+            next(args, None)
+        elif arg.split('=', 1)[0] not in names:
+            result.append(arg)
+    return result
+
+
+# The rclone command with `copy` instead of `sync`, for the file lists which can't delete the extra files of the destination
+def get_copy_cmd(cmd):
+    if 'sync' not in cmd:
+        return list(cmd)
+    i = cmd.index('sync')
+    return cmd[:i] + ['copy'] + cmd[i + 1:]
+
+
+# Wait at most timeout seconds for a process of the script to exit, return True if it has exited
+async def wait_proc_exit(proc, timeout):
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+# Stop the rclone started by `proc` and wait for it to exit, so that its rc port is free for the next one
+# rc 'core/quit' first when rclone has a rc port, then SIGTERM to its process group, SIGKILL only when it is still there
+async def stop_rclone(proc, port=None):
+    if proc.returncode is None and port is not None:
+        await RcClient(port, retries=0).quit()
+        if await wait_proc_exit(proc, rclone_quit_timeout):
+            return
+        logger.warning('rclone %s has not quit in %s seconds, send SIGTERM\n' % (proc.pid, rclone_quit_timeout))
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        if await wait_proc_exit(proc, rclone_term_timeout):
+            return
+        logger.warning('rclone %s is still alive %s seconds after SIGTERM, kill it\n' % (proc.pid, rclone_term_timeout))
+    if proc.returncode is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    if not await wait_proc_exit(proc, rclone_stop_timeout):
+        logger.error('rclone process %s is still alive %s seconds after it was killed\n' % (proc.pid, rclone_stop_timeout))
+
+
+# Wait until the rc of rclone answers, return False if rclone has exited or rc doesn't answer in rclone_start_timeout
+async def wait_rclone_ready(proc, rc):
+    time_start = time.time()
+    delay = ready_backoff_initial
+    while proc.returncode is None:
+        try:
+            await rc.call('rc/noop', retries=0)
+            return True
+        except RcError:
+            if time.time() - time_start > rclone_start_timeout:
+                return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, ready_backoff_max)
+    return False
+
+
+# AIMD controller of the tpslimit and the transfers of the rclone processes of a worker, see rate_control_*
+# rclone only reads them when it starts: the controller follows the rate limit errors and the speed of the current
+# rclone, a rate limit error restarts it with lower values, the others go to the next one, compared with the one before
+class RateController:
+    def __init__(self, cmd_rclone):
+        tpslimit = float(get_rclone_flag(cmd_rclone, '--tpslimit') or 0)
+        transfers = get_rclone_flag(cmd_rclone, '--transfers')
+        tpslimit = tpslimit if tpslimit > 0 else rate_control_tpslimit[1]
+        transfers = int(transfers) if transfers else 4
+        self.tpslimit = min(max(tpslimit, rate_control_tpslimit[0]), rate_control_tpslimit[1])
+        self.transfers = min(max(transfers, rate_control_transfers[0]), rate_control_transfers[1])
+        self.rate_before = None  # Bytes and files per second of the rclone before the last increase
+        self.values_before = None  # Its tpslimit and transfers
+        self.time_increase = 0  # No increase before
+        self.time_decrease = 0
+        self.start_process()
+
+    # The command of the next rclone with the values picked
+    def get_cmd(self, cmd_rclone):
+        return remove_rclone_flags(cmd_rclone, ('--tpslimit', '--transfers')) + [
+            '--tpslimit', '%g' % self.tpslimit, '--transfers', str(self.transfers)]
+
+    # A new rclone process with the values picked, its counters start from 0 again
+    def start_process(self):
+        self.process_start = None  # First check where it transfers, the speed is measured from it
+        self.process_last = None
+        self.rate_limited = False
+        self.picked = False
+
+    # Follow the current rclone with its last check
+    def update(self, stats_window):
+        last = stats_window.last()
+        previous = stats_window.samples[-2] if len(stats_window.samples) > 1 else None
+        if previous is not None and (last['log'].get('rate_limit', 0) > previous['log'].get('rate_limit', 0) or (
+                last['errors'] > previous['errors'] and 'rateLimitExceeded' in last['last_error'] and
+                'userRateLimitExceeded' not in last['last_error'])):
+            self.rate_limited = True
+        if self.process_start is None and last['bytes'] > 0:
+            self.process_start = last
+        self.process_last = last
+
+    # A rate limit error lowers the limits of the running rclone at once, it is restarted to read them
+    def should_restart(self):
+        return self.rate_limited and time.time() - self.time_decrease >= rate_control_restart_after
+
+    # Pick the values of the next rclone from how the current one went, once per rclone
+    # Return True when they have changed
+    def pick_values(self):
+        if self.picked:
+            return False
+        self.picked = True
+        start, last = self.process_start, self.process_last
+        if self.rate_limited:
+            self.tpslimit = max(rate_control_tpslimit[0], round(self.tpslimit * rate_control_decrease, 2))
+            self.transfers = max(rate_control_transfers[0], int(self.transfers * rate_control_decrease))
+            self.rate_before = self.values_before = None
+            self.time_increase = time.time() + rate_control_increase_after
+            self.time_decrease = time.time()
+            return True
+
+        # Too short to tell its speed, the next rclone keeps the same values
+        if start is None or last['t'] - start['t'] < rate_control_increase_after or time.time() < self.time_increase:
+            return False
+        elapsed = last['t'] - start['t']
+        rate = ((last['bytes'] - start['bytes']) / elapsed, (last['transfers'] - start['transfers']) / elapsed)
+        if self.rate_before is not None and rate[0] < self.rate_before[0] * (1 + rate_control_min_gain) and \
+                rate[1] < self.rate_before[1] * (1 + rate_control_min_gain):
+            # The limits aren't what holds rclone back, go back to the values before the increase
+            self.tpslimit, self.transfers = self.values_before
+            self.rate_before = self.values_before = None
+            self.time_increase = time.time() + rate_control_retry_after
+            return True
+        if self.tpslimit >= rate_control_tpslimit[1] and self.transfers >= rate_control_transfers[1]:
+            self.rate_before = self.values_before = None
+            return False
+        self.values_before = (self.tpslimit, self.transfers)
+        self.tpslimit = min(rate_control_tpslimit[1], self.tpslimit + rate_control_step)
+        self.transfers = min(rate_control_transfers[1], self.transfers + rate_control_step)
+        self.rate_before = rate
+        return True
+
+
+# The command of the next rclone of a worker, with the limits picked by its rate controller if it has one
+def get_cmd_rclone_next(cmd_rclone, rate_controller, worker_logger):
+    if rate_controller is None:
+        return cmd_rclone
+    if rate_controller.pick_values():
+        worker_logger.info('Rate control: the next rclone runs with tpslimit %g, transfers %s\n' % (
+            rate_controller.tpslimit, rate_controller.transfers))
+    return rate_controller.get_cmd(cmd_rclone)
+
+
+# Let the transfers in progress which fit in the quota left finish before a switch, see drain_switch_rules
+# Return the last core/stats of rclone
+async def drain_rclone(proc, rc, response_json, sa_left, worker_logger):
+    transferring = response_json.get('transferring') or []
+    quota_left = sa_left
+    finishing = set()
+    for transfer in sorted(transferring, key=lambda transfer: transfer.get('size', 0) - transfer.get('bytes', 0)):
+        left = max(0, transfer.get('size', 0) - transfer.get('bytes', 0))
+        if left > sa_left:
+            break
+        sa_left -= left
+        finishing.add(transfer.get('name'))
+    if not finishing:
+        return response_json
+    # The limit is reached already, rclone refuses to start any other file
+    try:
+        await rc.call('options/set', {'main': {'MaxTransfer': response_json.get('bytes', 0), 'CutoffMode': 'soft'}})
+    except RcError as error:
+        worker_logger.warning('Can\'t stop rclone from starting new transfers: %s\n' % error)
+        return response_json
+
+    worker_logger.info('Drain, wait for %s of %s transfers to finish\n' % (len(finishing), len(transferring)))
+    time_start = time.time()
+    bytes_start = response_json.get('bytes', 0)
+    errors = response_json.get('errors', 0)
+    in_progress = set(transfer.get('name') for transfer in transferring)
+    while proc.returncode is None and time.time() - time_start < drain_timeout:
+        await asyncio.sleep(check_interval)
+        try:
+            response_json = await rc.stats()
+        except RcError:
+            break  # rclone has exited or doesn't answer, stop it anyway
+        names = set(transfer.get('name') for transfer in response_json.get('transferring') or [])
+        if not finishing.intersection(names):
+            worker_logger.info('Drained in %.2f seconds\n' % (time.time() - time_start))
+            return response_json
+        # rclone has started another file anyway, it would only use the quota of the next SA
+        started = names - in_progress
+        if started:
+            worker_logger.warning('rclone has started %s new transfers during the drain, stop it\n' % len(started))
+            return response_json
+        # The transfers which don't finish count too, stop before the quota left runs out
+        if response_json.get('bytes', 0) - bytes_start >= quota_left:
+            worker_logger.warning('The quota left is used after %.2f seconds of drain, stop rclone\n' % (
+                time.time() - time_start))
+            return response_json
+        # The quota has run out after all, the transfers left fail
+        if response_json.get('errors', 0) > errors and 'userRateLimitExceeded' in (response_json.get('lastError') or ''):
+            break
+    if proc.returncode is not None:
+        worker_logger.info('rclone has exited with code %s after %.2f seconds of drain\n' % (
+            proc.returncode, time.time() - time_start))
+    else:
+        worker_logger.warning('The transfers have not finished after %.2f seconds, stop rclone\n' % (
+            time.time() - time_start))
+    return response_json
+
+
+# Build the rclone command which uses a SA and a rc port
+def get_cmd_rclone_for_sa(cmd_rclone, sa, port, work_args=()):
+    cmd_rclone = cmd_rclone + ['--rc-addr=:{}'.format(port)] + list(work_args)
+    if switch_sa_way == 'config':
+        switch_sa_by_config(sa)
+        return cmd_rclone
+    # By default, it is treated as 'runtime', with the '--drive-service-account-file' parameter appended
+    return cmd_rclone + ['--drive-service-account-file', sa]
+
+
+# The rclone of the next SA, started in the background before the switch
+class StandbyRclone:
+    def __init__(self, cmd_rclone, sa, port, log, work_args=(), batch=None):
+        self.sa = sa
+        self.port = port
+        self.log = log
+        self.batch = batch
+        self.cmd = get_cmd_rclone_for_sa(remove_rclone_flags(cmd_rclone, ['--log-file']) + ['--log-file', log],
+                                         sa, port, work_args) + ['--check-first', '--bwlimit', standby_bwlimit]
+        self.proc = None
+        self.rc = RcClient(port, retries=0)
+        self.rclone_pid = None
+        self.paused = False
+
+    async def start(self):
+        self.proc = await start_rclone(self.cmd)
+
+    # Pause rclone once it starts transferring, return False if it has exited
+    async def check(self):
+        if self.proc.returncode is not None:
+            return False
+        if self.paused:
+            return True
+        try:
+            response_json = await self.rc.stats()
+            if self.rclone_pid is None:
+                self.rclone_pid = await self.rc.pid()
+        except RcError:
+            return True  # rc is not up yet
+        if response_json.get('transferring') or response_json.get('transfers', 0) > 0:
+            import psutil
+            psutil.Process(self.rclone_pid).suspend()
+            self.paused = True
+        return True
+
+    # Let rclone transfer at full speed
+    async def release(self, bwlimit):
+        if self.paused:
+            import psutil
+            psutil.Process(self.rclone_pid).resume()
+            self.paused = False
+        try:
+            await self.rc.call('core/bwlimit', {'rate': bwlimit})
+        except RcError as error:
+            logger.warning('Can\'t remove the bandwidth limit of the standby rclone: %s\n' % error)
+        self.rc.close()
+
+    async def kill(self):
+        if self.paused:
+            import psutil
+            psutil.Process(self.rclone_pid).resume()  # A paused rclone can't quit
+            self.paused = False
+        await stop_rclone(self.proc, self.port)
+        self.rc.close()
+
+
+# Join a remote or local path with a name inside of it
+def join_remote_path(path, name):
+    if path.endswith(':') or path.endswith('/'):
+        return path + name
+    return path + '/' + name
+
+
+# Run rclone and return its output
+async def run_rclone_output(*rclone_args):
+    proc = await asyncio.create_subprocess_exec(rclone_bin, *rclone_args, stdout=asyncio.subprocess.PIPE)
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, [rclone_bin] + list(rclone_args))
+    return output.decode('utf-8')
+
+
+# Run rclone and decode its json output
+async def run_rclone_json(*rclone_args):
+    return json.loads(await run_rclone_output(*rclone_args))
+
+
+# List the top-level entries of the source as (name, is_dir, size) with rclone lsjson
+async def list_source_entries(source):
+    entries = await run_rclone_json('lsjson', '--max-depth', '1', source)
+    return [(entry['Path'], entry.get('IsDir', False), entry.get('Size', 0)) for entry in entries]
+
+
+# Get the total size of a directory of the source with rclone size
+async def get_source_dir_size(source, name):
+    return (await run_rclone_json('size', '--json', join_remote_path(source, name))).get('bytes', 0)
+
+
+# Split the top-level entries of the source into `count` shards
+# 'dir' deals the entries out one by one, 'size' puts the biggest entries first into the lightest shard
+async def split_source_into_shards(source, count, shard_by):
+    entries = await list_source_entries(source)
+    shards = [[] for _ in range(count)]
+    if shard_by == 'dir':
+        for i, entry in enumerate(sorted(entries)):
+            shards[i % count].append(entry)
+        return shards
+
+    # Size the directories `count` at a time
+    semaphore = asyncio.Semaphore(count)
+
+    async def get_size(name):
+        async with semaphore:
+            return await get_source_dir_size(source, name)
+
+    dirs = [entry[0] for entry in entries if entry[1]]
+    sizes = dict(zip(dirs, await asyncio.gather(*[get_size(name) for name in dirs])))
+    entries = [(name, is_dir, sizes.get(name, size)) for name, is_dir, size in entries]
+
+    shard_bytes = [0] * count
+    for entry in sorted(entries, key=lambda entry: entry[2], reverse=True):
+        lightest = shard_bytes.index(min(shard_bytes))
+        shards[lightest].append(entry)
+        shard_bytes[lightest] += entry[2]
+    return shards
+
+
+# List the files of a local folder as (path, size, modification time), skipping symlinks like rclone does
+def walk_local_files(root):
+    files = []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            stat = os.lstat(path)
+            if not os.path.islink(path):
+                files.append((os.path.relpath(path, root).replace(os.sep, '/'), stat.st_size,
+                              format_modtime(stat.st_mtime)))
+    return files
+
+
+# A modification time in the format of rclone lsjson (UTC)
+def format_modtime(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + ('%.9f' % (ts % 1))[1:] + 'Z'
+
+
+# Seconds since the epoch of a modification time of rclone lsjson or of the Drive API, None if it can't be read
+def parse_modtime(modtime):
+    match = re.match(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)$', modtime or '')
+    if match is None:
+        return None
+    ts = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S')) + float(match.group(2) or 0)
+    if match.group(3) != 'Z':
+        sign = 1 if match.group(3)[0] == '+' else -1
+        ts -= sign * (int(match.group(3)[1:3]) * 3600 + int(match.group(3)[4:6]) * 60)
+    return ts
+
+
+# List all the files of a remote (rclone lsjson) or a local folder (walk) as (path, size, modification time, md5)
+# The md5 is None when it isn't listed (a local folder, or the remote has none)
+async def list_files(remote, hashes=False):
+    if os.path.isdir(remote):
+        files = await asyncio.get_running_loop().run_in_executor(None, walk_local_files, remote)
+        return [(path, size, modtime, None) for path, size, modtime in files]
+    try:
+        entries = await run_rclone_json('lsjson', '-R', '--files-only', '--fast-list', '--no-mimetype',
+                                        *(['--hash', '--hash-type', 'md5'] if hashes else []), remote)
+    except subprocess.CalledProcessError as error:
+        if error.returncode == 3:
+            return []  # Directory not found, nothing is there yet
+        raise
+    return [(entry['Path'], entry.get('Size', 0), entry.get('ModTime'), (entry.get('Hashes') or {}).get('md5'))
+            for entry in entries]
+
+
+# A file of the source is at the destination when the sizes match and the md5 match, or the modification times
+# when one of them has no md5. `destination` is (size, modification time, md5) or None
+def is_file_transferred(size, modtime, md5, destination):
+    if destination is None or destination[0] != size:
+        return False
+    if md5 and destination[2]:
+        return md5 == destination[2]
+    source_ts, destination_ts = parse_modtime(modtime), parse_modtime(destination[1])
+    return source_ts is not None and destination_ts is not None and \
+        abs(source_ts - destination_ts) <= manifest_modtime_window
+
+
+def save_manifest(source, files, path):
+    with gzip.open(path + '.tmp', 'wt') as f:
+        f.write(json.dumps({'source': source, 'time': time.time(), 'files': len(files)}) + '\n')
+        for file in files:
+            f.write(json.dumps(file) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+# Hand out the files left to transfer in batches which fit the quota left of a SA
+# Biggest files first (first fit decreasing), so that every SA is filled close to its limit
+# The files are (path, size) or (path, size, modification time, md5) as listed, the index gets the last two
+class BatchPlanner:
+    def __init__(self, files, index=None):
+        self.sizes = dict((file[0], file[1]) for file in files)  # Files not transferred yet
+        self.details = dict((file[0], file[2:4]) for file in files if len(file) > 2)
+        self.order = sorted(self.sizes, key=self.sizes.get, reverse=True)
+        self.assigned = set()  # Files in the batch of a running rclone
+        self.index = index  # The destination index which gets the transferred files
+
+    def has_pending(self):
+        return len(self.sizes) > len(self.assigned)
+
+    def batch_bytes(self, batch):
+        return sum(self.sizes.get(path, 0) for path in batch)
+
+    def next_batch(self, capacity):
+        batch = []
+        room = capacity
+        order = []
+        for path in self.order:
+            if path not in self.sizes:
+                continue  # Transferred, forget it
+            order.append(path)
+            if path not in self.assigned and self.sizes[path] <= room:
+                batch.append(path)
+                room -= self.sizes[path]
+        self.order = order
+        if not batch:
+            # Nothing fits in the quota left, try the smallest file alone
+            batch = [path for path in reversed(order) if path not in self.assigned][:1]
+            if batch and self.sizes[batch[0]] > sa_daily_quota:
+                logger.warning('%s is bigger than the quota of a Service Account\n' % batch[0])
+        self.assigned.update(batch)
+        return batch
+
+    # rclone keeps the modification time of the source, and Drive computes the same md5
+    def mark_done(self, path):
+        size = self.sizes.pop(path, None)
+        modtime, md5 = self.details.pop(path, (None, None))
+        self.assigned.discard(path)
+        if self.index is not None and size is not None:
+            self.index.add(path, size, md5, modtime or format_modtime(time.time()))
+
+    # rclone has transferred the whole batch
+    def finish(self, batch):
+        for path in batch:
+            self.mark_done(path)
+
+    # Give the files of a batch which are not transferred back to the next batches
+    def release(self, batch):
+        for path in batch or []:
+            self.assigned.discard(path)
+
+
+# Files and folders at the destination, with their Drive id and md5 when the destination is a Drive
+class DestinationIndex:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS files '
+                             '(path TEXT PRIMARY KEY, id TEXT, size INTEGER, md5 TEXT, modtime TEXT, is_dir INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS files_id ON files (id)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def close(self):
+        self._db.close()
+
+    def get_meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    # Replace the index by a full listing of the destination
+    def replace_all(self, destination, entries, root_id=None, page_token=None):
+        with self._db:
+            self._db.execute('DELETE FROM files')
+            self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', entries)
+            self._db.execute('DELETE FROM meta')
+            self._db.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('destination', destination), ('listed_at', str(time.time())), ('root_id', root_id),
+                ('page_token', page_token)])
+
+    def add(self, path, size, md5=None, modtime=None, file_id=None, is_dir=False):
+        with self._db:
+            if file_id is not None:
+                self._db.execute('DELETE FROM files WHERE id = ? AND path != ?', (file_id, path))
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                             (path, file_id, size, md5, modtime, int(is_dir)))
+
+    def get_path(self, file_id):
+        row = self._db.execute('SELECT path FROM files WHERE id = ?', (file_id,)).fetchone()
+        return row[0] if row else None
+
+    # Remove a file, or a folder with everything in it
+    def remove(self, path):
+        with self._db:
+            self._db.execute('DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(path) + 1, path + '/'))
+
+    # Move everything in a renamed folder
+    def move_folder(self, old_path, new_path):
+        with self._db:
+            self._db.execute('UPDATE files SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?',
+                             (new_path + '/', len(old_path) + 2, len(old_path) + 1, old_path + '/'))
+
+    # The files as {path: (size, modification time, md5)}
+    def get_files(self):
+        return dict((row[0], row[1:]) for row in self._db.execute(
+            'SELECT path, size, modtime, md5 FROM files WHERE is_dir = 0'))
+
+
+# Drive API client which reads with a SA
+def get_drive_service(sa):
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import build
+    credentials = Credentials.from_service_account_file(sa, scopes=['https://www.googleapis.com/auth/drive.readonly'])
+    return build('drive', 'v3', credentials=credentials, cache_discovery=False)
+
+
+# The Drive id of the shared drive and of the root folder of a destination, None when it isn't a Drive
+# Only the section of the remote is read (`config show`), `config dump` would print the secrets of every remote
+async def get_drive_ids(destination):
+    remote, colon, path = destination.partition(':')
+    if not colon or os.path.isdir(destination):
+        return None, None
+    try:
+        config = configparser.ConfigParser(interpolation=None)
+        config.read_string(await run_rclone_output('config', 'show', remote))
+        remote_config = config[remote] if config.has_section(remote) else {}
+        stat = await run_rclone_json('lsjson', '--stat', destination)
+    except (subprocess.CalledProcessError, ValueError, configparser.Error):
+        return None, None
+    if remote_config.get('type') != 'drive':
+        return None, None
+    drive_id = remote_config.get('team_drive') or None
+    root_id = stat.get('ID') if path.strip('/') else None
+    return drive_id, root_id or remote_config.get('root_folder_id') or drive_id
+
+
+def get_drive_start_page_token(service, drive_id):
+    params = {'supportsAllDrives': True}
+    if drive_id:
+        params['driveId'] = drive_id
+    return service.changes().getStartPageToken(**params).execute()['startPageToken']
+
+
+# Apply the changes of the Drive since the last run to the index
+def apply_drive_changes(index, service):
+    page_token = index.get_meta('page_token')
+    drive_id = index.get_meta('drive_id')
+    root_id = index.get_meta('root_id')
+    count = 0
+    while True:
+        params = {'pageToken': page_token, 'pageSize': 1000, 'includeRemoved': True, 'supportsAllDrives': True,
+                  'includeItemsFromAllDrives': True,
+                  'fields': 'nextPageToken,newStartPageToken,changes(fileId,removed,'
+                            'file(id,name,parents,size,md5Checksum,modifiedTime,mimeType,trashed))'}
+        if drive_id:
+            params['driveId'] = drive_id
+        response = service.changes().list(**params).execute()
+        for change in response.get('changes', []):
+            apply_drive_change(index, change, root_id)
+            count += 1
+        if 'newStartPageToken' in response:
+            index.set_meta('page_token', response['newStartPageToken'])
+            return count
+        page_token = response['nextPageToken']
+        index.set_meta('page_token', page_token)
+
+
+def apply_drive_change(index, change, root_id):
+    drive_file = change.get('file') or {}
+    old_path = index.get_path(change['fileId'])
+    if change.get('removed') or drive_file.get('trashed'):
+        if old_path is not None:
+            index.remove(old_path)
+        return
+    parents = drive_file.get('parents') or [None]
+    parent_path = '' if parents[0] == root_id else index.get_path(parents[0])
+    if parent_path is None:
+        # Not in the destination (anymore)
+        if old_path is not None:
+            index.remove(old_path)
+        return
+    is_dir = drive_file.get('mimeType') == 'application/vnd.google-apps.folder'
+    if not is_dir and drive_file.get('mimeType', '').startswith('application/vnd.google-apps.'):
+        return  # Google Docs have no size, rclone exports them
+    path = drive_file['name'] if not parent_path else parent_path + '/' + drive_file['name']
+    if is_dir and old_path is not None and old_path != path:
+        index.move_folder(old_path, path)
+    index.add(path, int(drive_file.get('size', 0)), drive_file.get('md5Checksum'), drive_file.get('modifiedTime'),
+              drive_file['id'], is_dir)
+
+
+# List the files and folders of the destination as rows of the index
+async def list_destination_entries(destination):
+    if os.path.isdir(destination):
+        files = await asyncio.get_running_loop().run_in_executor(None, walk_local_files, destination)
+        return [(path, None, size, None, modtime, 0) for path, size, modtime in files]
+    try:
+        entries = await run_rclone_json('lsjson', '-R', '--fast-list', '--hash', '--no-mimetype', destination)
+    except subprocess.CalledProcessError as error:
+        if error.returncode == 3:
+            return []  # Directory not found, nothing is there yet
+        raise
+    return [(entry['Path'], entry.get('ID'), entry.get('Size', 0), (entry.get('Hashes') or {}).get('md5'),
+             entry.get('ModTime'), int(entry.get('IsDir', False))) for entry in entries]
+
+
+# Bring the destination index up to date, by the Drive changes since the last run or by listing the destination
+# The Drive API is read with the account `sa`
+async def update_destination_index(index, destination, sa, refresh=False):
+    loop = asyncio.get_running_loop()
+    listed_at = float(index.get_meta('listed_at') or 0)
+    if not refresh and index.get_meta('destination') == destination and \
+            time.time() - listed_at < destination_index_max_age:
+        if not index.get_meta('page_token'):
+            logger.info('Use the index of %s, updated with the files transferred since it was listed\n' % destination)
+            return
+        try:
+            service = await loop.run_in_executor(None, get_drive_service, sa)
+            count = await loop.run_in_executor(None, apply_drive_changes, index, service)
+            logger.info('Use the index of %s, updated with %s Drive changes\n' % (destination, count))
+            return
+        except Exception as error:  # Any error of the Drive API, list the destination instead
+            logger.warning('Can\'t get the Drive changes of %s (%s), list it again\n' % (destination, error))
+
+    # Get the change token first so that nothing changed during the listing is missed
+    drive_id = root_id = page_token = None
+    if drive_changes:
+        drive_id, root_id = await get_drive_ids(destination)
+        if root_id is not None:
+            try:
+                service = await loop.run_in_executor(None, get_drive_service, sa)
+                page_token = await loop.run_in_executor(None, get_drive_start_page_token, service, drive_id)
+            except ImportError:
+                logger.warning('google-api-python-client isn\'t installed, the index only follows the transferred files\n')
+            except Exception as error:  # Any error of the Drive API, go on without the changes
+                logger.warning('Can\'t follow the Drive changes of %s: %s\n' % (destination, error))
+    logger.info('List the files of the destination %s for its index\n' % destination)
+    index.replace_all(destination, await list_destination_entries(destination), root_id, page_token)
+    if drive_id:
+        index.set_meta('drive_id', drive_id)
+
+
+# List the source and the destination (or use its index), and plan the files left to transfer
+# The source is listed at every run so that its new and changed files are never missed, its manifest is the last listing
+async def build_batch_planner(job):
+    source, destination = job.source, job.destination
+    job.logger.info('List the files of the source %s\n' % source)
+    files = await list_files(source, manifest_hashes)
+    save_manifest(source, files, job.path(manifest_path))
+    if job.destination_index is not None:
+        # Leased like the account of a worker, reading doesn't need the upload quota
+        sa = await acquire_next_sa_json_path_waiting('', job.logger, allow_exhausted=True)
+        try:
+            await update_destination_index(job.destination_index, destination, sa, job.refresh_index)
+        finally:
+            release_sa_json_path(sa)
+        destination_files = job.destination_index.get_files()
+    else:
+        job.logger.info('List the files of the destination %s\n' % destination)
+        destination_files = dict((path, (size, modtime, md5)) for path, size, modtime, md5 in await list_files(destination))
+    # rclone still checks the files of its batch, the ones which are the same at the destination are skipped
+    files = [file for file in files if not is_file_transferred(*file[1:], destination_files.get(file[0]))]
+    if job.journal is not None:
+        transferred = job.journal.get_transferred()
+        files = [file for file in files if file[0] not in transferred or transferred[file[0]] not in (None, file[1])]
+    job.logger.info('%s files (%.2f GiB) left to transfer\n' % (len(files), sum(file[1] for file in files) / pow(1024, 3)))
+    return BatchPlanner(files, job.destination_index)
+
+
+def write_batch_file(batch, path):
+    with open(path, 'w') as f:
+        for file_path in batch:
+            f.write(file_path + '\n')
+
+
+# Escape the glob characters of a path for a rclone filter rule
+def escape_filter_path(path):
+    return ''.join('\\' + c if c in '\\*?[]{}' else c for c in path)
+
+
+# Write a rclone filter file which only includes the entries of a shard
+def write_shard_filter(shard, path):
+    with open(path, 'w') as f:
+        for name, is_dir, _ in shard:
+            name = escape_filter_path(name)
+            f.write('+ /%s/**\n' % name if is_dir else '+ /%s\n' % name)
+        f.write('- **\n')
+
+
+# Write a rclone filter file which excludes transferred files, followed by the rules of the shard if any
+def write_rclone_filter(path, excluded, shard_filter=None):
+    with open(path, 'w') as f:
+        for file_path in excluded:
+            f.write('- /%s\n' % escape_filter_path(file_path))
+        if shard_filter is not None:
+            with open(shard_filter) as shard_f:
+                shutil.copyfileobj(shard_f, f)
+
+
+# Files transferred by a job (source and destination), the pending ones are written at every check
+class TransferJournal:
+    def __init__(self, path, job):
+        self.job = job
+        self._pending = []
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS transferred '
+                             '(job TEXT, path TEXT, size INTEGER, ts REAL, PRIMARY KEY (job, path))')
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def record(self, path, size=None):
+        self._pending.append((self.job, path, size, time.time()))
+
+    def flush(self):
+        if self._pending:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO transferred VALUES (?, ?, ?, ?)', self._pending)
+            self._pending = []
+
+    # Transferred files and their sizes (None when unknown)
+    def get_transferred(self):
+        self.flush()
+        return dict(self._db.execute('SELECT path, size FROM transferred WHERE job = ?', (self.job,)))
+
+    def get_newest(self, limit):
+        self.flush()
+        rows = self._db.execute('SELECT path FROM transferred WHERE job = ? ORDER BY ts DESC LIMIT ?', (self.job, limit))
+        return [row[0] for row in rows]
+
+    # The transfer is complete, the next one compares the source and the destination again
+    def clear(self):
+        self._pending = []
+        with self._db:
+            self._db.execute('DELETE FROM transferred WHERE job = ?', (self.job,))
+
+
+# Compact history of the checks and switches of the workers, see stats_history_*
+# A record is a kind, a timestamp, the ids of the worker, the SA and a name (rule or reason) and the counters of rclone:
+#   S  the rclone of the SA is up
+#   C  a check: bytes, speed, files transferred and errors of rclone, bytes of the files in progress, quota error seen
+#   W  a switch by the rules named, with the counters of the last check
+#   E  the rclone has ended (finished, batch, failed, stopped or rate_limit: restarted with lower limits),
+#      with the counters of the last check
+#   N  the id of a worker, SA or rule name, followed by the name, before the first record using it in the file
+class StatsRecorder:
+    record = struct.Struct('<cdHHHQfIIQB')
+    name = struct.Struct('<cHH')
+
+    def __init__(self, location):
+        self.location = location
+        self._file = None
+        self._day = None
+        self._names = {}
+        os.makedirs(location, exist_ok=True)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Start a file every day, the files of the days before are downsampled
+    def _open_day(self, t):
+        day = time.strftime('%Y%m%d', time.gmtime(t))
+        if day == self._day:
+            return
+        self.close()
+        compact_stats_history(self.location, t)
+        self._file = open(os.path.join(self.location, day + '.rec'), 'ab')
+        self._day = day
+        self._names = {}  # The ids are defined again in every file
+
+    def _get_id(self, name):
+        name = str(name)
+        if name not in self._names:
+            self._names[name] = len(self._names)
+            data = name.encode('utf-8')[:0xffff]
+            self._file.write(self.name.pack(b'N', self._names[name], len(data)) + data)
+        return self._names[name]
+
+    def add(self, kind, worker, sa, response_json=None, name='', quota=False):
+        t = time.time()
+        self._open_day(t)
+        response_json = response_json or {}
+        partial = sum(transfer.get('bytes', 0) for transfer in response_json.get('transferring') or [])
+        ids = (self._get_id(worker), self._get_id(sa), self._get_id(name))
+        self._file.write(self.record.pack(
+            kind.encode(), t, ids[0], ids[1], ids[2], int(response_json.get('bytes', 0)),
+            response_json.get('speed', 0), response_json.get('transfers', 0), response_json.get('errors', 0),
+            int(partial), quota))
+        self._file.flush()
+
+
+# The raw records of a history file, the names included, a record cut by a crash ends it
+def iter_stats_file_records(path):
+    with open(path, 'rb') as f:
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            if kind == b'N':
+                data = kind + f.read(StatsRecorder.name.size - 1)
+                if len(data) < StatsRecorder.name.size:
+                    return
+                data += f.read(StatsRecorder.name.unpack(data)[2])
+            else:
+                data = kind + f.read(StatsRecorder.record.size - 1)
+                if len(data) < StatsRecorder.record.size:
+                    return
+            yield data
+
+
+# The records of a history file as dicts with the names instead of their ids
+def read_stats_file(path):
+    names = {}
+    for data in iter_stats_file_records(path):
+        if data[:1] == b'N':
+            names[StatsRecorder.name.unpack(data[:StatsRecorder.name.size])[1]] = \
+                data[StatsRecorder.name.size:].decode('utf-8', 'replace')
+            continue
+        fields = StatsRecorder.record.unpack(data)
+        yield {'kind': fields[0].decode(), 't': fields[1], 'worker': names.get(fields[2], ''),
+               'sa': names.get(fields[3], ''), 'name': names.get(fields[4], ''), 'bytes': fields[5],
+               'speed': fields[6], 'transfers': fields[7], 'errors': fields[8], 'partial': fields[9],
+               'quota': bool(fields[10])}
+
+
+# History files in the order of their days
+def get_stats_files(location):
+    return sorted(glob.glob(os.path.join(glob.escape(location), '*.rec')), key=os.path.basename)
+
+
+def read_stats_history(location):
+    for path in get_stats_files(location):
+        for record in read_stats_file(path):
+            yield record
+
+
+# Downsample the days older than stats_history_full_days and delete the ones older than stats_history_keep_days
+def compact_stats_history(location, now):
+    full_from = time.strftime('%Y%m%d', time.gmtime(now - stats_history_full_days * 24 * 3600))
+    keep_from = time.strftime('%Y%m%d', time.gmtime(now - stats_history_keep_days * 24 * 3600))
+    for path in get_stats_files(location):
+        day, _, rest = os.path.basename(path).partition('.')
+        if day < keep_from:
+            os.remove(path)
+        elif day < full_from and rest == 'rec':
+            # Keep one sample a minute and the ones where a quota error shows up or rclone starts transferring
+            last = {}
+            with open(path[:-len('rec')] + 'min.rec.tmp', 'wb') as f:
+                for data in iter_stats_file_records(path):
+                    if data[:1] == b'C':
+                        fields = StatsRecorder.record.unpack(data)
+                        state = (int(fields[1] // stats_history_downsample), fields[10], fields[6] > 0)
+                        if last.get(fields[2]) == state:
+                            continue
+                        last[fields[2]] = state
+                    elif data[:1] != b'N':
+                        last.pop(StatsRecorder.record.unpack(data)[2], None)
+                    f.write(data)
+            os.replace(path[:-len('rec')] + 'min.rec.tmp', path[:-len('rec')] + 'min.rec')
+            os.remove(path)
+
+
+# Print the efficiency of the transfers recorded in the history, reading it once whatever its length:
+# throughput of every SA, idle time after the switches, time to detect an exhausted quota and bytes lost by the kills
+def report_stats_history(location):
+    sas = {}  # email: [rclone runs, seconds, bytes]
+    runs = {}  # worker: the rclone running, {'sa', 'start', 'quota' (first check with a quota error), 'last' (check)}
+    switched = {}  # worker: time of the switch until the next rclone transfers
+    idle = [0, 0, 0]  # count, seconds, max
+    detect = [0, 0, 0]
+    retransferred = 0
+    time_first = time_last = None
+
+    def end_run(worker, t, record):
+        run = runs.pop(worker)
+        sa = sas.setdefault(run['sa'], [0, 0, 0])
+        sa[0] += 1
+        sa[1] += max(0, t - run['start'])
+        sa[2] += record['bytes']
+        return run
+
+    def add(total, value):
+        total[0] += 1
+        total[1] += value
+        total[2] = max(total[2], value)
+
+    for record in read_stats_history(location):
+        worker, t, kind = record['worker'], record['t'], record['kind']
+        if time_first is None:
+            time_first = t
+        time_last = t
+        if kind == 'S':
+            if worker in runs:
+                # The last run has been stopped without an end record
+                end_run(worker, runs[worker]['last']['t'], runs[worker]['last'])
+            runs[worker] = {'sa': record['sa'], 'start': t, 'quota': None, 'last': record}
+            continue
+        run = runs.get(worker)
+        if run is None:
+            if kind != 'C':
+                continue  # A switch or end without a rclone up, e.g. a rclone which failed to start
+            # The history starts while rclone runs
+            run = runs[worker] = {'sa': record['sa'], 'start': t, 'quota': None, 'last': record}
+        if kind == 'C':
+            run['last'] = record
+            if record['quota'] and run['quota'] is None:
+                run['quota'] = t
+            if record['speed'] > 0 and worker in switched:
+                add(idle, t - switched.pop(worker))
+        elif kind == 'W':
+            end_run(worker, t, record)
+            retransferred += record['partial']
+            if run['quota'] is not None:
+                add(detect, t - run['quota'])
+            switched[worker] = t
+        elif kind == 'E':
+            end_run(worker, t, record)
+            if record['name'] in ('failed', 'stopped', 'rate_limit'):
+                retransferred += record['partial']
+            if record['name'] in ('batch', 'rate_limit'):
+                switched[worker] = t
+            else:
+                switched.pop(worker, None)
+
+    if time_first is None:
+        print('No history in %s' % location)
+        return
+    for worker in list(runs):
+        end_run(worker, runs[worker]['last']['t'], runs[worker]['last'])
+    if not sas:
+        print('No rclone runs recorded in %s' % location)
+        return
+    run_seconds = sum(sa[1] for sa in sas.values())
+    run_bytes = sum(sa[2] for sa in sas.values())
+    print('History of %s from %s to %s' % (location, time.strftime('%Y-%m-%d %H:%M', time.localtime(time_first)),
+                                           time.strftime('%Y-%m-%d %H:%M', time.localtime(time_last))))
+    print('Transferred: %.2f GiB by %s rclone runs of %s Service Accounts in %.1f hours, %.2f MiB/s on average' % (
+        run_bytes / pow(1024, 3), sum(sa[0] for sa in sas.values()), len(sas), run_seconds / 3600,
+        run_bytes / max(run_seconds, 1) / pow(1024, 2)))
+    print('Idle after a switch: %s times, %.1f seconds on average, %.1f at most, %.2f hours in all (%.1f%% of the time)' % (
+        idle[0], idle[1] / max(idle[0], 1), idle[2], idle[1] / 3600, idle[1] * 100 / max(run_seconds + idle[1], 1)))
+    print('Exhausted quota detected: %s times, %.1f seconds after the first quota error on average, %.1f at most' % (
+        detect[0], detect[1] / max(detect[0], 1), detect[2]))
+    print('Lost by the kills: %.2f GiB of files in progress to transfer again' % (retransferred / pow(1024, 3)))
+
+    # The slowest accounts first, the ones below half of the median speed are marked
+    speeds = sorted((sa[2] / max(sa[1], 1), email) for email, sa in sas.items())
+    median = speeds[len(speeds) // 2][0]
+    print('%-60s %5s %10s %8s %8s' % ('Service Account', 'runs', 'GiB', 'hours', 'MiB/s'))
+    for speed, email in speeds:
+        print('%-60s %5s %10.2f %8.2f %8.2f%s' % (
+            email, sas[email][0], sas[email][2] / pow(1024, 3), sas[email][1] / 3600, speed / pow(1024, 2),
+            '  < half of the median' if speed < median / 2 else ''))
+
+
+# Sizes of the files of a listing in its order: a local folder, a manifest of the script (.gz),
+# the output of `rclone lsjson -R` (an entry a line) or of `rclone size --json` (totals only, the files get the average size)
+def read_plan_listing(path):
+    sizes = array.array('q')
+    if os.path.isdir(path):
+        sizes.extend(file[1] for file in walk_local_files(path))
+        return sizes
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt') as f:
+            f.readline()  # Header
+            for line in f:
+                sizes.append(max(0, int(json.loads(line)[1])))
+        return sizes
+    size_re = re.compile(r'"Size":\s*(-?\d+)')
+    dir_re = re.compile(r'"IsDir":\s*true')
+    with open(path) as f:
+        try:
+            totals = json.loads(f.readline())
+        except ValueError:
+            totals = None
+        if isinstance(totals, dict) and 'count' in totals and 'bytes' in totals:
+            return array.array('q', [totals['bytes'] // max(totals['count'], 1)]) * totals['count']
+        f.seek(0)
+        for line in f:
+            match = size_re.search(line)
+            if match and not dir_re.search(line):
+                sizes.append(max(0, int(match.group(1))))  # -1 for the Google documents
+    return sizes
+
+
+# When the rules switch, in seconds after the quota of the account has run out (< 0 before), and the rules hit then
+# None if they never switch for an exhausted quota
+def get_quota_switch_delay(engine):
+    quota_error = 'googleapi: Error 403: User rate limit exceeded., userRateLimitExceeded'
+    hits = []
+    for rule in engine.rules:
+        if rule.kind == 'quota_forecast':
+            hits.append((-check_interval * rule.polls, rule))
+        elif rule.kind == 'quota_used':
+            hits.append((check_interval / 2, rule))  # The next check
+        elif rule.kind == 'error_message':
+            if 'quota' in rule.log_events:
+                hits.append((log_follow_interval, rule))
+            elif rule.pattern and rule.pattern.search(quota_error):
+                hits.append((check_interval / 2, rule))
+        else:
+            # Every transfer fails once the quota has run out, the rules of a window wait for it to pass
+            hits.append((max(rule.window, check_interval) + check_interval / 2, rule))
+    weight = 0
+    for delay, rule in sorted(hits, key=lambda hit: hit[0]):
+        weight += rule.weight
+        if engine.should_switch(weight):
+            return delay, [other.name for other_delay, other in hits if other_delay <= delay]
+    return None, []
+
+
+# Seconds a rclone takes to transfer files
+def get_plan_transfer_time(size, count):
+    return max(size / plan_sa_speed, count / plan_files_per_second if plan_files_per_second else 0)
+
+
+# Simulate the rclone processes of a worker over the files lo..hi-1 of the listing (prefix: bytes up to each file),
+# one account after another. In the `transfers` files in progress at a switch, the bytes sent are lost
+# unless the drain lets them finish in the quota left.
+# Return the runs [start, end, bytes sent, bytes lost, seconds of overhead] and the files which never finish
+def plan_worker(prefix, lo, hi, delay, drain, transfers):
+    runs = []
+    stuck = []
+    t = 0
+    index = lo
+    base = prefix[lo - 1] if lo else 0
+    credit = [0, 0]  # Bytes and count of the files the last drain has finished, the next rclone skips them
+    total = prefix[hi - 1] - base if hi > lo else 0
+    speed = total / max(get_plan_transfer_time(total, hi - lo), 1e-9)  # With the limit of files per second
+    threshold = sa_daily_quota + min(delay, 0) * speed
+    overhead = plan_start_time
+    while index < hi:
+        end = bisect.bisect_right(prefix, base + threshold + credit[0], index, hi)
+        if end == hi:
+            size = prefix[hi - 1] - base - credit[0]
+            duration = overhead + get_plan_transfer_time(size, hi - index - credit[1])
+            runs.append([t, t + duration, size, 0, overhead])
+            break
+        # Files index..done-1 have finished, done..end are in progress
+        done = max(index, end - transfers + 1)
+        sent = (prefix[done - 1] - base if done > index else 0) - credit[0]
+        partial = threshold - sent
+        in_progress = [prefix[i] - (prefix[i - 1] if i else 0) for i in range(done, end + 1)]
+        lost = partial
+        drained = [0, 0]
+        if drain:
+            room = sa_daily_quota - threshold
+            for left in sorted(max(0, size - partial / len(in_progress)) for size in in_progress):
+                if left > room:
+                    break
+                room -= left
+                drained[0] += left
+                drained[1] += 1
+                lost -= partial / len(in_progress)
+        duration = overhead + get_plan_transfer_time(threshold + drained[0], done - index + drained[1] - credit[1]) + \
+            max(delay, 0)  # rclone fails until the rules switch
+        runs.append([t, t + duration, threshold + drained[0], lost, overhead + max(delay, 0) +
+                     drained[0] / plan_sa_speed])
+        t += duration
+        if done == index and not drained[1]:
+            # None of the files in progress can finish with one account, they would start over forever
+            stuck += in_progress
+            index = end + 1
+            base = prefix[end]
+            credit = [0, 0]
+        else:
+            # The files finished by the drain are in the bytes of the next files, the next rclone skips them
+            credit = [sum(sorted(in_progress)[:drained[1]]), drained[1]]
+            index = done
+            base = prefix[done - 1] if done else 0
+        overhead = plan_start_time
+    return runs, stuck
+
+
+# Batches of a shared planner (--manifest), first fit decreasing like BatchPlanner, each one fills a new account
+# Return the bytes and count of every batch
+def plan_batches(sizes):
+    order = array.array('q', sorted(sizes, reverse=True))
+    negated = array.array('q', (-size for size in order))  # Ascending for bisect
+    count = len(order)
+    following = array.array('q', range(count + 1))  # The first file not taken from each index, with path compression
+
+    def find(i):
+        root = i
+        while following[root] != root:
+            root = following[root]
+        while following[i] != root:
+            following[i], i = root, following[i]
+        return root
+
+    batches = []
+    while find(0) < count:
+        room = sa_daily_quota
+        batch = [0, 0]
+        i = find(0)
+        while i < count:
+            if order[i] <= room:
+                room -= order[i]
+                batch[0] += order[i]
+                batch[1] += 1
+                following[i] = i + 1
+                i = find(i + 1)
+            else:
+                # The biggest file left which fits
+                i = find(bisect.bisect_left(negated, -room, i))
+        batches.append(batch)
+    return batches
+
+
+# Accounts needed so that no worker waits for a quota window: an account can be used again sa_quota_window after its run
+def get_plan_accounts_needed(runs):
+    starts = sorted(run[0] for run in runs)
+    releases = sorted(run[1] + sa_quota_window for run in runs)
+    needed = in_use = released = 0
+    for start in starts:
+        while released < len(releases) and releases[released] <= start:
+            released += 1
+            in_use -= 1
+        in_use += 1
+        needed = max(needed, in_use)
+    return needed
+
+
+# Print the service accounts, wall time, switch overhead and bytes transferred again a job would take
+def plan_transfer(path, engine, workers=1, manifest=False, warm_standby=False):
+    time_start = time.time()
+    sizes = read_plan_listing(path)
+    transfers = int(get_rclone_flag(shlex.split(rclone_flags), '--transfers') or 4)
+    delay, rules_hit = get_quota_switch_delay(engine)
+    drain = delay is not None and delay < 0 and bool(drain_switch_rules) and \
+        all(rule in drain_switch_rules for rule in rules_hit)
+    cutoff = sa_daily_quota if manifest or drain or delay is None or delay >= 0 else \
+        sa_daily_quota + delay * plan_sa_speed
+    too_big = [size for size in sizes if size > cutoff]
+    if too_big:
+        sizes = array.array('q', (size for size in sizes if size <= cutoff))
+
+    print('Plan of %s files (%.2f GiB) of %s, read in %.1f seconds' % (
+        len(sizes) + len(too_big), (sum(sizes) + sum(too_big)) / pow(1024, 3), path, time.time() - time_start))
+    print('Model: %s worker(s), rclone at %.1f MiB/s and %s files/s with %s transfers, %s, quota %.2f GiB a %.1f hours' % (
+        workers, plan_sa_speed / pow(1024, 2), plan_files_per_second or 'any', transfers,
+        ('batches with a warm standby' if warm_standby else 'batches') if manifest else 'restart',
+        sa_daily_quota / pow(1024, 3), sa_quota_window / 3600))
+    if manifest:
+        print('Switch: every batch fills the quota of an account, rclone ends with it')
+    elif delay is None:
+        print('Switch: the rules never switch when the quota runs out, the transfer would stop at the first account')
+        return
+    elif delay < 0:
+        print('Switch: %.1f seconds before the quota runs out by %s%s' % (
+            -delay, ', '.join(rules_hit), ', the files in progress which fit are drained' if drain else ''))
+    else:
+        print('Switch: %.1f seconds after the quota runs out by %s' % (delay, ', '.join(rules_hit)))
+
+    stuck = []
+    if manifest:
+        runs = []
+        free = [0] * max(1, workers)  # When each worker takes its next batch
+        for size, count in plan_batches(sizes):
+            worker = free.index(min(free))
+            # A warm standby has checked its batch while the last one was transferring
+            overhead = plan_start_time if free[worker] == 0 else 0 if warm_standby else plan_batch_start_time
+            duration = overhead + get_plan_transfer_time(size, count)
+            runs.append([free[worker], free[worker] + duration, size, 0, overhead])
+            free[worker] += duration
+    else:
+        # Every worker gets a shard of about the same bytes
+        prefix = array.array('q', itertools.accumulate(sizes))
+        total = prefix[-1] if prefix else 0
+        bounds = [0] + [bisect.bisect_left(prefix, total * i // max(1, workers)) for i in range(1, max(1, workers))] + \
+            [len(prefix)]
+        runs = []
+        for lo, hi in zip(bounds, bounds[1:]):
+            worker_runs, worker_stuck = plan_worker(prefix, lo, hi, delay, drain, transfers)
+            runs += worker_runs
+            stuck += worker_stuck
+
+    wall_time = max([run[1] for run in runs] + [0])
+    switches = max(0, len(runs) - max(1, workers))
+    overhead = sum(run[4] for run in runs) - min(len(runs), max(1, workers)) * plan_start_time
+    print('Service Accounts: %s runs, %s accounts needed so that no worker waits for a quota window' % (
+        len(runs), get_plan_accounts_needed(runs)))
+    print('Wall time: %.1f hours (%.1f days)' % (wall_time / 3600, wall_time / 86400))
+    print('Switch overhead: %s switches, %.2f hours in all (%.1f seconds each on average)' % (
+        switches, overhead / 3600, overhead / max(switches, 1)))
+    print('Transferred again: %.2f GiB of files in progress lost at the switches (%.2f%% of the bytes sent)' % (
+        sum(run[3] for run in runs) / pow(1024, 3), sum(run[3] for run in runs) * 100 / max(sum(run[2] for run in runs), 1)))
+    if too_big:
+        print('Too big: %s files (%.2f GiB) are bigger than what an account can send (sa_daily_quota)' % (
+            len(too_big), sum(too_big) / pow(1024, 3)))
+    if stuck:
+        print('Stuck: %s files (%.2f GiB) never finish, %s of them at once don\'t fit in the quota of an account '
+              '(use --manifest or fewer --transfers)' % (len(stuck), sum(stuck) / pow(1024, 3), transfers))
+    print('Simulated in %.1f seconds' % (time.time() - time_start))
+
+
+# Restrict a new rclone to what is left: its batch, or everything except the transferred files (and other shards)
+# Return the arguments to add to the rclone command and the batch
+def prepare_rclone_work(job, port, planner, capacity, shard_filter):
+    if planner is not None:
+        batch = planner.next_batch(capacity)
+        write_batch_file(batch, job.path(batch_files_path) % port)
+        return ['--files-from-raw', job.path(batch_files_path) % port], batch
+    excluded = job.journal.get_newest(journal_exclude_max) if job.journal is not None else []
+    if not excluded and shard_filter is None:
+        return [], None
+    write_rclone_filter(job.path(filter_path) % port, excluded, shard_filter)
+    return ['--filter-from', job.path(filter_path) % port], None
+
+
+# Prefix the messages of a worker with its number
+class WorkerLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return '[%s] %s' % (self.extra['prefix'], msg), kwargs
+
+
+# A transfer from a source to a destination, with its own state files, rc ports and rclone logs
+# The command line runs a job named None with the files of the configuration items (in --state-dir if given),
+# the daemon runs a job for every json file of its queue with the files in daemon_state_dir/<name>
+class Job:
+    def __init__(self, name, source, destination, port, state_dir=None, cmd=None, mode=None, flags='', priority=0,
+                 workers=1, shard_by='size', warm_standby=False, manifest=False, index=False,
+                 refresh_index=False, rate_control=False, verify=False):
+        self.name = name
+        self.source = source
+        self.destination = destination
+        self.port = port
+        self.state_dir = state_dir
+        # The rclone command is a list of arguments, the flags are split like a shell would do
+        self.cmd_rclone = list(cmd or [rclone_bin, mode or rclone_mode, source, destination] + shlex.split(rclone_flags))
+        if flags:
+            self.cmd_rclone += shlex.split(flags)
+        self.priority = priority
+        self.workers = workers
+        self.shard_by = shard_by
+        self.warm_standby = warm_standby
+        self.rate_control = rate_control
+        self.verify = verify
+        # The index of the destination replaces its listing, a standby needs a batch which the current rclone doesn't have
+        self.manifest = manifest or index or warm_standby
+        self.index = index
+        self.refresh_index = refresh_index
+        self.logger = self.get_logger(0)
+        self.config = {}
+        self.journal = None
+        self.destination_index = None
+        self.stats_recorder = None
+        self.state = 'queued'  # Then running, done, failed or stopped
+        self.exit_code = None
+        self.workers_status = {}  # Worker id: SA, rc port and the last core/stats counters of its rclone
+
+    # A file of the configuration items, in the state folder of the job if it has one
+    def path(self, path):
+        if self.state_dir is None:
+            return path
+        return os.path.join(self.state_dir, os.path.basename(path))
+
+    def get_logger(self, worker_id):
+        if self.name is None:
+            return logger if worker_id == 0 else WorkerLogger(logger, {'prefix': 'worker %s' % worker_id})
+        return WorkerLogger(logger, {'prefix': self.name if worker_id == 0 else '%s worker %s' % (self.name, worker_id)})
+
+    # Value of the worker label of the metrics
+    def worker_label(self, worker_id):
+        return worker_id if self.name is None else '%s/%s' % (self.name, worker_id)
+
+    # Load the state of the last run, open the journal of the transferred files and the index of the destination
+    def open(self):
+        if self.state_dir is not None:
+            os.makedirs(self.state_dir, exist_ok=True)
+        if os.path.exists(self.path(instance_config_path)):
+            self.logger.info('Instance config exist, Load it...\n')
+            with open(self.path(instance_config_path)) as f:
+                self.config = json.load(f)
+        # The files transferred by the last rclone processes, also by the last run if it was stopped
+        self.journal = TransferJournal(self.path(transfer_journal_path), '%s -> %s' % (self.source, self.destination))
+        if self.index:
+            self.destination_index = DestinationIndex(self.path(destination_index_path))
+        if stats_history_path:
+            self.stats_recorder = StatsRecorder(self.path(stats_history_path))
+
+    def close(self):
+        self.journal.close()
+        if self.destination_index is not None:
+            self.destination_index.close()
+        if self.stats_recorder is not None:
+            self.stats_recorder.close()
+
+    # Add a record to the history, see StatsRecorder
+    def record_stats(self, kind, worker_label, sa, response_json=None, name='', quota=False):
+        if self.stats_recorder is not None:
+            self.stats_recorder.add(kind, worker_label, sa_pool.get_email(sa) if sa in sa_pool else sa,
+                                    response_json, name, quota)
+
+    def write_config(self, name, value):
+        self.config[name] = value
+        with open(self.path(instance_config_path), 'w') as f:
+            json.dump(self.config, f, sort_keys=True)
+
+    # Kill the rclone processes the last run of the job may have left
+    async def kill_last_rclone(self):
+        for key, last_pid in list(self.config.items()):
+            if last_pid and (key.startswith('last_pid') or key.startswith('last_standby_pid')):
+                self.logger.debug('Last PID exist, Start to check if it is still alive\n')
+                await wait_procs_exit(force_kill_rclone_subproc_by_parent_pid(last_pid))
+
+
+# A file has been transferred
+def record_transferred(job, planner, path, size=None):
+    if job.journal is not None:
+        job.journal.record(path, size if size is not None else planner.sizes.get(path) if planner else None)
+    if planner is not None:
+        planner.mark_done(path)
+
+
+# Journal the files a rclone has finished from its rc 'core/transferred'
+async def journal_transferred(job, planner, rc):
+    if job.journal is None and planner is None:
+        return
+    try:
+        transferred = (await rc.call('core/transferred', retries=0)).get('transferred') or []
+    except RcError:
+        transferred = []
+    for transfer in transferred:
+        if transfer.get('name') and not transfer.get('error') and not transfer.get('checked'):
+            record_transferred(job, planner, transfer['name'], transfer.get('size'))
+    if job.journal is not None:
+        job.journal.flush()
+
+
+# Run one rclone process after another with the next service account until the transfer ends
+async def run_worker(job, worker_id, cmd_rclone, port, rclone_log, planner=None, shard_filter=None):
+    import psutil
+    worker_logger = job.get_logger(worker_id)
+    worker_label = job.worker_label(worker_id)
+
+    # Fixed cmd_rclone to prevent missing `--rc`
+    if not any(arg.startswith('--rc') for arg in cmd_rclone):
+        worker_logger.warning('Lost important param `--rc` in rclone commands, AutoAdd it.\n')
+        cmd_rclone = cmd_rclone + ['--rc']
+
+    # Rclone log file
+    cmd_rclone = cmd_rclone + ['--log-file', rclone_log]
+    if '--use-json-log' not in cmd_rclone:
+        cmd_rclone.append('--use-json-log')
+
+    # The bandwidth limit a standby gets back when it takes over
+    bwlimit = get_rclone_flag(cmd_rclone, '--bwlimit') or 'off'
+
+    warm_standby = job.warm_standby
+    if warm_standby and switch_sa_way == 'config':
+        worker_logger.warning('switch_sa_way `config` can\'t be used with a warm standby, disable it.\n')
+        warm_standby = False
+    if warm_standby and planner is None:
+        # Without a batch of its own the standby would upload again what the current rclone finishes
+        worker_logger.info('No batches for this rclone, run it without a warm standby\n')
+        warm_standby = False
+    # The standby writes to a log of its own so that its events don't count for the current rclone,
+    # the log of the rclone which is running is followed, a standby uses the other one
+    root, ext = os.path.splitext(rclone_log)
+    standby_log = '%s.standby%s' % (root, ext)
+
+    rate_controller = RateController(cmd_rclone) if job.rate_control else None
+
+    last_sa = current_sa = job.config.get(worker_config_key('last_sa', worker_id), '')
+    proc = None
+    standby = None
+    time_switch = None
+    batch = None
+    response_json = None  # Last core/stats of the current rclone
+    restart_same_sa = False  # The rate controller restarts rclone with lower limits
+
+    # Follow the rclone log from where the last run stopped reading it
+    log_follower = LogFollower(rclone_log, job.config.get(worker_config_key('rclone_log_position', worker_id)))
+    log_follower.start()
+
+    try:
         # Account switching cycle
         while True:
-            logger.info('Switch to next SA..........\n')
-            last_sa = current_sa = get_next_sa_json_path(last_sa)
-            write_config('last_sa', current_sa)
-            logger.info('Get SA information, file: %s , email: %s\n' % (current_sa, get_email_from_sa(current_sa)))
-
-            # Switch Rclone command
-            if switch_sa_way == 'config':
-                switch_sa_by_config(current_sa)
-                cmd_rclone_current_sa = cmd_rclone
+            if standby is None and planner is not None and not planner.has_pending():
+                worker_logger.info('No files left to transfer\n')
+                return 0
+            if restart_same_sa:
+                restart_same_sa = False
+            elif standby is None:
+                worker_logger.info('Switch to next SA..........\n')
+                last_sa = current_sa = await acquire_next_sa_json_path_waiting(last_sa, worker_logger)
             else:
-                # By default, it is treated as 'runtime', with the '--drive-service-account-file' parameter appended
-                cmd_rclone_current_sa = cmd_rclone + ' --drive-service-account-file %s' % (current_sa,)
-
-            # Start a subprocess to rclone
-            getRcloneLogSize() # Check the rclone log size
-            proc = subprocess.Popen(cmd_rclone_current_sa, shell=True)
-
-            # Wait so that rclone is fully up
-            logger.info('Wait %s seconds to full call rclone command: %s\n' % (check_after_start, cmd_rclone_current_sa))
-            time.sleep(check_after_start)
-
-            # Record pid information
-            # Note that because the subprocess starts sh first, and then sh starts rclone, the actual pid information recorded here is sh
-            # proc.pid + 1 is usually the pid of the rclone process, but not sure
-            # So be sure to kill rclone with force_kill_rclone_subproc_by_parent_pid (sh_pid)
-            write_config('last_pid', proc.pid)
-            logger.info('Run Rclone command Success in pid %s\n' % (proc.pid + 1))
-
-            # The main process uses `rclone rc core / stats` to check the child process
-            cnt_error = 0
-            cnt_403_retry = 0
-            cnt_transfer_last = 0
-            cnt_get_rate_limit = False
+                # The standby takes over with its own account and port
+                last_sa = current_sa = standby.sa
+            job.write_config(worker_config_key('last_sa', worker_id), current_sa)
+            sa_used_before = quota_ledger.get_used_bytes().get(sa_pool.get_email(current_sa), 0)
+            worker_logger.info('Get SA information, file: %s , email: %s , already uploaded: %.2f GiB\n' % (
+                current_sa, sa_pool.get_email(current_sa), sa_used_before / pow(1024, 3)))
+
+            if standby is None:
+                # Start a subprocess to rclone
+                current_port = port
+                work_args, batch = prepare_rclone_work(job, current_port, planner, sa_daily_quota - sa_used_before, shard_filter)
+                if planner is not None:
+                    worker_logger.info('Batch of %s files (%.2f GiB) for this SA\n' % (
+                        len(batch), planner.batch_bytes(batch) / pow(1024, 3)))
+                cmd_rclone_current_sa = get_cmd_rclone_for_sa(
+                    get_cmd_rclone_next(cmd_rclone, rate_controller, worker_logger), current_sa, current_port, work_args)
+                log_follower.clear()  # Don't let the errors of the last rclone make this one switch
+                if log_follower.path != rclone_log:
+                    log_follower.follow(rclone_log)
+                rotateRcloneLog(rclone_log) # Check the rclone log size
+                proc = await start_rclone(cmd_rclone_current_sa)
+                rc = RcClient(current_port)
+
+                # Wait so that rclone is fully up
+                time_start_rclone = time.time()
+                worker_logger.info('Wait for rc to answer, rclone command: %s\n' % shlex.join(cmd_rclone_current_sa))
+                if not await wait_rclone_ready(proc, rc):
+                    if proc.returncode is not None:
+                        worker_logger.error('rclone has exited with code %s before rc answered\n' % proc.returncode)
+                    else:
+                        worker_logger.error('rc didn\'t answer in %s seconds, Force kill rclone\n' % rclone_start_timeout)
+                        await stop_rclone(proc)
+                    rc.close()
+                    job.record_stats('E', worker_label, current_sa, name='failed')
+                    return 1
+                worker_logger.info('rclone is up in %.2f seconds\n' % (time.time() - time_start_rclone))
+            else:
+                current_port = standby.port
+                proc = standby.proc
+                batch = standby.batch
+                rc = RcClient(current_port)
+                standby = None
+
+            # Record pid information, rclone is started without a shell so proc.pid is rclone itself
+            # The next run kills the rclone left by this one with force_kill_rclone_subproc_by_parent_pid
+            job.write_config(worker_config_key('last_pid', worker_id), proc.pid)
+            job.write_config(worker_config_key('last_standby_pid', worker_id), None)
+            if time_switch is not None:
+                metrics.observe('autorclone_switch_downtime_seconds', time.time() - time_switch, worker=worker_label)
+            rclone_pid = None
+            try:
+                rclone_pid = await rc.pid()
+                worker_logger.info('Run Rclone command Success in pid %s, memory in use: %.1f MiB\n' % (
+                    rclone_pid, (await rc.memstats()).get('Sys', 0) / pow(1024, 2)))
+            except RcError as error:
+                worker_logger.warning('Can\'t get rclone process information from rc: %s\n' % error)
+            job.record_stats('S', worker_label, current_sa)
+            job.workers_status[worker_id] = {'sa': sa_pool.get_email(current_sa), 'port': current_port, 'bytes': 0,
+                                             'speed': 0, 'transfers': 0, 'errors': 0, 'time': time.time()}
+            response_json = None
+            if rate_controller is not None:
+                rate_controller.start_process()
+                metrics.set('autorclone_tpslimit', rate_controller.tpslimit, worker=worker_label)
+                metrics.set('autorclone_transfers_limit', rate_controller.transfers, worker=worker_label)
+
+            # The main process uses the rc API `core/stats` to check the child process
+            rc_failed_since = None
+            stats_window = rule_engine.new_window()
+            cnt_transfer_recorded = 0
+            cnt_files_recorded = 0
+            cnt_log_events = {'quota': 0, 'rate_limit': 0, 'retry': 0, 'copied': 0, 'error': 0}
+            standby_failed = False
             while True:
+                if proc.returncode == 0 and planner is None:
+                    worker_logger.info('rclone has finished the transfer\n')
+                    job.record_stats('E', worker_label, current_sa, response_json, 'finished')
+                    return 0
+
+                # rclone has transferred its whole batch, go on with the next one
+                if proc.returncode == 0:
+                    worker_logger.info('rclone has transferred its batch\n')
+                    job.record_stats('E', worker_label, current_sa, response_json, 'batch')
+                    planner.finish(batch)
+                    batch = None
+                    time_switch = None
+                    rc.close()
+                    if standby is not None and await standby.check():
+                        # The standby goes on with its batch
+                        await standby.release(bwlimit)
+                        release_sa_json_path(current_sa)
+                    elif standby is not None:
+                        release_sa_json_path(standby.sa)
+                        planner.release(standby.batch)
+                        standby = None
+                    break
+
                 try:
-                    rclone_rc_cmd = "rclone rc core/stats --rc-addr=:{}".format(args.port)
-                    response = subprocess.check_output(rclone_rc_cmd, shell=True)
-                except subprocess.CalledProcessError as error:
-                    cnt_error = cnt_error + 1
-                    err_msg = 'check core/stats failed for %s times,' % cnt_error
-                    if cnt_error > 3:
-                        logger.error(err_msg + ' Force kill exist rclone process %s.\n' % proc.pid)
-                        proc.kill()
-                        logger.info("The rclone sync process has probably ended\n")
-                        logger.info(get_TotalTime(time_start)) # Sync ended
-                        exit(1)
-
-                    logger.warning(err_msg + ' Wait %s seconds to recheck.\n' % check_interval)
-                    time.sleep(check_interval)
+                    stats_json = await rc.stats()
+                except RcError as error:
+                    if proc.returncode == 0:
+                        continue  # rclone has exited after its transfer
+                    if rc_failed_since is None:
+                        rc_failed_since = time.time()
+                    err_msg = 'check core/stats failed for %.1f seconds (%s),' % (time.time() - rc_failed_since, error)
+                    if proc.returncode is not None or time.time() - rc_failed_since > rc_max_failed_time:
+                        worker_logger.error(err_msg + ' Force kill exist rclone process %s.\n' % proc.pid)
+                        await stop_rclone(proc)
+                        worker_logger.info("The rclone sync process has probably ended\n")
+                        job.record_stats('E', worker_label, current_sa, response_json, 'failed')
+                        return 1
+
+                    worker_logger.warning(err_msg + ' Wait %s seconds to recheck.\n' % check_interval)
+                    await asyncio.sleep(check_interval)
                     continue  # check again
                 else:
-                    cnt_error = 0
+                    rc_failed_since = None
+                    response_json = stats_json
 
-                # Parse 'rclone rc core/stats' output
-                response_json = json.loads(response.decode('utf-8').replace('\0', ''))
+                # Parse rc core/stats output
                 cnt_transfer = response_json.get('bytes', 0)
 
+                # Journal the files rclone has finished, the log may have missed some of them
+                await journal_transferred(job, planner, rc)
+
+                # Record the bytes uploaded since the last check in the quota ledger
+                if cnt_transfer > cnt_transfer_recorded:
+                    quota_ledger.record(sa_pool.get_email(current_sa), cnt_transfer - cnt_transfer_recorded)
+                    metrics.inc('autorclone_transferred_bytes_total', cnt_transfer - cnt_transfer_recorded, worker=worker_label)
+                    cnt_transfer_recorded = cnt_transfer
+                if response_json.get('transfers', 0) > cnt_files_recorded:
+                    metrics.inc('autorclone_transferred_files_total', response_json['transfers'] - cnt_files_recorded,
+                                worker=worker_label)
+                    cnt_files_recorded = response_json['transfers']
+                metrics.set('autorclone_speed_bytes', response_json.get('speed', 0), worker=worker_label)
+                metrics.set('autorclone_transferring', len(response_json.get('transferring') or []), worker=worker_label)
+                if rclone_pid is not None:
+                    try:
+                        metrics.set('autorclone_rclone_rss_bytes', psutil.Process(rclone_pid).memory_info().rss,
+                                    worker=worker_label)
+                    except psutil.Error:
+                        pass  # rclone has exited, the next check handles it
+
                 # Output the current situation
-                logger.info('Transfer Status - Upload: %s GiB, Avg upspeed: %s MiB/s, Transfered: %s.' % (
+                worker_logger.info('Transfer Status - Upload: %s GiB, Avg upspeed: %s MiB/s, Transfered: %s. '
+                                   'Log: %s copied, %s retries, %s 403, %s errors.' % (
                     response_json.get('bytes', 0) / pow(1024, 3),
                     response_json.get('speed', 0) / pow(1024, 2),
-                    response_json.get('transfers', 0)
+                    response_json.get('transfers', 0),
+                    cnt_log_events['copied'], cnt_log_events['retry'], cnt_log_events['rate_limit'] + cnt_log_events['quota'],
+                    cnt_log_events['error']
                 ))
+                job.write_config(worker_config_key('rclone_log_position', worker_id), log_follower.get_position())
+
+                job.workers_status[worker_id].update({
+                    'bytes': response_json.get('bytes', 0), 'speed': response_json.get('speed', 0),
+                    'transfers': response_json.get('transfers', 0), 'errors': response_json.get('errors', 0),
+                    'time': time.time()})
 
                 # Determine if the switch should be made
-                should_switch = 0
-                switch_reason = 'Switch Reason: '
-
-                # Check if the current total upload exceeds 750 GB
-                if switch_sa_rules.get('up_than_750', False):
-                    if cnt_transfer > 750 * pow(1000, 3):  # This is 750GB instead of 750GiB
-                        should_switch += 1
-                        switch_reason += 'Rule `up_than_750` hit, '
-
-                # Check the amount of rclone transmissions during monitoring
-                if switch_sa_rules.get('zero_transferred_between_check_interval', False):
-                    if cnt_transfer - cnt_transfer_last == 0:  # Not added
-                        cnt_403_retry += 1
-                        if cnt_403_retry % 10 == 0:
-                            logger.warning('Rclone seems not transfer in %s checks' % cnt_403_retry)
-                        if cnt_403_retry >= 100:  # No increase in more than 100 inspections
-                            should_switch += 1
-                            switch_reason += 'Rule `zero_transferred_between_check_interval` hit, '
-                    else:
-                        cnt_403_retry = 0
-                    cnt_transfer_last = cnt_transfer
-
-                # Rclone prompt error 403 ratelimitexceed directly
-                if switch_sa_rules.get('error_user_rate_limit', False):
-                    last_error = response_json.get('lastError', '')
-                    if last_error.find('userRateLimitExceeded') > -1:
-                        should_switch += 1
-                        switch_reason += 'Rule `error_user_rate_limit` hit, '
-
-                # Check the current transferring transfer
-                if switch_sa_rules.get('all_transfers_in_zero', False):
-                    graceful = True
-                    if response_json.get('transferring', False):
-                        for transfer in response_json['transferring']:
-                            # Handle the case where `bytes` or` speed` does not exist (the transfer is considered complete) @ yezi1000
-                            if 'bytes' not in transfer or 'speed' not in transfer:
-                                continue
-                            elif transfer.get('bytes', 0) != 0 and transfer.get('speed', 0) > 0:  # There are currently outstanding transfers
-                                graceful = False
-                                break
-                    if graceful:
-                        should_switch += 1
-                        switch_reason += 'Rule `all_transfers_in_zero` hit, '
+                stats_window.add(response_json, cnt_log_events)
+                job.record_stats('C', worker_label, current_sa, response_json, quota=cnt_log_events['quota'] > 0 or
+                                 'userRateLimitExceeded' in (response_json.get('lastError') or ''))
+                sa_left = sa_daily_quota - sa_used_before - cnt_transfer
+
+                # Follow the rate limit errors and the speed of rclone for the limits of the next one
+                if rate_controller is not None:
+                    rate_controller.update(stats_window)
+                switch_weight, rules_hit = rule_engine.evaluate(stats_window, sa_left)
 
                 # Greater than the set replacement level
-                if should_switch >= switch_sa_level:
-                    logger.info('Transfer Limit may hit (%s), Try to Switch..........\n' % switch_reason)
-                    force_kill_rclone_subproc_by_parent_pid(proc.pid)  # Kill the current rclone process
+                if rule_engine.should_switch(switch_weight):
+                    switch_reason = 'Switch Reason: ' + ', '.join('Rule `%s` hit' % rule for rule in rules_hit)
+                    worker_logger.info('Transfer Limit may hit (%s), Try to Switch..........\n' % switch_reason)
+                    time_switch = time.time()
+                    job.record_stats('W', worker_label, current_sa, response_json, ','.join(rules_hit))
+                    for rule in rules_hit:
+                        metrics.inc('autorclone_switch_reasons_total', rule=rule)
+                    if any(rule in quota_exhausted_rules for rule in rules_hit):
+                        quota_ledger.mark_exhausted(sa_pool.get_email(current_sa))
+                    if drain_switch_rules and all(rule in drain_switch_rules for rule in rules_hit):
+                        response_json = await drain_rclone(proc, rc, response_json, sa_left, worker_logger)
+                        await journal_transferred(job, planner, rc)
+                        if response_json.get('bytes', 0) > cnt_transfer_recorded:
+                            quota_ledger.record(sa_pool.get_email(current_sa),
+                                                response_json['bytes'] - cnt_transfer_recorded)
+                            metrics.inc('autorclone_transferred_bytes_total',
+                                        response_json['bytes'] - cnt_transfer_recorded, worker=worker_label)
+                            cnt_transfer_recorded = response_json['bytes']
+                        time_switch = time.time()  # rclone has transferred until now
+                    rc.close()
+                    if planner is not None:
+                        planner.release(batch)
+                        batch = None
+                    if standby is not None and await standby.check():
+                        metrics.inc('autorclone_switches_total', worker=worker_label, way='standby')
+                        # Hand over to the standby, it is ready (or still listing) so it goes on right away
+                        await stop_rclone(proc, current_port)  # Stop the current rclone process
+                        log_follower.clear()
+                        log_follower.follow(standby.log)
+                        await standby.release(bwlimit)
+                        release_sa_json_path(current_sa)
+                        worker_logger.info('Hand over to the standby rclone of %s in %.2f seconds\n' % (
+                            standby.sa, time.time() - time_switch))
+                    else:
+                        metrics.inc('autorclone_switches_total', worker=worker_label, way='restart')
+                        if standby is not None:
+                            await standby.kill()
+                            release_sa_json_path(standby.sa)
+                            if planner is not None:
+                                planner.release(standby.batch)
+                            standby = None
+                        await stop_rclone(proc, current_port)  # Stop the current rclone process
                     break  # Exit the main process monitoring cycle to switch to the next account
 
-                time.sleep(check_interval)
+                # A rate limit error, restart rclone with lower limits and the same account
+                if rate_controller is not None and rate_controller.should_restart():
+                    worker_logger.info('Rate limit error, restart rclone with lower limits\n')
+                    time_switch = time.time()
+                    job.record_stats('E', worker_label, current_sa, response_json, 'rate_limit')
+                    rc.close()
+                    if planner is not None:
+                        planner.release(batch)
+                        batch = None
+                    if standby is not None:
+                        # Started with the limits before the error
+                        await standby.kill()
+                        release_sa_json_path(standby.sa)
+                        if planner is not None:
+                            planner.release(standby.batch)
+                        standby = None
+                    await stop_rclone(proc, current_port)
+                    restart_same_sa = True
+                    break
+
+                # Start the standby when the account would reach its quota within standby_lead_time
+                # No standby while all the accounts are in use, it is tried again at the next check
+                standby_sa = None
+                if warm_standby and standby is None and not standby_failed:
+                    if sa_left < response_json.get('speed', 0) * standby_lead_time and \
+                            (planner is None or planner.has_pending()):
+                        standby_sa = acquire_next_sa_json_path(current_sa, release_last=False)
+                    if standby_sa is not None:
+                        standby_port = port + standby_port_offset if current_port == port else port
+                        work_args, standby_batch = prepare_rclone_work(
+                            job, standby_port, planner,
+                            sa_daily_quota - quota_ledger.get_used_bytes().get(sa_pool.get_email(standby_sa), 0),
+                            shard_filter)
+                        standby = StandbyRclone(get_cmd_rclone_next(cmd_rclone, rate_controller, worker_logger),
+                                                standby_sa, standby_port,
+                                                standby_log if log_follower.path == rclone_log else rclone_log,
+                                                work_args, standby_batch)
+                        rotateRcloneLog(standby.log)
+                        await standby.start()
+                        job.write_config(worker_config_key('last_standby_pid', worker_id), standby.proc.pid)
+                        worker_logger.info('%.2f GiB left, start the standby rclone of %s: %s\n' % (
+                            sa_left / pow(1024, 3), standby_sa, shlex.join(standby.cmd)))
+
+                # Wait for the next check while handling the events of the rclone log
+                # A quota error checks right away, a standby is checked more often until it is paused
+                time_next_check = time.time() + check_interval
+                while time.time() < time_next_check:
+                    timeout = time_next_check - time.time()
+                    if standby is not None and not standby.paused:
+                        if not await standby.check():
+                            worker_logger.warning('The standby rclone of %s has exited with code %s, switch without it\n' % (
+                                standby.sa, standby.proc.returncode))
+                            release_sa_json_path(standby.sa)
+                            if planner is not None:
+                                planner.release(standby.batch)
+                            standby = None
+                            standby_failed = True
+                        elif standby.paused:
+                            worker_logger.info('The standby rclone of %s is ready and paused\n' % standby.sa)
+                        else:
+                            timeout = min(timeout, standby_check_interval)
+                    try:
+                        event = await asyncio.wait_for(log_follower.events.get(), max(0, timeout))
+                    except asyncio.TimeoutError:
+                        continue
+                    cnt_log_events[event['type']] += 1
+                    if event['type'] == 'copied':
+                        record_transferred(job, planner, event['object'])
+                    if event['type'] == 'quota':
+                        worker_logger.warning('Quota error in the rclone log: %s %s\n' % (event['object'], event['msg']))
+                    if event['type'] in rule_engine.log_event_types:
+                        break
+    finally:
+        # Also reached when the worker is cancelled, don't leave rclone processes behind
+        if proc is not None and proc.returncode is None:
+            await stop_rclone(proc, current_port)
+            job.record_stats('E', worker_label, current_sa, response_json, 'stopped')
+        if standby is not None:
+            await standby.kill()
+            release_sa_json_path(standby.sa)
+        if planner is not None:
+            planner.release(batch)
+            if standby is not None:
+                planner.release(standby.batch)
+        release_sa_json_path(current_sa)
+        job.write_config(worker_config_key('rclone_log_position', worker_id), log_follower.get_position())
+        job.workers_status.pop(worker_id, None)
+        log_follower.stop()
+        if job.journal is not None:
+            job.journal.flush()
+
+
+# Stop on SIGINT and SIGTERM by cancelling the running task, which stops the rclone processes, and serve the metrics
+# Return the metrics server
+async def start_supervisor(metrics_port=None, handle_signals=True):
+    loop = asyncio.get_running_loop()
+    if handle_signals:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, asyncio.current_task().cancel)
+
+    server = None
+    if metrics_port is not None:
+        server = await asyncio.start_server(handle_metrics_request, metrics_host, metrics_port)
+        logger.info('Serve metrics on http://%s:%s/metrics\n' % (metrics_host, metrics_port))
+
+    if sa_leases.kind is not None:
+        background_tasks.add(asyncio.ensure_future(renew_sa_leases()))
+    return server
+
+
+# Run the workers of the job given on the command line in one event loop
+async def supervise(job, metrics_port=None):
+    await start_supervisor(metrics_port)
+    return await run_job(job)
+
+
+# Run a job: the files which failed the last verification, the transfer and its verification, return the exit code
+async def run_job(job):
+    job.state = 'running'
+    await job.kill_last_rclone()
+
+    # The files which failed the last verification first
+    retry_path = job.path(verify_retry_path)
+    if os.path.exists(retry_path):
+        job.logger.info('Transfer again the files which failed the last verification\n')
+        cmd_rclone_retry = get_copy_cmd(job.cmd_rclone) + ['--files-from-raw', retry_path, '--no-traverse', '--ignore-times']
+        exit_code = await run_worker(job, 0, cmd_rclone_retry, job.port, job.path(rclone_log_file))
+        if exit_code != 0:
+            return finish_transfer(job, exit_code)
+        os.remove(retry_path)
+
+    exit_code = await transfer_job(job)
+    # The files which fail the verification are in the retry list, the job ends with the code of the transfer
+    if exit_code == 0 and job.verify:
+        await verify_job(job)
+    return finish_transfer(job, exit_code)
+
+
+# Run the workers of a job, return the highest exit code of the workers
+async def transfer_job(job):
+    # Every worker needs its own account
+    workers = max(1, job.workers)
+    if workers > len(sa_pool):
+        job.logger.warning('Only %s Service Accounts for %s workers, use %s workers.\n' % (len(sa_pool), workers, len(sa_pool)))
+        workers = len(sa_pool)
+
+    # All the workers would share the same section of rclone.conf
+    if workers > 1 and switch_sa_way == 'config':
+        job.logger.warning('switch_sa_way `config` can only be used by one worker, use 1 worker.\n')
+        workers = 1
+
+    rclone_log = job.path(rclone_log_file)
+    root, ext = os.path.splitext(rclone_log)
+
+    if job.manifest:
+        # The workers take their batches from the same plan, there is no need to split the source
+        planner = await build_batch_planner(job)
+        if 'sync' in job.cmd_rclone:
+            job.logger.warning('`sync` can\'t delete files at the destination with batches, use `copy`\n')
+        cmd_rclone_batch = get_copy_cmd(job.cmd_rclone) + ['--no-traverse']
+        worker_runs = []
+        for worker_id in range(workers):
+            worker_log = rclone_log if worker_id == 0 else '%s.%s%s' % (root, worker_id, ext)
+            worker_runs.append(run_worker(job, worker_id, cmd_rclone_batch, job.port + worker_id, worker_log, planner))
+        return max(await asyncio.gather(*worker_runs))
+
+    if workers == 1:
+        return await run_worker(job, 0, job.cmd_rclone, job.port, rclone_log)
+
+    # Split the source, each worker syncs its shard with the rules of its filter
+    job.logger.info('Split %s into %s shards by %s\n' % (job.source, workers, job.shard_by))
+    shards = await split_source_into_shards(job.source, workers, job.shard_by)
+    worker_runs = []
+    for worker_id, shard in enumerate(shards):
+        if not shard:
+            continue
+        filter_path = job.path(shard_filter_path) % worker_id
+        write_shard_filter(shard, filter_path)
+        job.logger.info('Worker %s gets %s entries (%.2f GiB)\n' % (
+            worker_id, len(shard), sum(entry[2] for entry in shard) / pow(1024, 3)))
+        worker_log = rclone_log if worker_id == 0 else '%s.%s%s' % (root, worker_id, ext)
+        worker_runs.append(run_worker(job, worker_id, job.cmd_rclone, job.port + worker_id, worker_log,
+                                      shard_filter=filter_path))
+    return max(await asyncio.gather(*worker_runs) or [0])
+
+
+# Check the files of the journal with rclone check, verify_processes at once with an account each
+# Write the ones missing or different at the destination to the retry list, return how many they are
+async def verify_job(job):
+    # A move has deleted the files from the source, there is nothing to compare them with
+    if 'move' in job.cmd_rclone:
+        job.logger.warning('The files of a move can\'t be verified, they are gone from the source\n')
+        return 0
+    files = sorted(job.journal.get_transferred())
+    if not files:
+        return 0
+    processes = max(1, min(verify_processes, len(files), len(sa_pool)))
+    job.logger.info('Verify the %s transferred files with %s rclone check at once\n' % (len(files), processes))
+    time_start = time.time()
+    results = await asyncio.gather(*[verify_files(job, i, files[i::processes]) for i in range(processes)])
+    failed = sorted(path for result in results for path in result)
+    if failed:
+        write_batch_file(failed, job.path(verify_retry_path))
+        job.logger.warning('%s of the %s files are missing or differ at the destination, the next run transfers them '
+                           'again (%s)\n' % (len(failed), len(files), job.path(verify_retry_path)))
+    else:
+        job.logger.info('The %s files are verified in %.1f seconds\n' % (len(files), time.time() - time_start))
+    # The retry list has the files to transfer again
+    job.journal.clear()
+    return len(failed)
+
+
+# Check some files with a rclone check of its own account, return the files which failed
+async def verify_files(job, index, files):
+    files_path = job.path(verify_files_path) % index
+    result_path = job.path(verify_result_path) % index
+    write_batch_file(files, files_path)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    # rclone check doesn't upload, an exhausted account can do it
+    sa = await acquire_next_sa_json_path_waiting('', job.logger, allow_exhausted=True)
+    cmd = [rclone_bin, 'check', job.source, job.destination, '--files-from-raw', files_path,
+           '--combined', result_path] + shlex.split(verify_flags)
+    if switch_sa_way != 'config':
+        cmd += ['--drive-service-account-file', sa]
+    proc = None
+    try:
+        proc = await start_rclone(cmd)
+        await proc.wait()
+    finally:
+        if proc is not None and proc.returncode is None:
+            await stop_rclone(proc)
+        release_sa_json_path(sa)
+    # rclone check exits with 1 when files differ, with another code when it couldn't check them
+    if proc.returncode not in (0, 1) or not os.path.exists(result_path):
+        job.logger.warning('rclone check of %s files has exited with code %s, they are all transferred again\n' % (
+            len(files), proc.returncode))
+        return files
+    failed = []
+    with open(result_path) as f:
+        for line in f:
+            # '= ' the same, '- ' missing at the destination, '* ' different, '! ' error, '+ ' only at the destination
+            if line[:2] in ('- ', '* ', '! '):
+                failed.append(line[2:].rstrip('\n'))
+    return failed
+
+
+# Exit code of the job, the journal isn't needed anymore when the transfer is complete
+def finish_transfer(job, exit_code):
+    if exit_code == 0 and job.journal is not None:
+        job.journal.clear()
+    job.state = 'done' if exit_code == 0 else 'failed'
+    job.exit_code = exit_code
+    return exit_code
+
+
+# A job from its description (the keys of a job file of the daemon queue), in daemon_state_dir/<name>
+def new_job(name, spec):
+    if not isinstance(spec, dict) or not spec.get('source') or not spec.get('destination'):
+        raise ValueError('a job needs a source and a destination')
+    if spec.get('mode', rclone_mode) not in ('sync', 'copy', 'move'):
+        raise ValueError('unknown mode %r' % spec['mode'])
+    return Job(name, spec['source'], spec['destination'], None, state_dir=os.path.join(daemon_state_dir, name),
+               mode=spec.get('mode'), flags=spec.get('flags', ''), priority=int(spec.get('priority', 0)),
+               workers=int(spec.get('workers', 1)), shard_by=spec.get('shard_by', 'size'),
+               warm_standby=bool(spec.get('warm_standby', False)), manifest=bool(spec.get('manifest', False)),
+               index=bool(spec.get('index', False)), rate_control=bool(spec.get('rate_control', False)),
+               verify=bool(spec.get('verify', False)))
+
+
+# A job of the daemon queue, its name is the name of its json file
+def load_job(path):
+    with open(path) as f:
+        spec = json.load(f)
+    return new_job(os.path.splitext(os.path.basename(path))[0], spec)
+
+
+# Move the file of a job which has ended to QUEUE_DIR/done or QUEUE_DIR/failed
+def finish_queued_job(queue_dir, path, succeeded):
+    try:
+        os.replace(path, os.path.join(queue_dir, 'done' if succeeded else 'failed', os.path.basename(path)))
+    except FileNotFoundError:
+        logger.warning('The job file %s has been removed from the queue while the job ran\n' % path)
+
+
+# Run the queued jobs, the highest priority (then the oldest file) first, max_jobs at once
+# All the jobs take their accounts from the same pool, an account is never used by two of them at the same time
+async def run_daemon(queue_dir, max_jobs, port, metrics_port=None):
+    await start_supervisor(metrics_port)
+    for folder in ('done', 'failed'):
+        os.makedirs(os.path.join(queue_dir, folder), exist_ok=True)
+    logger.info('Run the jobs queued in %s, %s at once\n' % (queue_dir, max_jobs))
+
+    running = {}  # Job file -> (job, slot, task)
+    unreadable = set()  # Job files which can't be read yet, they may still be written
+    try:
+        while True:
+            for path, (job, slot, task) in list(running.items()):
+                if not task.done():
+                    continue
+                del running[path]
+                job.close()
+                if task.exception() is not None:
+                    job.logger.error('The job has failed: %r\n' % task.exception())
+                    finish_queued_job(queue_dir, path, False)
+                else:
+                    job.logger.info('The job has ended with code %s\n' % task.result())
+                    finish_queued_job(queue_dir, path, task.result() == 0)
+
+            free_slots = sorted(set(range(max_jobs)) - set(slot for _, slot, _ in running.values()))
+            queued = []
+            for path in glob.glob(os.path.join(queue_dir, '*.json')) if free_slots else []:
+                if path in running:
+                    continue
+                try:
+                    job = load_job(path)
+                except (OSError, ValueError, TypeError) as error:
+                    try:
+                        changed = time.time() - os.path.getmtime(path)
+                    except OSError:
+                        continue  # Removed in the meantime
+                    if changed < daemon_job_write_time:
+                        if path not in unreadable:
+                            logger.warning('Can\'t load the job %s yet, try again: %s\n' % (path, error))
+                            unreadable.add(path)
+                        continue
+                    logger.error('Can\'t load the job %s: %s\n' % (path, error))
+                    unreadable.discard(path)
+                    finish_queued_job(queue_dir, path, False)
+                    continue
+                unreadable.discard(path)
+                queued.append((-job.priority, os.path.getmtime(path), path, job))
+
+            for (_, _, path, job), slot in zip(sorted(queued, key=lambda item: item[:3]), free_slots):
+                job.port = port + slot * job_port_stride
+                try:
+                    job.open()
+                except (OSError, ValueError, sqlite3.Error) as error:
+                    job.logger.error('Can\'t open the state of the job: %s\n' % error)
+                    finish_queued_job(queue_dir, path, False)
+                    continue
+                job.logger.info('Start the job: %s -> %s on port %s\n' % (job.source, job.destination, job.port))
+                running[path] = (job, slot, asyncio.ensure_future(run_job(job)))
+
+            await asyncio.sleep(daemon_poll_interval)
+    finally:
+        # The queued files of the running jobs stay in the queue, the next start of the daemon resumes them
+        for job, _, task in running.values():
+            task.cancel()
+        await asyncio.gather(*[task for _, _, task in running.values()], return_exceptions=True)
+        for job, _, _ in running.values():
+            job.close()
+
+
+# Load the account pool, the quota ledger, the leases and the switch rules shared by every job of the process
+def open_shared_state(service_accounts, leases=None, rules=None):
+    global sa_pool, sa_leases, quota_ledger, rule_engine
+
+    pool = load_sa_pool(service_accounts)
+    if len(pool) == 0:
+        raise ValueError('No usable Service Account Credentials JSON file exists')
+    try:
+        sa_leases = open_sa_leases(leases or sa_lease_backend)
+    except (OSError, ValueError, sqlite3.Error) as error:
+        raise ValueError('Can\'t open the Service Account leases: %s' % error)
+    try:
+        rule_engine = load_rule_engine(rules or (switch_rules_path if os.path.exists(switch_rules_path) else None))
+    except (OSError, ValueError, TypeError) as error:
+        raise ValueError('Can\'t load the switch rules: %s' % error)
+    sa_pool = pool
+    quota_ledger = QuotaLedger(quota_ledger_path)
+
+
+# Run the supervisor from another program, its event loop runs in a background thread:
+#
+#   import autorclone
+#   supervisor = autorclone.Supervisor('/path/to/sa', check_interval=5, rclone_flags='--fast-list')
+#   supervisor.start()
+#   supervisor.submit('src:', 'GDrive:backup', name='backup', workers=2, mode='copy')
+#   print(supervisor.status())
+#   exit_code = supervisor.wait('backup')
+#   supervisor.stop()
+#
+# The options of submit are the keys of a job file of the daemon queue, the jobs share the accounts like in the daemon
+# The program sets up the logging of the 'autorclone' logger itself (or calls autorclone.setup_logging())
+class Supervisor:
+    def __init__(self, service_accounts, port=5572, leases=None, rules=None, metrics_port=None, **config):
+        configure(**config)
+        self.service_accounts = service_accounts
+        self.port = port
+        self.leases = leases
+        self.rules = rules
+        self.metrics_port = metrics_port
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.jobs = {}  # Name: (job, slot, task, concurrent.futures.Future of the exit code)
+        self.lock = threading.Lock()
+
+    def start(self):
+        global supervisor
+
+        if supervisor is not None:
+            raise RuntimeError('A Supervisor is already running in this process')
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='autorclone', daemon=True)
+        self.thread.start()
+        try:
+            self.server = self.call(self._start())
+        except BaseException:
+            self._stop_loop()
+            raise
+        supervisor = self
+        return self
+
+    # The SQLite databases are used by the thread which opens them, open them in the event loop
+    async def _start(self):
+        open_shared_state(self.service_accounts, self.leases, self.rules)
+        return await start_supervisor(self.metrics_port, handle_signals=False)
+
+    def _stop_loop(self, timeout=None):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.loop.close()
+        self.loop = None
+
+    # Run a coroutine in the event loop, wait for its result
+    def call(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # Start a job, in daemon_state_dir/<name> with the rc ports from port + slot * job_port_stride
+    def submit(self, source, destination, name=None, **options):
+        spec = dict(options, source=source, destination=destination)
+        with self.lock:
+            name = name or 'job%s' % (len(self.jobs) + 1)
+            if name in self.jobs and not self.jobs[name][3].done():
+                raise ValueError('the job %s is still running' % name)
+            job = new_job(name, spec)
+            running = set(slot for other, slot, _, future in self.jobs.values() if not future.done())
+            slot = min(set(range(len(running) + 1)) - running)
+            job.port = self.port + slot * job_port_stride
+            future = concurrent.futures.Future()
+            self.jobs[name] = (job, slot, None, future)
+        self.call(self._start_job(name, job, future))
+        return name
+
+    async def _start_job(self, name, job, future):
+        try:
+            job.open()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        job.logger.info('Start the job: %s -> %s on port %s\n' % (job.source, job.destination, job.port))
+        task = asyncio.ensure_future(self._run_job(job, future))
+        with self.lock:
+            self.jobs[name] = (job, self.jobs[name][1], task, future)
+
+    async def _run_job(self, job, future):
+        try:
+            exit_code = await run_job(job)
+        except asyncio.CancelledError:
+            job.state = 'stopped'
+            future.cancel()
+            raise
+        except Exception as error:
+            job.logger.error('The job has failed: %r\n' % error)
+            job.state = 'failed'
+            future.set_exception(error)
+            return
+        finally:
+            job.close()
+        job.logger.info('The job has ended with code %s\n' % exit_code)
+        future.set_result(exit_code)
+
+    # Exit code of a job once it has ended
+    def wait(self, name, timeout=None):
+        return self.jobs[name][3].result(timeout)
+
+    # The jobs, their workers and the accounts in use
+    def status(self):
+        return self.call(self._status())
+
+    async def _status(self):
+        jobs = {}
+        for name, (job, _, _, _) in list(self.jobs.items()):
+            jobs[name] = {
+                'state': job.state,
+                'exit_code': job.exit_code,
+                'source': job.source,
+                'destination': job.destination,
+                'port': job.port,
+                'workers': {worker_id: dict(status) for worker_id, status in job.workers_status.items()},
+            }
+        return {'running': self.thread is not None and self.thread.is_alive(), 'service_accounts': len(sa_pool),
+                'in_use': len(sa_in_use), 'jobs': jobs}
+
+    # Stop the jobs (their rclone processes are killed, a job resumes where it was when it is submitted again)
+    def stop(self, timeout=None):
+        global supervisor
+
+        if self.loop is None:
+            return
+        self.call(self._stop(), timeout)
+        self._stop_loop(timeout)
+        supervisor = None
+
+    async def _stop(self):
+        tasks = [task for _, _, task, _ in self.jobs.values() if task is not None] + list(background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        background_tasks.clear()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        quota_ledger.close()
+        sa_leases.close()
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+
+    if args.report is not None:
+        if not args.report and not stats_history_path:
+            logger.error('No history is recorded, set stats_history_path.\n')
+            exit(1)
+        if args.report:
+            report_stats_history(args.report)
+        elif args.state_dir is not None:
+            report_stats_history(os.path.join(args.state_dir, os.path.basename(stats_history_path)))
+        else:
+            report_stats_history(stats_history_path)
+        exit(0)
+
+    if args.plan is not None:
+        try:
+            engine = load_rule_engine(args.rules or (switch_rules_path if os.path.exists(switch_rules_path) else None))
+            plan_transfer(args.plan, engine, max(1, args.workers), args.manifest or args.index or args.warm_standby,
+                          args.warm_standby)
+        except (OSError, ValueError, TypeError, IndexError) as error:
+            logger.error('Can\'t plan the transfer: %s\n' % error)
+            exit(1)
+        exit(0)
+
+    import filelock
+
+    if args.daemon is not None:
+        job = None
+        os.makedirs(daemon_state_dir, exist_ok=True)
+        instance_check = filelock.FileLock(os.path.join(daemon_state_dir, os.path.basename(instance_lock_path)))
+    else:
+        job = Job(None, args.source, args.destination, args.port, state_dir=args.state_dir,
+                  workers=args.workers, shard_by=args.shard_by, warm_standby=args.warm_standby, manifest=args.manifest,
+                  index=args.index, refresh_index=args.refresh_index, rate_control=args.rate_control, verify=args.verify)
+        if args.state_dir is not None:
+            os.makedirs(args.state_dir, exist_ok=True)
+        instance_check = filelock.FileLock(job.path(instance_lock_path))
+
+    # Start Time
+    time_start = time.time()
+    str_timeStart = "Started at: {}\n".format(time.strftime("%H:%M:%S"))
+    logger.info(str_timeStart) # Log the start time
+
+    with instance_check.acquire(timeout=0):
+        # Load account information, the quota used by every account, the accounts used by the other hosts
+        # and the rules which make a switch
+        if args.preflight:
+            configure(sa_preflight=True)
+        try:
+            open_shared_state(args.service_accounts, args.leases, args.rules)
+        except (OSError, ValueError, TypeError, sqlite3.Error) as error:
+            logger.error('%s\n' % error)
+            exit(1)
+
+        if job is None:
+            try:
+                asyncio.run(run_daemon(args.daemon, max(1, args.max_jobs), args.port, args.metrics_port))
+            except asyncio.CancelledError:
+                logger.info('Stopped by signal, the rclone processes are killed\n')
+            logger.info(get_TotalTime(time_start))
+            exit(0)
+
+        # Load instance configuration, the journal and the index
+        job.open()
+
+        # Check the sa information recorded last time, if any, rearrange the pool
+        # So we start with a new 750G every time
+        last_sa = job.config.get('last_sa', '')
+        if last_sa in sa_pool:
+            logger.info('Get `last_sa` from config, resort the Service Account pool\n')
+            sa_pool.rotate(last_sa)
+
+        try:
+            exit_code = asyncio.run(supervise(job, args.metrics_port))
+        except asyncio.CancelledError:
+            logger.info('Stopped by signal, the rclone processes are killed\n')
+            exit_code = 1
+        job.close()
+
+        logger.info(get_TotalTime(time_start)) # Sync ended
+        exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
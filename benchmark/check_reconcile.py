@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Run deprecated/reconcile.py against fake_drive_api.py and check the members of the drives after every run:
+#   --dry-run  changes nothing
+#   a run      adds the missing accounts and gives the role to the others, leaves the other members alone
+#   --prune    also removes the service accounts which are not in the folder, never the other users
+#   a new run  finds nothing to change
+# A share of the batched requests is answered with 429 (--rate-limit) so that the retries are exercised.
+#
+# python3 benchmark/check_reconcile.py --accounts 1000 --rate-limit 0.05
+
+import os
+import sys
+import json
+import pickle
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from google.oauth2.credentials import Credentials
+
+benchmark_location = os.path.dirname(os.path.abspath(__file__))
+reconcile_path = os.path.join(os.path.dirname(benchmark_location), 'deprecated', 'reconcile.py')
+sys.path.insert(0, benchmark_location)
+
+from fake_drive_api import FakeDrives, start_server  # noqa: E402
+
+sa_email = 'sa%s@reconcile-check.iam.gserviceaccount.com'
+stale_email = 'old%s@reconcile-check.iam.gserviceaccount.com'
+user_email = 'someone@example.com'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check reconcile.py against a stand-in of the Drive API.')
+    parser.add_argument('--accounts', type=int, default=250, help='Service accounts in the folder.')
+    parser.add_argument('--rate-limit', type=float, default=0.05, help='Share of the batched requests answered with 429.')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch folder for debugging.')
+    return parser.parse_args()
+
+
+# The folder of the accounts and a token which reconcile.py takes as valid
+def write_scratch(scratch, accounts):
+    os.makedirs(os.path.join(scratch, 'accounts'))
+    for i in range(accounts):
+        with open(os.path.join(scratch, 'accounts', 'sa%s.json' % i), 'w') as f:
+            json.dump({'type': 'service_account', 'client_email': sa_email % i}, f)
+    with open(os.path.join(scratch, 'token.pickle'), 'wb') as f:
+        pickle.dump(Credentials(token='fake-token'), f)
+
+
+# Drive A has half of the accounts, some of them with another role, two old accounts and a user
+# Drive B has no member
+def get_drives(accounts):
+    members = [{'emailAddress': sa_email % i, 'role': 'reader' if i % 4 == 0 else 'fileOrganizer'}
+               for i in range(0, accounts, 2)]
+    members += [{'emailAddress': stale_email % i, 'role': 'fileOrganizer'} for i in range(2)]
+    members.append({'emailAddress': user_email, 'role': 'organizer'})
+    return {'driveA': members, 'driveB': []}
+
+
+def run_reconcile(scratch, endpoint, *args):
+    result = subprocess.run([sys.executable, reconcile_path, '-p', 'accounts', '-d', 'driveA', 'driveB',
+                             '--api-endpoint', endpoint] + list(args),
+                            cwd=scratch, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return result.returncode, result.stdout
+
+
+def main():
+    args = parse_args()
+    scratch = tempfile.mkdtemp(prefix='reconcile-check-')
+    write_scratch(scratch, args.accounts)
+    drives = FakeDrives(get_drives(args.accounts), args.rate_limit, seed=0)
+    server = start_server(drives)
+    endpoint = 'http://%s:%s/' % server.server_address[:2]
+
+    wanted = dict((sa_email % i, 'fileOrganizer') for i in range(args.accounts))
+    stale = dict((stale_email % i, 'fileOrganizer') for i in range(2))
+    before = drives.get_members()
+    steps = [
+        ('--dry-run', ['--dry-run', '--prune'], before),
+        ('run', [], {'driveA': dict(wanted, **dict(stale, **{user_email: 'organizer'})), 'driveB': wanted}),
+        ('--prune', ['--prune'], {'driveA': dict(wanted, **{user_email: 'organizer'}), 'driveB': wanted}),
+        ('run again', ['--prune'], {'driveA': dict(wanted, **{user_email: 'organizer'}), 'driveB': wanted}),
+    ]
+    failed = False
+    try:
+        for name, reconcile_args, expected in steps:
+            requests_before = drives.requests
+            exit_code, output = run_reconcile(scratch, endpoint, *reconcile_args)
+            members = drives.get_members()
+            ok = exit_code == 0 and members == expected
+            if name == 'run again':
+                ok = ok and output.count('0 to add, 0 to change') == 2
+            print('%-10s %s  exit code %s, %s requests, members: %s' % (
+                name, 'OK  ' if ok else 'FAIL', exit_code, drives.requests - requests_before,
+                ', '.join('%s %s' % (drive_id, len(members[drive_id])) for drive_id in sorted(members))))
+            if not ok:
+                failed = True
+                print(output)
+                for drive_id in sorted(expected):
+                    diff = set(expected[drive_id].items()).symmetric_difference(members[drive_id].items())
+                    if diff:
+                        print('  %s differs: %s' % (drive_id, sorted(diff)[:10]))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
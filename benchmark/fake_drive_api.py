@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# A stand-in for the permissions of the Drive API v3 to run deprecated/reconcile.py without a Google account
+# It serves on 'http://HOST:PORT/' (reconcile.py --api-endpoint http://HOST:PORT/):
+#   GET    drive/v3/files/ID/permissions          pages of the members (pageSize, pageToken)
+#   POST   drive/v3/files/ID/permissions          add a member, a member added again keeps its single permission
+#   PATCH  drive/v3/files/ID/permissions/PERM_ID  change the role of a member
+#   DELETE drive/v3/files/ID/permissions/PERM_ID  remove a member (404 when it isn't there)
+#   POST   batch/drive/v3                         multipart/mixed batches of the requests above
+# A share of the requests of the batches (--rate-limit) is answered with 429 rateLimitExceeded,
+# so the retries of the batch executor are exercised too.
+#
+# The drives are a json file {"DRIVE_ID": [{"emailAddress": ..., "role": ...}, ...]} given with --drives,
+# and the members of every drive are written to --output when the server is stopped (Ctrl+C).
+
+import sys
+import json
+import random
+import argparse
+import threading
+
+from email.parser import BytesParser
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+page_size_max = 100  # Members in a page at most, like the real API
+
+
+# The members of the shared drives, changed by the requests
+class FakeDrives:
+    def __init__(self, drives, rate_limit=0, seed=None):
+        self.drives = {}
+        self.next_id = 0
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        for drive_id, members in drives.items():
+            self.drives[drive_id] = {}
+            for member in members:
+                self._add(drive_id, member['emailAddress'], member['role'])
+
+    def _add(self, drive_id, email, role):
+        for perm in self.drives[drive_id].values():
+            if perm['emailAddress'].lower() == email.lower():
+                return perm
+        self.next_id += 1
+        perm = {'id': 'perm%s' % self.next_id, 'type': 'user', 'emailAddress': email, 'role': role}
+        self.drives[drive_id][perm['id']] = perm
+        return perm
+
+    # The members of every drive as {drive ID: {email: role}}
+    def get_members(self):
+        with self.lock:
+            return dict((drive_id, dict((perm['emailAddress'], perm['role']) for perm in perms.values()))
+                        for drive_id, perms in self.drives.items())
+
+    # Run a request, return the status and the json answer (None for no content)
+    def handle(self, method, url, body, batched=False):
+        parts = urlsplit(url)
+        query = dict((name, values[0]) for name, values in parse_qs(parts.query).items())
+        path = parts.path.strip('/').split('/')
+        with self.lock:
+            self.requests += 1
+            if batched and self.random.random() < self.rate_limit:
+                return 429, error_json(429, 'rateLimitExceeded', 'Rate Limit Exceeded')
+            if len(path) < 5 or path[:3] != ['drive', 'v3', 'files'] or path[4] != 'permissions':
+                return 404, error_json(404, 'notFound', 'Unknown method')
+            drive_id = path[3]
+            if drive_id not in self.drives:
+                return 404, error_json(404, 'notFound', 'Shared drive not found: %s' % drive_id)
+            perms = self.drives[drive_id]
+            if len(path) == 5 and method == 'GET':
+                start = int(query.get('pageToken') or 0)
+                size = min(int(query.get('pageSize', page_size_max)), page_size_max)
+                page = list(perms.values())[start:start + size]
+                answer = {'permissions': [dict(perm) for perm in page]}
+                if start + size < len(perms):
+                    answer['nextPageToken'] = str(start + size)
+                return 200, answer
+            if len(path) == 5 and method == 'POST':
+                return 200, dict(self._add(drive_id, body['emailAddress'], body['role']))
+            if len(path) == 6 and path[5] not in perms:
+                return 404, error_json(404, 'notFound', 'Permission not found: %s' % path[5])
+            if len(path) == 6 and method == 'PATCH':
+                perms[path[5]]['role'] = body['role']
+                return 200, dict(perms[path[5]])
+            if len(path) == 6 and method == 'DELETE':
+                del perms[path[5]]
+                return 204, None
+            return 404, error_json(404, 'notFound', 'Unknown method')
+
+
+def error_json(code, reason, message):
+    return {'error': {'code': code, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+# Run the requests of a multipart/mixed batch, return the multipart/mixed answer and its boundary
+def handle_batch(drives, content_type, data):
+    message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + data)
+    boundary = 'batch_fake_drive_api'
+    answer = []
+    for part in message.get_payload():
+        request = part.get_payload(decode=True).replace(b'\r\n', b'\n')
+        head, _, body = request.partition(b'\n\n')
+        method, url = head.split(b'\n', 1)[0].decode().split(' ')[:2]
+        status, answer_json = drives.handle(method, url, json.loads(body) if body.strip() else None, batched=True)
+        content = json.dumps(answer_json) if answer_json is not None else ''
+        answer.append('--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n'
+                      'HTTP/1.1 %s %s\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n%s\r\n' % (
+                          boundary, part['Content-ID'][1:-1], status, 'OK' if status < 300 else 'Error', content))
+    return ''.join(answer) + '--%s--\r\n' % boundary, boundary
+
+
+def make_handler(drives):
+    class DriveHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _answer(self, status, data, content_type='application/json; charset=UTF-8'):
+            data = data.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self):
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlsplit(self.path).path.strip('/') == 'batch/drive/v3':
+                answer, boundary = handle_batch(drives, self.headers['Content-Type'], data)
+                self._answer(200, answer, 'multipart/mixed; boundary=%s' % boundary)
+                return
+            status, answer_json = drives.handle(self.command, self.path, json.loads(data) if data.strip() else None)
+            self._answer(status, json.dumps(answer_json) if answer_json is not None else '')
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+        def log_message(self, *log_args):
+            pass
+
+    return DriveHandler
+
+
+# Serve the drives in a background thread, return the server (server.server_address has its port)
+def start_server(drives, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(drives))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A stand-in for the permissions of the Drive API.')
+    parser.add_argument('--drives', type=str, required=True, help='Json file of the members of every drive.')
+    parser.add_argument('--output', type=str, default=None, help='Write the members of every drive here when stopped.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--rate-limit', type=float, default=0, help='Share of the batched requests answered with 429.')
+    args = parser.parse_args()
+
+    with open(args.drives) as f:
+        drives = FakeDrives(json.load(f), args.rate_limit)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(drives))
+    print('Serving the Drive API on http://%s:%s/' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(drives.get_members(), f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
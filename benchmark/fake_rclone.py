@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# A stand-in for rclone to benchmark autorclone.py without using real Drive quota
+# It serves the rc API on '--rc-addr' (core/stats, core/transferred, core/pid, core/memstats, core/bwlimit, core/quit,
+# options/set, rc/noop)
+# with byte counts, speeds, `transferring` lists and `lastError` values scripted by a scenario file,
+# and answers `lsjson` and `size` for the sharding of the workers.
+#
+# The scenario is a json file given by the FAKE_RCLONE_SCENARIO environment variable:
+#   listing       seconds spent listing and checking before the first transfer
+#   speed         bytes per second once transferring
+#   file_size     bytes of every file, used for the `transfers` count
+#   transfers     files transferred at once
+#   error_after   seconds of transferring before `error` is raised (null to never raise it)
+#   error         the error, e.g. userRateLimitExceeded
+#   error_in      where the error shows up: stats (`lastError`), log (json line of '--log-file') or both
+#   total_bytes   exit with code 0 once this many bytes are transferred (null to never end)
+#   entries       top-level entries [name, is_dir, size] of the source for `lsjson` and `size`
+#   files         all the files [path, size] of every remote for `lsjson -R`, e.g. {"src:": [["a/b.bin", 1024]]}
+#                 (a remote which isn't there exits with code 3 like a missing directory)
+#   differ        the files `check` finds different at the destination, the others are the same
+# 'MaxTransfer' set by options/set with the soft 'CutoffMode' lets the files in progress finish and starts no new one.
+# With '--files-from-raw' rclone transfers the listed files of the source one after another,
+# logs `Copied (new)` for each of them and exits with code 0 once they are all transferred.
+# `check` with '--files-from-raw' and '--combined' reports the listed files and exits with code 1 if some differ.
+#
+# What happens is appended as json lines to the file given by FAKE_RCLONE_EVENTS:
+#   start, transferring (the first byte is sent), copied, error, bwlimit, options, quit, done and check.
+# On Linux the process renames itself to `rclone`, so autorclone.py finds and kills it like the real one.
+
+import os
+import sys
+import json
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_scenario = {
+    'listing': 0.5,
+    'speed': 100 * pow(1024, 2),
+    'file_size': 10 * pow(1024, 2),
+    'transfers': 4,
+    'error_after': None,
+    'error': 'userRateLimitExceeded',
+    'error_in': 'both',
+    'total_bytes': None,
+    'entries': [['dir%s' % i, True, pow(1024, 3)] for i in range(8)],
+    'files': {},
+    'differ': [],
+}
+
+tick_interval = 0.005  # Check the scripted deadlines every xx seconds
+
+
+def load_scenario():
+    scenario = dict(default_scenario)
+    path = os.environ.get('FAKE_RCLONE_SCENARIO')
+    if path:
+        with open(path) as f:
+            scenario.update(json.load(f))
+    return scenario
+
+
+# Value of a flag given as '--flag value' or '--flag=value'
+def get_flag(argv, name, default=None):
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return default
+
+
+# Parse a rclone bandwidth limit such as 1, 10M or off, in bytes per second (None for no limit)
+def parse_bwlimit(rate):
+    if rate is None or str(rate).lower() in ('off', '0', ''):
+        return None
+    rate = str(rate).split(':')[0]
+    units = {'B': 1, 'K': 1024, 'M': pow(1024, 2), 'G': pow(1024, 3), 'T': pow(1024, 4)}
+    if rate[-1].upper() in units:
+        return float(rate[:-1]) * units[rate[-1].upper()]
+    return float(rate) * 1024  # rclone reads a plain number as KiB/s
+
+
+def set_process_name(name):
+    try:
+        with open('/proc/self/comm', 'w') as f:
+            f.write(name)
+    except OSError:
+        pass
+
+
+class FakeRclone:
+    def __init__(self, argv, scenario):
+        self.argv = argv
+        self.scenario = scenario
+        self.sa = get_flag(argv, '--drive-service-account-file', '')
+        self.log_file = get_flag(argv, '--log-file')
+        self.events_path = os.environ.get('FAKE_RCLONE_EVENTS')
+        self.lock = threading.Lock()
+        self.time_start = time.time()
+        self.bwlimit = parse_bwlimit(get_flag(argv, '--bwlimit'))
+        self.bytes_done = 0.0  # Bytes transferred until time_counted
+        self.time_counted = self.time_start + scenario['listing']
+        self.time_transferring = None
+        self.last_error = ''
+        self.errors = 0
+        self.max_bytes = None  # Bytes at the end of the files in progress when a soft MaxTransfer is reached
+        self.batch = []  # [path, size] of the files of '--files-from-raw' not copied yet
+        self.copied = []  # core/transferred entries of the copied files
+        files_from = get_flag(argv, '--files-from-raw') or get_flag(argv, '--files-from')
+        if files_from:
+            source_sizes = dict(scenario['files'].get(argv[1], []))
+            with open(files_from) as f:
+                self.batch = [[path, source_sizes.get(path, 0)] for path in f.read().splitlines() if path]
+            scenario['total_bytes'] = sum(size for _, size in self.batch)
+
+    def event(self, name, **fields):
+        if not self.events_path:
+            return
+        fields.update({'t': time.time(), 'event': name, 'pid': os.getpid(), 'sa': self.sa})
+        with open(self.events_path, 'a') as f:
+            f.write(json.dumps(fields) + '\n')
+
+    def speed(self):
+        if self.max_bytes is not None and self.bytes_done >= self.max_bytes:
+            return 0.0
+        if self.bwlimit is None:
+            return float(self.scenario['speed'])
+        return min(float(self.scenario['speed']), self.bwlimit)
+
+    # Bring bytes_done up to now, call it with the lock held
+    def count(self):
+        now = time.time()
+        if now > self.time_counted:
+            self.bytes_done += (now - self.time_counted) * self.speed()
+            if self.max_bytes is not None:
+                self.bytes_done = min(self.bytes_done, self.max_bytes)
+            self.time_counted = now
+        return self.bytes_done
+
+    def set_options(self, options):
+        main = options.get('main', {})
+        if main.get('MaxTransfer', -1) >= 0 and main.get('CutoffMode') == 'soft':
+            with self.lock:
+                file_size = self.scenario['file_size']
+                self.count()
+                self.max_bytes = max(main['MaxTransfer'], (self.bytes_done // file_size + 1) * file_size)
+        self.event('options', options=options)
+
+    def set_bwlimit(self, rate):
+        with self.lock:
+            self.count()
+            self.bwlimit = parse_bwlimit(rate)
+        self.event('bwlimit', rate=rate)
+
+    def stats(self):
+        with self.lock:
+            bytes_done = self.count()
+            listing = time.time() < self.time_start + self.scenario['listing']
+        speed = 0 if listing else self.speed()
+        file_size = self.scenario['file_size']
+        transferring = []
+        if not listing and speed:
+            for i in range(self.scenario['transfers']):
+                transferring.append({
+                    'name': 'file%s' % (int(bytes_done // file_size) + i),
+                    'size': file_size,
+                    'bytes': int(bytes_done % file_size),
+                    'speed': speed / self.scenario['transfers'],
+                    'percentage': int(bytes_done % file_size * 100 // file_size),
+                })
+        return {
+            'bytes': int(bytes_done),
+            'speed': speed,
+            'transfers': int(bytes_done // file_size),
+            'transferring': transferring,
+            'checks': 0,
+            'errors': self.errors,
+            'lastError': self.last_error,
+            'elapsedTime': time.time() - self.time_start,
+        }
+
+    def raise_error(self):
+        error = self.scenario['error']
+        msg = 'Failed to copy: googleapi: Error 403: User rate limit exceeded., %s' % error
+        self.errors += 1
+        if self.scenario['error_in'] in ('stats', 'both'):
+            self.last_error = msg
+        if self.scenario['error_in'] in ('log', 'both') and self.log_file:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'level': 'error', 'msg': msg,
+                                    'object': 'file%s' % int(self.bytes_done // self.scenario['file_size']),
+                                    'objectType': '*drive.Object', 'source': 'operations/copy.go:300'}) + '\n')
+        self.event('error', error=error)
+
+    # Log the files of the batch which are transferred
+    def log_copied(self, bytes_done):
+        bytes_copied = 0
+        while self.batch and bytes_copied + self.batch[0][1] <= bytes_done - self.batch_bytes_copied:
+            path, size = self.batch.pop(0)
+            bytes_copied += size
+            self.copied.append({'name': path, 'size': size, 'bytes': size, 'checked': False, 'error': '',
+                                'timestamp': time.time()})
+            if self.log_file:
+                with open(self.log_file, 'a') as f:
+                    f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'level': 'info',
+                                        'msg': 'Copied (new)', 'object': path, 'objectType': '*drive.Object',
+                                        'size': size}) + '\n')
+            self.event('copied', path=path)
+        self.batch_bytes_copied += bytes_copied
+
+    # Follow the scripted deadlines: first transfer, error and end
+    def run_script(self):
+        time_error = None
+        self.batch_bytes_copied = 0
+        while True:
+            with self.lock:
+                bytes_done = self.count()
+                # A transfer limited to a few KiB/s (a standby) isn't really transferring
+                transferring = time.time() >= self.time_start + self.scenario['listing'] and \
+                    (self.bwlimit is None or self.bwlimit > 64 * 1024)
+            if transferring and self.time_transferring is None:
+                self.time_transferring = time.time()
+                self.event('transferring')
+                if self.scenario['error_after'] is not None:
+                    time_error = self.time_transferring + self.scenario['error_after']
+            if time_error is not None and time.time() >= time_error:
+                time_error = None
+                self.raise_error()
+            self.log_copied(bytes_done)
+            total_bytes = self.scenario['total_bytes']
+            if total_bytes is not None and bytes_done >= total_bytes:
+                self.event('done')
+                os._exit(0)
+            time.sleep(tick_interval)
+
+
+def make_handler(fake):
+    class RcHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                params = json.loads(body.decode('utf-8')) if body else {}
+            except ValueError:
+                params = {}
+            method = self.path.strip('/')
+            status = 200
+            if method == 'core/stats':
+                response = fake.stats()
+            elif method == 'core/transferred':
+                response = {'transferred': list(fake.copied)}
+            elif method == 'core/pid':
+                response = {'pid': os.getpid()}
+            elif method == 'core/memstats':
+                response = {'Sys': 50 * pow(1024, 2), 'HeapAlloc': 20 * pow(1024, 2)}
+            elif method == 'core/bwlimit':
+                if 'rate' in params:
+                    fake.set_bwlimit(params['rate'])
+                response = {'rate': params.get('rate', 'off')}
+            elif method == 'options/set':
+                fake.set_options(params)
+                response = {}
+            elif method == 'rc/noop':
+                response = params
+            elif method == 'core/quit':
+                fake.event('quit')
+                threading.Timer(0.05, os._exit, args=(params.get('exitCode', 0),)).start()
+                response = {}
+            else:
+                status = 404
+                response = {'error': "couldn't find method %r" % method, 'input': params, 'path': method, 'status': 404}
+            data = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *log_args):
+            pass
+
+    return RcHandler
+
+
+def main():
+    argv = sys.argv[1:]
+    scenario = load_scenario()
+    command = argv[0] if argv else ''
+    set_process_name('rclone')
+
+    if command == 'lsjson' and '-R' in argv:
+        if argv[-1] not in scenario['files']:
+            sys.stderr.write('ERROR : error listing: directory not found\n')
+            return 3
+        print(json.dumps([{'Path': path, 'Name': path.split('/')[-1], 'IsDir': False, 'Size': size}
+                          for path, size in scenario['files'][argv[-1]]]))
+        return 0
+    if command == 'lsjson':
+        print(json.dumps([{'Path': name, 'Name': name, 'IsDir': is_dir, 'Size': -1 if is_dir else size}
+                          for name, is_dir, size in scenario['entries']]))
+        return 0
+    if command == 'size':
+        name = argv[-1].rstrip('/').split('/')[-1].split(':')[-1]
+        size = sum(entry[2] for entry in scenario['entries'] if entry[0] == name or not name)
+        print(json.dumps({'count': 1, 'bytes': size}))
+        return 0
+    if command == 'check':
+        fake = FakeRclone(argv, scenario)
+        differ = set(scenario['differ'])
+        with open(get_flag(argv, '--combined'), 'w') as f:
+            for path, _ in fake.batch:
+                f.write('%s %s\n' % ('*' if path in differ else '=', path))
+        fake.event('check', files=len(fake.batch), differ=len(differ.intersection(path for path, _ in fake.batch)))
+        return 1 if differ.intersection(path for path, _ in fake.batch) else 0
+    if command not in ('sync', 'copy', 'move'):
+        sys.stderr.write('fake_rclone: unsupported command %r\n' % command)
+        return 1
+
+    rc_addr = get_flag(argv, '--rc-addr', ':5572')
+    host, _, port = rc_addr.rpartition(':')
+    fake = FakeRclone(argv, scenario)
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), make_handler(fake))
+    fake.event('start', port=int(port), check_first='--check-first' in argv)
+    threading.Thread(target=fake.run_script, daemon=True).start()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+from concurrent.futures import ThreadPoolExecutor
+from random import random
+from time import sleep, time
+import threading
+
+batch_size = 100  # Requests sent in one batch, the most the Drive API takes
+threads = 8  # Send xx batches at once
+max_retries = 8  # Send a request which failed with a rate limit or a server error again up to xx times
+backoff_time = 1  # Wait xx seconds before the first retry, twice as long before each next one
+max_delay = 64  # Wait at most xx seconds before a batch or a retry
+throttle_rate = 0.05  # Slow down when more than 5% of the requests of a batch get a 429, speed up when none do
+
+
+# An API client for every thread, httplib2 isn't thread safe
+class ThreadClients:
+    def __init__(self, build_client):
+        self.build_client = build_client
+        self.local = threading.local()
+
+    def get(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.build_client()
+        return self.local.client
+
+
+# A request refused by a rate limit: 429, or 403 with a reason like rateLimitExceeded or userRateLimitExceeded
+def is_rate_limited(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    content = exception.content.decode('utf-8', 'replace')
+    return exception.resp.status == 429 or (exception.resp.status == 403 and (
+        'ateLimitExceeded' in content or 'RATE_LIMIT_EXCEEDED' in content))
+
+
+# A request which failed with a rate limit, a service just enabled, a server error or a connection error
+# The server may have processed the request before a server or connection error, it is only sent again when it's idempotent
+def is_retryable(exception, idempotent=True):
+    if not isinstance(exception, HttpError):
+        return idempotent
+    if is_rate_limited(exception):
+        return True
+    if exception.resp.status in (500, 502, 503, 504):
+        return idempotent
+    content = exception.content.decode('utf-8', 'replace')
+    return exception.resp.status == 403 and ('SERVICE_DISABLED' in content or 'accessNotConfigured' in content)
+
+
+# Send the requests of an API in batches, several batches at once, and send the failed ones again
+# The delay before each batch follows the 429 errors: doubled when a batch gets more than throttle_rate of them
+# (once per delay, the batches sent at the same time see the same limit), halved when a batch gets none,
+# so the requests go at the highest rate the API takes
+class BatchExecutor:
+    def __init__(self, clients, batch_uri=None, batch_size=batch_size, threads=threads):
+        self.clients = clients
+        self.batch_uri = batch_uri  # Batch endpoint of another root URL, e.g. a local stand-in of the API
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(threads)  # Shared by the calls of execute, the clients stay with its threads
+        self.delay = 0
+        self.time_slowed = 0
+        self.lock = threading.Lock()
+
+    def _new_batch(self, client, callback):
+        if self.batch_uri:
+            return BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+        return client.new_batch_http_request(callback=callback)
+
+    # Follow the share of 429 errors of a batch
+    def _adapt(self, rate_limited, count):
+        with self.lock:
+            if rate_limited > count * throttle_rate:
+                if time() - self.time_slowed >= self.delay:
+                    self.delay = min(max_delay, max(backoff_time, self.delay * 2))
+                    self.time_slowed = time()
+            elif rate_limited == 0:
+                self.delay = self.delay / 2 if self.delay > backoff_time / 8 else 0
+
+    # Send one batch, return the keys of the requests to send again
+    def _run_batch(self, keys, make_request, responses, errors, idempotent):
+        if self.delay:
+            sleep(self.delay * (0.5 + random()))
+        retry = []
+        outcome = {'rate_limited': 0}
+
+        def callback(request_id, resp, exception):
+            key = keys[int(request_id)]
+            with self.lock:
+                if exception is None:
+                    responses[key] = resp
+                    errors.pop(key, None)
+                    return
+                errors[key] = exception
+            if is_retryable(exception, idempotent):
+                retry.append(key)
+            if is_rate_limited(exception):
+                outcome['rate_limited'] += 1
+
+        client = self.clients.get()
+        batch = self._new_batch(client, callback)
+        for i, key in enumerate(keys):
+            batch.add(make_request(client, key), request_id=str(i))
+        try:
+            batch.execute()
+        except Exception as e:
+            # The whole batch is lost, send it again unless the server may have run some of its requests
+            with self.lock:
+                for key in keys:
+                    if key not in responses:
+                        errors[key] = e
+            if idempotent or is_rate_limited(e):
+                retry = [key for key in keys if key not in responses]
+        self._adapt(outcome['rate_limited'], len(keys))
+        return retry
+
+    # Send make_request(client, key) for every key, the ones which failed with a retryable error are sent again
+    # A request which isn't idempotent (it creates something new each time) is only sent again after a rate limit,
+    # the caller looks at what exists for the ones which failed otherwise
+    # Return the responses of the requests which succeeded and the errors of the others by key
+    def execute(self, keys, make_request, idempotent=False):
+        responses = {}
+        errors = {}
+        pending = list(keys)
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                sleep(min(max_delay, max(backoff_time * pow(2, attempt - 1), self.delay)) * (0.5 + random()))
+            chunks = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            retries = list(self.pool.map(
+                lambda chunk: self._run_batch(chunk, make_request, responses, errors, idempotent), chunks))
+            pending = [key for retry in retries for key in retry]
+        return responses, errors
@@ -2,25 +2,15 @@ from google.oauth2.service_account import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from batchexec import BatchExecutor, ThreadClients
 from argparse import ArgumentParser
 from os.path import exists
 from json import loads
 from glob import glob
 import pickle
 
-successful = []
-
-
-def _is_success(id, resp, exception):
-    global successful
-
-    if exception is None:
-        successful.append(resp['emailAddress'])
-
 
 def masshare(drive_id=None, path='accounts', token='token.pickle', credentials='credentials.json'):
-    global successful
-
     SCOPES = ["https://www.googleapis.com/auth/drive",
               "https://www.googleapis.com/auth/cloud-platform",
               "https://www.googleapis.com/auth/iam"]
@@ -39,26 +29,23 @@ def masshare(drive_id=None, path='accounts', token='token.pickle', credentials='
         with open(token, 'wb') as t:
             pickle.dump(creds, t)
 
-    drive = build("drive", "v3", credentials=creds)
+    drive = BatchExecutor(ThreadClients(lambda: build("drive", "v3", credentials=creds, cache_discovery=False)))
 
-    accounts_to_add = []
+    accounts_to_add = set()
 
     print('Fetching emails')
     for i in glob('%s/*.json' % path):
-        accounts_to_add.append(loads(open(i, 'r').read())['client_email'])
+        accounts_to_add.add(loads(open(i, 'r').read())['client_email'])
 
-    while len(successful) < len(accounts_to_add):
-        print('Preparing %d members' % (len(accounts_to_add) - len(successful)))
-        batch = drive.new_batch_http_request(callback=_is_success)
-        for i in accounts_to_add:
-            if i not in successful:
-                batch.add(drive.permissions().create(fileId=drive_id, fields='emailAddress', supportsAllDrives=True, body={
-                    "role": "fileOrganizer",
-                    "type": "user",
-                    "emailAddress": i
-                }))
-        print('Adding')
-        batch.execute()
+    print('Adding %d members' % len(accounts_to_add))
+    _, errors = drive.execute(sorted(accounts_to_add), lambda client, email: client.permissions().create(
+        fileId=drive_id, fields='emailAddress', supportsAllDrives=True, body={
+            "role": "fileOrganizer",
+            "type": "user",
+            "emailAddress": email
+        }), idempotent=True)  # Adding a member again keeps a single permission
+    for email, e in sorted(errors.items()):
+        print('Can\'t add %s: %s' % (email, e))
 
 
 if __name__ == '__main__':
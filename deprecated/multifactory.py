@@ -2,42 +2,63 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from batchexec import BatchExecutor, ThreadClients
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 from base64 import b64decode
 from random import choice
 from json import loads
 from time import sleep
 from glob import glob
-import os, pickle
+import os, pickle, threading
 
 SCOPES = [
     'https://www.googleapis.com/auth/drive',
     'https://www.googleapis.com/auth/cloud-platform',
     'https://www.googleapis.com/auth/iam'
 ]
-project_create_ops = []
-current_key_dump = []
-sleep_time = 30
-
-# Create count SAs in project
-def _create_accounts(service, project, count):
-    batch = service.new_batch_http_request(callback=_def_batch_resp)
-    for i in range(count):
-        aid = _generate_id('mfc-')
-        batch.add(service.projects().serviceAccounts().create(name='projects/' + project,
-                                                              body={'accountId': aid,
-                                                                    'serviceAccount': {'displayName': aid}
-                                                                    }))
-    batch.execute()
-
-
-# Create accounts needed to fill project
+threads = 10  # Set up xx projects at once
+print_lock = threading.Lock()
+
+
+def _print(msg):
+    with print_lock:
+        print(msg)
+
+
+# Build an API client, every thread needs its own (httplib2 isn't thread safe)
+# Replace it to run against a mocked Google API
+def _build_client(name, version, creds):
+    return build(name, version, credentials=creds, cache_discovery=False)
+
+
+# A batch executor for each API, shared by the projects set up at once
+def _get_executors(creds):
+    return dict((name, BatchExecutor(ThreadClients(lambda name=name, version=version: _build_client(name, version, creds))))
+                for name, version in (('cloudresourcemanager', 'v1'), ('iam', 'v1'), ('serviceusage', 'v1')))
+
+
+# Create count SAs in project, return the accounts created and the errors of the others
+def _create_accounts(iam, project, count):
+    ids = [_generate_id('mfc-') for _ in range(count)]
+    created, errors = iam.execute(ids, lambda client, aid: client.projects().serviceAccounts().create(
+        name='projects/' + project, body={'accountId': aid, 'serviceAccount': {'displayName': aid}}))
+    _print_errors(errors, 'create in %s the account' % project)
+    return list(created.values()), errors
+
+
+# Create accounts needed to fill project, return the accounts of the project
 def _create_remaining_accounts(iam, project):
-    print('Creating accounts in %s' % project)
-    sa_count = len(_list_sas(iam, project))
-    while sa_count != 100:
-        _create_accounts(iam, project, 100 - sa_count)
-        sa_count = len(_list_sas(iam, project))
+    _print('Creating accounts in %s' % project)
+    sas = _list_sas(iam.clients.get(), project)
+    if len(sas) < 100:
+        created, errors = _create_accounts(iam, project, 100 - len(sas))
+        if errors:
+            # The requests which failed may have created their account anyway
+            sas += _list_sas(iam.clients.get(), project)
+        # The list may not show the new accounts right away
+        sas = list(dict((sa['uniqueId'], sa) for sa in sas + created).values())
+    return sas
 
 
 # Generate a random id
@@ -52,52 +73,50 @@ def _get_projects(service):
             if i.get('lifecycleState', 'ACTIVE') == 'ACTIVE']
 
 
-# Default batch callback handler
-def _def_batch_resp(id, resp, exception):
-    if exception is not None:
-        if str(exception).startswith('<HttpError 429'):
-            sleep(sleep_time/100)
-        else:
-            print(str(exception))
-
+# Print the requests which failed
+def _print_errors(errors, what):
+    for key, e in errors.items():
+        _print('Can\'t %s %s: %s' % (what, key, e))
 
-# Project Creation Batch Handler
-def _pc_resp(id, resp, exception):
-    global project_create_ops
-    if exception is not None:
-        print(str(exception))
-    else:
-        for i in resp.values():
-            project_create_ops.append(i)
 
-
-# Project Creation
+# Project Creation, return the projects created
 def _create_projects(cloud, count):
-    global project_create_ops
-    batch = cloud.new_batch_http_request(callback=_pc_resp)
-    new_projs = []
-    for i in range(count):
-        new_proj = _generate_id()
-        new_projs.append(new_proj)
-        batch.add(cloud.projects().create(body={'project_id': new_proj}))
-    batch.execute()
-
-    for i in project_create_ops:
-        while True:
-            resp = cloud.operations().get(name=i).execute()
-            if 'done' in resp and resp['done']:
-                break
-            sleep(3)
-    return new_projs
+    new_projs = [_generate_id() for _ in range(count)]
+    ops, errors = cloud.execute(new_projs, lambda client, proj: client.projects().create(body={'project_id': proj}))
+    if errors:
+        # The requests which failed may have created their project anyway
+        existing = set(_get_projects(cloud.clients.get()))
+        for proj in [proj for proj in errors if proj in existing]:
+            del errors[proj]
+            ops[proj] = {'done': True}
+    _print_errors(errors, 'create the project')
+
+    # The projects are created at the same time, wait for all of them
+    pending = dict((proj, op) for proj, op in ops.items() if not op.get('done'))
+    while pending:
+        sleep(3)
+        done, errors = cloud.execute(list(pending), lambda client, proj: client.operations().get(name=pending[proj]['name']),
+                                     idempotent=True)
+        _print_errors(errors, 'follow the creation of the project')
+        for proj in errors:
+            del ops[proj]
+        pending = {}
+        for proj, op in done.items():
+            if op.get('done'):
+                ops[proj] = op
+            else:
+                pending[proj] = op
+    for proj, op in ops.items():
+        if 'error' in op:
+            _print('Can\'t create the project %s: %s' % (proj, op['error'].get('message')))
+    return [proj for proj in new_projs if proj in ops and 'error' not in ops[proj]]
 
 
 # Enable services ste for projects in projects
-def _enable_services(service, projects, ste):
-    batch = service.new_batch_http_request(callback=_def_batch_resp)
-    for i in projects:
-        for j in ste:
-            batch.add(service.services().enable(name='projects/%s/services/%s' % (i, j)))
-    batch.execute()
+def _enable_services(serviceusage, projects, ste):
+    names = ['projects/%s/services/%s' % (i, j) for i in projects for j in ste]
+    _, errors = serviceusage.execute(names, lambda client, name: client.services().enable(name=name), idempotent=True)
+    _print_errors(errors, 'enable')
 
 
 # List SAs in project
@@ -108,55 +127,53 @@ def _list_sas(iam, project):
     return []
 
 
-# Create Keys Batch Handler
-def _batch_keys_resp(id, resp, exception):
-    global current_key_dump
-    if exception is not None:
-        current_key_dump = None
-        sleep(sleep_time/100)
-    elif current_key_dump is None:
-        sleep(sleep_time/100)
-    else:
-        current_key_dump.append((
-            resp['name'][resp['name'].rfind('/'):],
-            b64decode(resp['privateKeyData']).decode('utf-8')
-        ))
-
-
-# Create Keys
-def _create_sa_keys(iam, projects, path):
-    global current_key_dump
-    for i in projects:
-        current_key_dump = []
-        print('Downloading keys from %s' % i)
-        while current_key_dump is None or len(current_key_dump) != 100:
-            batch = iam.new_batch_http_request(callback=_batch_keys_resp)
-            total_sas = _list_sas(iam, i)
-            for j in total_sas:
-                batch.add(iam.projects().serviceAccounts().keys().create(
-                    name='projects/%s/serviceAccounts/%s' % (i, j['uniqueId']),
-                    body={
-                        'privateKeyType': 'TYPE_GOOGLE_CREDENTIALS_FILE',
-                        'keyAlgorithm': 'KEY_ALG_RSA_2048'
-                    }
-                ))
-            batch.execute()
-            if current_key_dump is None:
-                print('Redownloading keys from %s' % i)
-                current_key_dump = []
-            else:
-                for j in current_key_dump:
-                    with open('%s/%s.json' % (path, j[0]), 'w+') as f:
-                        f.write(j[1])
+# Create Keys, one for every SA of project (or of sas) which has no key downloaded in path yet
+# A key request which failed isn't sent again (the key may exist, its private key can't be downloaded again),
+# running the download again creates a key for the accounts still without one
+def _create_sa_keys(iam, project, path, sas=None):
+    _print('Downloading keys from %s' % project)
+    if sas is None:
+        sas = _list_sas(iam.clients.get(), project)
+    sa_names = dict((sa['uniqueId'], 'projects/%s/serviceAccounts/%s' % (project, sa['uniqueId'])) for sa in sas)
+    sa_keys, errors = iam.execute(list(sa_names), lambda client, uid: client.projects().serviceAccounts().keys().list(
+        name=sa_names[uid], keyTypes='USER_MANAGED'), idempotent=True)
+    _print_errors(errors, 'list the keys in %s of' % project)
+    missing = [uid for uid, resp in sa_keys.items() if not any(
+        os.path.exists('%s/%s.json' % (path, key['name'][key['name'].rfind('/') + 1:])) for key in resp.get('keys', []))]
+    keys, errors = iam.execute(missing, lambda client, uid: client.projects().serviceAccounts().keys().create(
+        name=sa_names[uid],
+        body={
+            'privateKeyType': 'TYPE_GOOGLE_CREDENTIALS_FILE',
+            'keyAlgorithm': 'KEY_ALG_RSA_2048'
+        }
+    ))
+    for resp in keys.values():
+        with open('%s/%s.json' % (path, resp['name'][resp['name'].rfind('/') + 1:]), 'w+') as f:
+            f.write(b64decode(resp['privateKeyData']).decode('utf-8'))
+    _print_errors(errors, 'create a key in %s for' % project)
+    return len(keys)
 
 
 # Delete Service Accounts
 def _delete_sas(iam, project):
-    sas = _list_sas(iam, project)
-    batch = iam.new_batch_http_request(callback=_def_batch_resp)
-    for i in sas:
-        batch.add(iam.projects().serviceAccounts().delete(name=i['name']))
-    batch.execute()
+    sas = _list_sas(iam.clients.get(), project)
+    _, errors = iam.execute([i['name'] for i in sas], lambda client, name: client.projects().serviceAccounts().delete(name=name),
+                            idempotent=True)
+    _print_errors(errors, 'delete')
+
+
+# Run the steps asked for project one after another: enable services, create SAs, download keys, delete SAs
+def _setup_project(executors, project, services=None, create_sas=False, path=None, delete_sas=False):
+    if services:
+        _enable_services(executors['serviceusage'], [project], services)
+    sas = None
+    if create_sas:
+        sas = _create_remaining_accounts(executors['iam'], project)
+    if path:
+        _create_sa_keys(executors['iam'], project, path, sas)
+    if delete_sas:
+        _print('Deleting service accounts in %s' % project)
+        _delete_sas(executors['iam'], project)
 
 
 def serviceaccountfactory(
@@ -171,7 +188,8 @@ def serviceaccountfactory(
         services=['iam', 'drive'],
         create_sas=None,
         delete_sas=None,
-        download_keys=None
+        download_keys=None,
+        threads=threads
 ):
     selected_projects = []
     proj_id = loads(open(credentials, 'r').read())['installed']['project_id']
@@ -189,9 +207,10 @@ def serviceaccountfactory(
         with open(token, 'wb') as t:
             pickle.dump(creds, t)
 
-    cloud = build('cloudresourcemanager', 'v1', credentials=creds)
-    iam = build('iam', 'v1', credentials=creds)
-    serviceusage = build('serviceusage', 'v1', credentials=creds)
+    cloud = _build_client('cloudresourcemanager', 'v1', creds)
+    iam = _build_client('iam', 'v1', creds)
+    serviceusage = _build_client('serviceusage', 'v1', creds)
+    executors = _get_executors(creds)
 
     projs = None
     while projs == None:
@@ -214,53 +233,48 @@ def serviceaccountfactory(
             current_count = len(_get_projects(cloud))
             if current_count + create_projects < max_projects:
                 print('Creating %d projects' % create_projects)
-                nprjs = _create_projects(cloud, create_projects)
+                nprjs = _create_projects(executors['cloudresourcemanager'], create_projects)
                 selected_projects = nprjs
             else:
                 print('%d projects already exist!' % current_count)
         else:
             print('Please specify a number larger than 0.')
-    if enable_services:
-        ste = []
-        ste.append(enable_services)
-        if enable_services == '~':
-            ste = selected_projects
-        elif enable_services == '*':
-            ste = _get_projects(cloud)
-        services = [i + '.googleapis.com' for i in services]
-        print('Enabling services')
-        _enable_services(serviceusage, ste, services)
-    if create_sas:
-        stc = []
-        stc.append(create_sas)
-        if create_sas == '~':
-            stc = selected_projects
-        elif create_sas == '*':
-            stc = _get_projects(cloud)
-        for i in stc:
-            _create_remaining_accounts(iam, i)
-    if download_keys:
+    # The projects selected for each step
+    def select(selector):
+        if not selector:
+            return []
+        if selector == '~':
+            return selected_projects
+        if selector == '*':
+            return _get_projects(cloud)
+        return [selector]
+    ste = select(enable_services)
+    stc = select(create_sas)
+    std = select(download_keys)
+    stx = select(delete_sas)
+    if std:
         try:
             os.mkdir(path)
         except FileExistsError:
             pass
-        std = []
-        std.append(download_keys)
-        if download_keys == '~':
-            std = selected_projects
-        elif download_keys == '*':
-            std = _get_projects(cloud)
-        _create_sa_keys(iam, std, path)
-    if delete_sas:
-        std = []
-        std.append(delete_sas)
-        if delete_sas == '~':
-            std = selected_projects
-        elif delete_sas == '*':
-            std = _get_projects(cloud)
-        for i in std:
-            print('Deleting service accounts in %s' % i)
-            _delete_sas(iam, i)
+    if ste:
+        print('Enabling services')
+    services = [i + '.googleapis.com' for i in services]
+
+    # Every project goes through its steps on its own, several projects at once
+    projects = []
+    for i in ste + stc + std + stx:
+        if i not in projects:
+            projects.append(i)
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        runs = [pool.submit(_setup_project, executors, i, services if i in ste else None, i in stc,
+                            path if i in std else None, i in stx) for i in projects]
+        # A project which fails (API error, lost connection, bad answer...) doesn't stop the others
+        for i, run in zip(projects, runs):
+            try:
+                run.result()
+            except Exception as e:
+                print('Can\'t set up %s: %s' % (i, e))
 
 
 if __name__ == '__main__':
@@ -279,6 +293,7 @@ if __name__ == '__main__':
     parse.add_argument('--download-keys', default=None, help='Download keys for all the service accounts in a project.')
     parse.add_argument('--quick-setup', default=None, type=int, help='Create projects, enable services, create service accounts and download keys. ')
     parse.add_argument('--new-only', default=False, action='store_true', help='Do not use exisiting projects.')
+    parse.add_argument('--threads', type=int, default=threads, help='Set up N projects at once. Default: %d' % threads)
     args = parse.parse_args()
     # If credentials file is invalid, search for one.
     if not os.path.exists(args.credentials):
@@ -324,7 +339,8 @@ if __name__ == '__main__':
         delete_sas=args.delete_sas,
         enable_services=args.enable_services,
         services=args.services,
-        download_keys=args.download_keys
+        download_keys=args.download_keys,
+        threads=args.threads
     )
     if resp is not None:
         if args.list_projects:
@@ -0,0 +1,163 @@
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from batchexec import BatchExecutor, ThreadClients
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+from os.path import exists
+from json import loads
+from glob import glob
+import pickle
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+valid_roles = ['organizer', 'fileOrganizer', 'writer', 'commenter', 'reader']
+valid_levels = ['manager', 'content manager', 'contributor', 'commenter', 'viewer']
+sa_domain = '.iam.gserviceaccount.com'  # Only the members with an email in this domain are removed by --prune
+threads = 8  # List xx drives at once
+
+
+# Drive API client, of another root URL such as a local stand-in of the API if api_endpoint is given
+def _build_drive(creds, api_endpoint=None):
+    if api_endpoint:
+        return build('drive', 'v3', credentials=creds, cache_discovery=False,
+                     client_options={'api_endpoint': api_endpoint.rstrip('/') + '/drive/v3/'})
+    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+
+# Role of the API for a role or a level of the Drive interface
+def _get_role(role):
+    lower_roles = [i.lower() for i in valid_roles]
+    if role.lower() in valid_levels:
+        return valid_roles[valid_levels.index(role.lower())]
+    if role.lower() in lower_roles:
+        return valid_roles[lower_roles.index(role.lower())]
+    return None
+
+
+# Emails of the service accounts of the folder
+def _read_emails(path):
+    emails = set()
+    for i in glob('%s/*.json' % path):
+        with open(i) as f:
+            emails.add(loads(f.read())['client_email'].lower())
+    return emails
+
+
+# Current members of the shared drive, page after page with only the fields needed
+def _list_permissions(drive, drive_id):
+    perms = []
+    token = None
+    while True:
+        rp = drive.permissions().list(fileId=drive_id, pageSize=100, pageToken=token, supportsAllDrives=True,
+                                      fields='nextPageToken,permissions(id,emailAddress,role)').execute()
+        perms += rp.get('permissions', [])
+        token = rp.get('nextPageToken')
+        if not token:
+            return perms
+
+
+# Requests to make the members of the shared drive match the accounts wanted:
+# add the missing accounts, give the wanted role to the others and with prune, remove the accounts not wanted
+def _diff(perms, wanted, role, prune):
+    actual = {}
+    for i in perms:
+        if i.get('emailAddress'):
+            actual[i['emailAddress'].lower()] = i
+    add = sorted(wanted.difference(actual))
+    change = sorted(i['id'] for email, i in actual.items() if email in wanted and i['role'] != role)
+    remove = []
+    if prune:
+        remove = sorted(i['id'] for email, i in actual.items() if email not in wanted and email.endswith(sa_domain))
+    return add, change, remove
+
+
+# The request of a change: (drive ID, add, email), (drive ID, change, permission ID) or (drive ID, remove, permission ID)
+def _make_request(drive, change, role):
+    drive_id, action, key = change
+    if action == 'add':
+        return drive.permissions().create(fileId=drive_id, fields='id', supportsAllDrives=True, sendNotificationEmail=False,
+                                          body={'role': role, 'type': 'user', 'emailAddress': key})
+    if action == 'change':
+        return drive.permissions().update(fileId=drive_id, permissionId=key, fields='id', supportsAllDrives=True,
+                                          body={'role': role})
+    return drive.permissions().delete(fileId=drive_id, permissionId=key, supportsAllDrives=True)
+
+
+def reconcile(drive_ids=None, path='accounts', role='fileOrganizer', prune=False, dry_run=False,
+              token='token.pickle', credentials='credentials.json', api_endpoint=None):
+    api_role = _get_role(role)
+    if api_role is None:
+        print('Invalid role.')
+        exit(-1)
+
+    creds = None
+    if exists(token):
+        with open(token, 'rb') as t:
+            creds = pickle.load(t)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(credentials, SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open(token, 'wb') as t:
+            pickle.dump(creds, t)
+    clients = ThreadClients(lambda: _build_drive(creds, api_endpoint))
+    # The batch endpoint doesn't follow api_endpoint
+    executor = BatchExecutor(clients, api_endpoint.rstrip('/') + '/batch/drive/v3' if api_endpoint else None)
+
+    print('Reading the service accounts of %s' % path)
+    wanted = _read_emails(path)
+    print('%d service accounts' % len(wanted))
+
+    # List the members of the drives at once
+    with ThreadPoolExecutor(threads) as pool:
+        all_perms = list(pool.map(lambda drive_id: _list_permissions(clients.get(), drive_id), drive_ids))
+
+    changes = []
+    for drive_id, perms in zip(drive_ids, all_perms):
+        add, change, remove = _diff(perms, wanted, api_role, prune)
+        print('%s: %d members, %d to add, %d to change to %s, %d to remove' % (
+            drive_id, len(perms), len(add), len(change), api_role, len(remove)))
+        changes += [(drive_id, 'add', i) for i in add] + [(drive_id, 'change', i) for i in change] + \
+            [(drive_id, 'remove', i) for i in remove]
+    if dry_run or not changes:
+        return {}
+
+    print('Applying %d changes' % len(changes))
+    _, errors = executor.execute(changes, lambda drive, change: _make_request(drive, change, api_role), idempotent=True)
+    for (drive_id, action, key), e in sorted(errors.items()):
+        # A member removed in the meantime is gone anyway
+        if action == 'remove' and isinstance(e, HttpError) and e.resp.status == 404:
+            del errors[(drive_id, action, key)]
+            continue
+        print('Can\'t %s %s in %s: %s' % (action, key, drive_id, e))
+    print('Done, %d changes failed.' % len(errors))
+    return errors
+
+
+if __name__ == '__main__':
+    parse = ArgumentParser(description='A tool to make the members of Shared Drives match a folder of service accounts.')
+    parse.add_argument('--path', '-p', default='accounts', help='Specify an alternative path to the service accounts folder.')
+    parse.add_argument('--role', default='fileOrganizer', help='Role of the service accounts. Default: fileOrganizer (content manager)')
+    parse.add_argument('--prune', default=False, action='store_true', help='Also remove the service accounts which are not in the folder.')
+    parse.add_argument('--dry-run', default=False, action='store_true', help='Only print the changes.')
+    parse.add_argument('--token', default='token.pickle', help='Specify the pickle token file path.')
+    parse.add_argument('--credentials', default='credentials.json', help='Specify the credentials file path.')
+    parse.add_argument('--api-endpoint', default=None, help='Root URL of the Drive API, e.g. a local stand-in for testing.')
+    parsereq = parse.add_argument_group('required arguments')
+    parsereq.add_argument('--drive-id', '-d', nargs='+', help='The IDs of the Shared Drives.', required=True)
+    args = parse.parse_args()
+
+    errors = reconcile(
+        drive_ids=args.drive_id,
+        path=args.path,
+        role=args.role,
+        prune=args.prune,
+        dry_run=args.dry_run,
+        token=args.token,
+        credentials=args.credentials,
+        api_endpoint=args.api_endpoint
+    )
+    exit(1 if errors else 0)
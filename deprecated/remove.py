@@ -2,27 +2,14 @@ from google.oauth2.service_account import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from batchexec import BatchExecutor, ThreadClients
 from argparse import ArgumentParser
 from os.path import exists
 import pickle
 
-to_be_removed = []
-
-
-def _is_success(id, resp, exception):
-    global to_be_removed
-
-    if exception is not None:
-        exp = str(exception).split('?')[0].split('/')
-        if exp[0].startswith('<HttpError 404'):
-            pass
-        else:
-            to_be_removed.append(exp[-1])
-
 
 def remove(drive_id=None, token='token.pickle', credentials='credentials.json', suffix=None, prefix=None, role=None):
-    global to_be_removed
-
     SCOPES = ["https://www.googleapis.com/auth/drive"]
     creds = None
 
@@ -39,7 +26,8 @@ def remove(drive_id=None, token='token.pickle', credentials='credentials.json',
         with open(token, 'wb') as t:
             pickle.dump(creds, t)
 
-    drive = build("drive", "v3", credentials=creds)
+    clients = ThreadClients(lambda: build("drive", "v3", credentials=creds, cache_discovery=False))
+    drive = clients.get()
 
     valid_roles = ['owner', 'organizer', 'fileorganizer', 'writer', 'reader', 'commenter']
     valid_levels = ['owner', 'manager', 'content manager', 'contributor', 'viewer', 'commenter']
@@ -68,6 +56,7 @@ def remove(drive_id=None, token='token.pickle', credentials='credentials.json',
         else:
             cont = False
 
+    to_be_removed = []
     for i in all_perms:
         if prefix:
             if i['emailAddress'].split('@')[0].startswith(prefix):
@@ -79,15 +68,13 @@ def remove(drive_id=None, token='token.pickle', credentials='credentials.json',
             if role == i['role'].lower():
                 to_be_removed.append(i['id'])
 
-    while len(to_be_removed) > 0:
-        print('Removing %d members.' % len(to_be_removed))
-        tbr = [to_be_removed[i:i + 100] for i in range(0, len(to_be_removed), 100)]
-        to_be_removed = []
-        for j in tbr:
-            batch = drive.new_batch_http_request(callback=_is_success)
-            for i in j:
-                batch.add(drive.permissions().delete(fileId=drive_id, permissionId=i, supportsAllDrives=True))
-            batch.execute()
+    print('Removing %d members.' % len(to_be_removed))
+    _, errors = BatchExecutor(clients).execute(to_be_removed, lambda client, i: client.permissions().delete(
+        fileId=drive_id, permissionId=i, supportsAllDrives=True), idempotent=True)
+    for i, e in sorted(errors.items()):
+        # Already removed
+        if not (isinstance(e, HttpError) and e.resp.status == 404):
+            print('Can\'t remove %s: %s' % (i, e))
     print('Users removed.')
 
 
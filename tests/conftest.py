@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tests import autorclone from the root of the repository and the scripts of deprecated/ by their module name
+repo_location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_location, 'deprecated'))
+sys.path.insert(0, repo_location)
@@ -0,0 +1,77 @@
+import os
+import asyncio
+
+import autorclone
+
+
+def test_batches_are_first_fit_decreasing():
+    planner = autorclone.BatchPlanner([('a', 60), ('b', 50), ('c', 40), ('d', 30), ('e', 10)])
+    assert planner.next_batch(100) == ['a', 'c']
+    assert planner.next_batch(100) == ['b', 'd', 'e']
+    assert not planner.has_pending()
+    # A file which doesn't fit in the quota left goes alone when nothing else fits
+    planner = autorclone.BatchPlanner([('big', 200), ('small', 150)])
+    assert planner.next_batch(100) == ['small']
+    assert planner.next_batch(100) == ['big']
+
+
+def test_released_files_go_to_the_next_batch():
+    planner = autorclone.BatchPlanner([('a', 60), ('b', 50), ('c', 40)])
+    batch = planner.next_batch(100)
+    assert batch == ['a', 'c']
+    planner.mark_done('a')
+    planner.release(batch)
+    assert planner.batch_bytes(['a', 'b', 'c']) == 90
+    assert planner.next_batch(100) == ['b', 'c']
+    planner.finish(['b', 'c'])
+    assert not planner.has_pending() and planner.sizes == {}
+
+
+def test_transferred_files_go_to_the_index(tmp_path):
+    index = autorclone.DestinationIndex(str(tmp_path / 'index'))
+    planner = autorclone.BatchPlanner([('a', 60, '2024-01-01T00:00:00Z', 'abc')], index)
+    planner.finish(planner.next_batch(100))
+    assert index.get_files() == {'a': (60, '2024-01-01T00:00:00Z', 'abc')}
+
+
+def test_parse_modtime():
+    assert autorclone.parse_modtime('2024-01-01T00:00:00Z') == 1704067200
+    assert autorclone.parse_modtime('2024-01-01T01:00:00.5+01:00') == 1704067200.5
+    assert autorclone.parse_modtime(autorclone.format_modtime(1704067200.25)) == 1704067200.25
+    assert autorclone.parse_modtime(None) is None
+
+
+def test_is_file_transferred():
+    done = autorclone.is_file_transferred
+    assert done(10, '2024-01-01T00:00:00Z', None, (10, '2024-01-01T00:00:00.4Z', None))
+    assert not done(10, '2024-01-01T00:00:00Z', None, (10, '2024-01-01T00:10:00Z', 'abc'))
+    assert not done(10, '2024-01-01T00:00:00Z', None, (11, '2024-01-01T00:00:00Z', None))
+    assert not done(10, '2024-01-01T00:00:00Z', None, None)
+    # The md5 wins over the modification time when both sides have one
+    assert done(10, '2024-01-01T00:00:00Z', 'abc', (10, '2024-02-01T00:00:00Z', 'abc'))
+    assert not done(10, '2024-01-01T00:00:00Z', 'abc', (10, '2024-01-01T00:00:00Z', 'def'))
+
+
+def write_file(path, size, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+
+
+# A changed file with the same size and a file added to the source after the last run are transferred
+def test_build_batch_planner_lists_the_source_every_run(tmp_path):
+    source, destination = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    for name in ('same', 'changed'):
+        write_file(os.path.join(source, 'dir', name), 10, 1700000000)
+        write_file(os.path.join(destination, 'dir', name), 10, 1700000000)
+    os.utime(os.path.join(source, 'dir', 'changed'), (1700000100, 1700000100))
+    job = autorclone.Job(None, source, destination, 5572, state_dir=str(tmp_path / 'state'), manifest=True)
+    job.open()
+    planner = asyncio.run(autorclone.build_batch_planner(job))
+    assert planner.sizes == {'dir/changed': 10}
+
+    write_file(os.path.join(source, 'new'), 20, 1700000200)
+    planner = asyncio.run(autorclone.build_batch_planner(job))
+    assert planner.sizes == {'dir/changed': 10, 'new': 20}
+    job.close()
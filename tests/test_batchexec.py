@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip('googleapiclient')
+
+import batchexec  # noqa: E402
+from googleapiclient.errors import HttpError  # noqa: E402
+from httplib2 import Response  # noqa: E402
+
+
+def http_error(status, content=b'{}'):
+    return HttpError(Response({'status': status}), content)
+
+
+# A client whose batches run the requests, the server counts what it has run
+class FakeClient:
+    def __init__(self, server):
+        self.server = server
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self.server, callback)
+
+
+class FakeBatch:
+    def __init__(self, server, callback):
+        self.server = server
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        results = [(request_id, request()) for request_id, request in self.requests]
+        if self.server['lose_batches']:
+            # The server has run the requests but the answer is lost
+            self.server['lose_batches'] -= 1
+            raise ConnectionResetError('connection reset')
+        for request_id, (resp, exception) in results:
+            self.callback(request_id, resp, exception)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(batchexec, 'backoff_time', 0.001)
+    return {'lose_batches': 0, 'runs': {}, 'errors': {}}
+
+
+def make_request(server):
+    def request(client, key):
+        def run():
+            server['runs'][key] = server['runs'].get(key, 0) + 1
+            errors = server['errors'].get(key)
+            if errors:
+                return None, errors.pop(0)
+            return {'key': key}, None
+        return run
+    return request
+
+
+def test_lost_batch_is_not_sent_again_unless_idempotent(server):
+    executor = batchexec.BatchExecutor(batchexec.ThreadClients(lambda: FakeClient(server)), batch_size=10, threads=2)
+    server['lose_batches'] = 1
+    responses, errors = executor.execute(range(5), make_request(server))
+    assert responses == {} and sorted(errors) == list(range(5))
+    assert all(count == 1 for count in server['runs'].values())
+
+    server['lose_batches'] = 1
+    server['runs'] = {}
+    responses, errors = executor.execute(range(5), make_request(server), idempotent=True)
+    assert sorted(responses) == list(range(5)) and errors == {}
+    assert all(count == 2 for count in server['runs'].values())
+
+
+def test_only_rate_limits_are_sent_again_unless_idempotent(server):
+    executor = batchexec.BatchExecutor(batchexec.ThreadClients(lambda: FakeClient(server)), batch_size=10, threads=2)
+    server['errors'] = {0: [http_error(429)], 1: [http_error(503)], 2: [http_error(403, b'rateLimitExceeded')]}
+    responses, errors = executor.execute(range(4), make_request(server))
+    assert sorted(responses) == [0, 2, 3] and list(errors) == [1]
+    assert server['runs'] == {0: 2, 1: 1, 2: 2, 3: 1}
+
+    server['errors'] = {1: [http_error(503)]}
+    server['runs'] = {}
+    responses, errors = executor.execute(range(4), make_request(server), idempotent=True)
+    assert sorted(responses) == [0, 1, 2, 3] and server['runs'][1] == 2
@@ -0,0 +1,40 @@
+import re
+
+import pytest
+
+import autorclone
+
+
+# configure() must reach the objects created after it, not only the code reading the globals at run time
+def test_configure_reaches_new_objects(tmp_path, monkeypatch):
+    for name in ('rc_host', 'rc_timeout', 'rc_retries', 'rc_retry_backoff', 'sa_quota_window', 'stats_window_max_samples'):
+        monkeypatch.setattr(autorclone, name, getattr(autorclone, name))
+    autorclone.configure(rc_host='10.0.0.1', rc_timeout=1, rc_retries=7, rc_retry_backoff=0.1,
+                         sa_quota_window=3600, stats_window_max_samples=5)
+
+    rc = autorclone.RcClient(5572)
+    assert (rc.host, rc.timeout, rc.retries, rc.retry_backoff) == ('10.0.0.1', 1, 7, 0.1)
+    assert autorclone.RcClient(5572, host='::1', timeout=2).host == '::1'
+
+    ledger = autorclone.QuotaLedger(str(tmp_path / 'ledger'))
+    try:
+        assert ledger.window == 3600
+        ledger.mark_exhausted('sa@example.com')
+        assert ledger.get_exhausted()['sa@example.com'] <= autorclone.time.time() + 3600
+    finally:
+        ledger.close()
+
+    stats_window = autorclone.StatsWindow(60)
+    assert stats_window.samples.maxlen == 5
+    assert autorclone.StatsWindow(60, max_samples=2).samples.maxlen == 2
+
+
+# Every item between the configuration markers can be set, and only them
+def test_config_names_match_the_configuration_items():
+    with open(autorclone.__file__) as f:
+        source = f.read()
+    items = source.split('# ------------ Start of configuration items')[1].split('# ------------ End of configuration')[0]
+    names = set(re.findall(r'^([a-z_][a-z0-9_]*) *=', items, re.M))
+    assert names == autorclone.config_names
+    with pytest.raises(TypeError):
+        autorclone.configure(sa_pool=None)
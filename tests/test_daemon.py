@@ -0,0 +1,38 @@
+import os
+import asyncio
+
+import autorclone
+
+
+def test_finish_queued_job(tmp_path):
+    for folder in ('done', 'failed'):
+        (tmp_path / folder).mkdir()
+    job_path = tmp_path / 'photos.json'
+    job_path.write_text('{}')
+    autorclone.finish_queued_job(str(tmp_path), str(job_path), True)
+    assert os.listdir(str(tmp_path / 'done')) == ['photos.json']
+
+    # Deleted from the queue while the job ran
+    autorclone.finish_queued_job(str(tmp_path), str(tmp_path / 'videos.json'), False)
+    assert os.listdir(str(tmp_path / 'failed')) == []
+
+
+# A job file still being written is tried again, a file which stays broken goes to failed/ and *.json.tmp is left alone
+def test_unreadable_job_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(autorclone, 'sa_leases', autorclone.SaLeases(None, 'node1', 60))
+    monkeypatch.setattr(autorclone, 'daemon_poll_interval', 0.01)
+    monkeypatch.setattr(autorclone, 'daemon_job_write_time', 30)
+    (tmp_path / 'writing.json').write_text('{"source": "src:", "desti')
+    (tmp_path / 'broken.json').write_text('{"source": "src:", "desti')
+    os.utime(str(tmp_path / 'broken.json'), (0, 0))
+    (tmp_path / 'next.json.tmp').write_text('{"source": "src:", "desti')
+
+    async def run_daemon_a_while():
+        try:
+            await asyncio.wait_for(autorclone.run_daemon(str(tmp_path), 1, 5572), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run_daemon_a_while())
+    assert sorted(os.listdir(str(tmp_path))) == ['done', 'failed', 'next.json.tmp', 'writing.json']
+    assert os.listdir(str(tmp_path / 'failed')) == ['broken.json']
@@ -0,0 +1,48 @@
+import json
+import asyncio
+
+import autorclone
+
+folder = 'application/vnd.google-apps.folder'
+
+
+def change(file_id, name, parent, mime_type='application/octet-stream', size=0, **fields):
+    drive_file = dict({'id': file_id, 'name': name, 'parents': [parent], 'mimeType': mime_type, 'size': str(size),
+                       'md5Checksum': 'md5-%s' % file_id, 'modifiedTime': '2024-01-01T00:00:00.000Z'}, **fields)
+    return {'fileId': file_id, 'file': drive_file}
+
+
+def test_apply_drive_change(tmp_path):
+    index = autorclone.DestinationIndex(str(tmp_path / 'index'))
+    for drive_change in [change('d1', 'photos', 'root', folder), change('f1', 'a.jpg', 'd1', size=10),
+                         change('f2', 'b.jpg', 'root', size=20),
+                         change('x1', 'elsewhere.jpg', 'other', size=30),  # Not under the destination
+                         change('g1', 'notes', 'root', 'application/vnd.google-apps.document')]:
+        autorclone.apply_drive_change(index, drive_change, 'root')
+    assert index.get_files() == {'photos/a.jpg': (10, '2024-01-01T00:00:00.000Z', 'md5-f1'),
+                                 'b.jpg': (20, '2024-01-01T00:00:00.000Z', 'md5-f2')}
+
+    # A renamed folder moves its files, a trashed or removed file and a file moved out are gone
+    autorclone.apply_drive_change(index, change('d1', 'pictures', 'root', folder), 'root')
+    assert sorted(index.get_files()) == ['b.jpg', 'pictures/a.jpg']
+    autorclone.apply_drive_change(index, change('f1', 'a.jpg', 'd1', size=10, trashed=True), 'root')
+    autorclone.apply_drive_change(index, change('f2', 'b.jpg', 'other', size=20), 'root')
+    assert index.get_files() == {}
+    autorclone.apply_drive_change(index, {'fileId': 'd1', 'removed': True}, 'root')
+    assert index.get_path('d1') is None
+
+
+def test_get_drive_ids_reads_only_its_remote(monkeypatch):
+    calls = []
+
+    async def run_rclone_output(*rclone_args):
+        calls.append(rclone_args)
+        if rclone_args[:2] == ('config', 'show'):
+            return '[gdrive]\ntype = drive\nteam_drive = 0ABC\ntoken = {"access_token": "%secret"}\n'
+        return json.dumps({'ID': 'folder1', 'IsDir': True})
+
+    monkeypatch.setattr(autorclone, 'run_rclone_output', run_rclone_output)
+    assert asyncio.run(autorclone.get_drive_ids('gdrive:backup')) == ('0ABC', 'folder1')
+    assert asyncio.run(autorclone.get_drive_ids('gdrive:')) == ('0ABC', '0ABC')
+    assert ('config', 'show', 'gdrive') in calls and not any('dump' in call for call in calls)
+    assert asyncio.run(autorclone.get_drive_ids('/local/backup')) == (None, None)
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import autorclone
+
+
+# A rc answering core/stats with the scripted stats, one after the other
+class FakeRc:
+    def __init__(self, stats):
+        self.stats_left = list(stats)
+        self.calls = []
+
+    async def call(self, method, params):
+        self.calls.append((method, params))
+        return {}
+
+    async def stats(self):
+        return self.stats_left.pop(0)
+
+
+class FakeProc:
+    returncode = None
+
+
+def transfer(name, size, done):
+    return {'name': name, 'size': size, 'bytes': done}
+
+
+def drain(rc, response_json, sa_left, monkeypatch):
+    monkeypatch.setattr(autorclone, 'check_interval', 0)
+    return asyncio.run(autorclone.drain_rclone(FakeProc(), rc, response_json, sa_left, logging.getLogger('test')))
+
+
+def test_transfers_which_fit_finish(monkeypatch):
+    start = {'bytes': 1000, 'transferring': [transfer('a', 100, 90), transfer('b', 1000, 100), transfer('c', 50, 0)]}
+    rc = FakeRc([{'bytes': 1030, 'transferring': [transfer('a', 100, 95), transfer('b', 1000, 120)]},
+                 {'bytes': 1070, 'transferring': [transfer('b', 1000, 130)]}])
+    assert drain(rc, start, 100, monkeypatch)['bytes'] == 1070
+    # New transfers are refused from the bytes transferred so far
+    assert rc.calls == [('options/set', {'main': {'MaxTransfer': 1000, 'CutoffMode': 'soft'}})]
+    assert rc.stats_left == []
+
+
+def test_nothing_fits(monkeypatch):
+    start = {'bytes': 1000, 'transferring': [transfer('a', 1000, 100)]}
+    rc = FakeRc([])
+    assert drain(rc, start, 100, monkeypatch) is start
+    assert rc.calls == []
+
+
+def test_new_transfer_stops_the_drain(monkeypatch):
+    start = {'bytes': 1000, 'transferring': [transfer('a', 100, 90), transfer('b', 1000, 100)]}
+    rc = FakeRc([{'bytes': 1005, 'transferring': [transfer('a', 100, 95), transfer('b', 1000, 100),
+                                                  transfer('d', 10, 0)]},
+                 {'bytes': 1010, 'transferring': [transfer('b', 1000, 100), transfer('d', 10, 5)]}])
+    assert drain(rc, start, 100, monkeypatch)['bytes'] == 1005
+    assert len(rc.stats_left) == 1
+
+
+# The transfers which don't fit use the quota too, the drain stops when it is used
+def test_drain_stops_at_the_quota_left(monkeypatch):
+    start = {'bytes': 1000, 'transferring': [transfer('a', 100, 0), transfer('b', 1000, 100)]}
+    rc = FakeRc([{'bytes': 1060, 'transferring': [transfer('a', 100, 30), transfer('b', 1000, 130)]},
+                 {'bytes': 1120, 'transferring': [transfer('a', 100, 60), transfer('b', 1000, 160)]},
+                 {'bytes': 1180, 'transferring': [transfer('b', 1000, 190)]}])
+    assert drain(rc, start, 100, monkeypatch)['bytes'] == 1120
+    assert len(rc.stats_left) == 1
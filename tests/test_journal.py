@@ -0,0 +1,53 @@
+import asyncio
+
+import autorclone
+
+
+class FakeRc:
+    def __init__(self, transferred):
+        self.transferred = transferred
+
+    async def call(self, method, params=None, retries=None):
+        assert method == 'core/transferred'
+        return {'transferred': self.transferred}
+
+
+def test_journal_keeps_the_files_of_each_job(tmp_path):
+    path = str(tmp_path / 'journal')
+    photos = autorclone.TransferJournal(path, 'photos')
+    photos.record('a.jpg', 10)
+    photos.record('b.jpg')
+    assert photos.get_transferred() == {'a.jpg': 10, 'b.jpg': None}
+    photos.record('a.jpg', 12)  # Transferred again
+    assert photos.get_newest(1) == ['a.jpg']
+    photos.close()
+
+    # Reopened by the next run, the other job has its own files
+    photos = autorclone.TransferJournal(path, 'photos')
+    videos = autorclone.TransferJournal(path, 'videos')
+    assert photos.get_transferred() == {'a.jpg': 12, 'b.jpg': None}
+    assert videos.get_transferred() == {}
+    photos.clear()
+    assert photos.get_transferred() == {}
+
+
+def test_journal_transferred_from_rc(tmp_path):
+    job = autorclone.Job('photos', 'src:', 'dst:', 5572, state_dir=str(tmp_path))
+    job.journal = autorclone.TransferJournal(str(tmp_path / 'journal'), 'photos')
+    planner = autorclone.BatchPlanner([('a.jpg', 10), ('b.jpg', 20), ('c.jpg', 30)])
+    planner.next_batch(100)
+    rc = FakeRc([{'name': 'a.jpg', 'size': 10}, {'name': 'b.jpg', 'size': 20, 'error': 'failed'},
+                 {'name': 'c.jpg', 'size': 30, 'checked': True}])
+    asyncio.run(autorclone.journal_transferred(job, planner, rc))
+    # Only the files rclone has copied, not the failed or checked ones
+    assert job.journal.get_transferred() == {'a.jpg': 10}
+    assert sorted(planner.sizes) == ['b.jpg', 'c.jpg']
+
+
+def test_rclone_filter_excludes_the_journal(tmp_path):
+    shard = tmp_path / 'shard.filter'
+    shard.write_text('+ /dir/**\n- **\n')
+    path = str(tmp_path / 'filter.txt')
+    autorclone.write_rclone_filter(path, ['dir/a [1].jpg', 'b*.jpg'], str(shard))
+    with open(path) as f:
+        assert f.read() == '- /dir/a \\[1\\].jpg\n- /b\\*.jpg\n+ /dir/**\n- **\n'
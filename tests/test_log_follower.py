@@ -0,0 +1,98 @@
+import os
+import json
+
+import autorclone
+
+
+def json_line(level, msg, obj=''):
+    return json.dumps({'time': '2024-01-01T00:00:00Z', 'level': level, 'object': obj, 'msg': msg}) + '\n'
+
+
+def get_events(follower):
+    follower.read()
+    events = []
+    while not follower.events.empty():
+        events.append(follower.events.get_nowait())
+    return events
+
+
+def test_parse_rclone_log_line():
+    parse = autorclone.parse_rclone_log_line
+    assert parse(json_line('error', 'googleapi: Error 403: User rate limit exceeded., userRateLimitExceeded',
+                           'a.bin'))['type'] == 'quota'
+    assert parse(json_line('error', 'googleapi: Error 403: Rate Limit Exceeded, rateLimitExceeded'))['type'] == 'rate_limit'
+    assert parse(json_line('info', 'Copied (new)', 'dir/a.bin')) == {
+        'type': 'copied', 'level': 'info', 'object': 'dir/a.bin', 'msg': 'Copied (new)'}
+    assert parse(json_line('error', 'Attempt 1/3 failed with 2 errors'))['type'] == 'retry'
+    assert parse(json_line('error', 'Failed to copy: unexpected EOF', 'a.bin'))['type'] == 'error'
+    assert parse(json_line('info', 'Copied (new)'))['type'] is None  # Not a file
+    # Text logs too
+    event = parse('2024/01/01 12:00:00 ERROR : dir/a b.bin: Failed to copy: googleapi: Error 403: dailyLimitExceeded')
+    assert (event['type'], event['object']) == ('quota', 'dir/a b.bin')
+    assert parse('2024/01/01 12:00:00.123456 INFO  : dir/a.bin: Moved (server-side)')['type'] == 'copied'
+    assert parse('') is None
+    assert parse('{not json') is None
+    assert parse('Transferred: 1 / 2') is None
+
+
+def test_log_follower_reads_new_lines_only_once(tmp_path):
+    path = str(tmp_path / 'rclone.log')
+    line = json_line('info', 'Copied (new)', 'b.bin')
+    with open(path, 'w') as f:
+        f.write(json_line('info', 'Copied (new)', 'a.bin'))
+        f.write(line[:20])  # Not written to the end yet
+    follower = autorclone.LogFollower(path)
+    assert [event['object'] for event in get_events(follower)] == ['a.bin']
+    with open(path, 'a') as f:
+        f.write(line[20:])
+    assert [event['object'] for event in get_events(follower)] == ['b.bin']
+    assert get_events(follower) == []
+
+
+def test_log_follower_goes_on_from_its_position(tmp_path):
+    path = str(tmp_path / 'rclone.log')
+    with open(path, 'w') as f:
+        f.write(json_line('info', 'Copied (new)', 'a.bin'))
+    follower = autorclone.LogFollower(path)
+    get_events(follower)
+    position = follower.get_position()
+    follower.stop()
+    with open(path, 'a') as f:
+        f.write(json_line('info', 'Copied (new)', 'b.bin'))
+    follower = autorclone.LogFollower(path, position)
+    assert [event['object'] for event in get_events(follower)] == ['b.bin']
+    follower.stop()
+    # The position of another log skips what was written before
+    follower = autorclone.LogFollower(path, [position[0] + 1, 0])
+    assert get_events(follower) == []
+
+
+def test_log_follower_rotation_and_truncation(tmp_path):
+    path = str(tmp_path / 'rclone.log')
+    with open(path, 'w') as f:
+        f.write(json_line('info', 'Copied (new)', 'a.bin'))
+    follower = autorclone.LogFollower(path)
+    get_events(follower)
+    # The end of the rotated log is read before the new one
+    with open(path, 'a') as f:
+        f.write(json_line('info', 'Copied (new)', 'b.bin'))
+    os.rename(path, path + '.1')
+    with open(path, 'w') as f:
+        f.write(json_line('info', 'Copied (new)', 'c.bin'))
+    assert [event['object'] for event in get_events(follower)] == ['b.bin', 'c.bin']
+    with open(path, 'w') as f:
+        f.write(json_line('info', 'Copied', 'd.bin'))  # Shorter than what was read
+    assert [event['object'] for event in get_events(follower)] == ['d.bin']
+
+
+def test_log_follower_follows_another_log_from_its_end(tmp_path):
+    path = str(tmp_path / 'rclone.log')
+    standby_path = str(tmp_path / 'rclone.standby.log')
+    with open(standby_path, 'w') as f:
+        f.write(json_line('error', 'googleapi: Error 403: rateLimitExceeded'))
+    follower = autorclone.LogFollower(path)
+    assert get_events(follower) == []
+    follower.follow(standby_path)
+    with open(standby_path, 'a') as f:
+        f.write(json_line('info', 'Copied (new)', 'a.bin'))
+    assert [event['object'] for event in get_events(follower)] == ['a.bin']
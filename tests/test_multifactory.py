@@ -0,0 +1,128 @@
+import os
+import json
+import base64
+import pickle
+
+import pytest
+
+pytest.importorskip('googleapiclient')
+pytest.importorskip('google_auth_oauthlib')
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+import batchexec  # noqa: E402
+import multifactory  # noqa: E402
+
+
+# A stand-in of the IAM API client given by multifactory._build_client, its batches can be lost after the server ran them
+class FakeIam:
+    def __init__(self, server):
+        self.server = server
+
+    def projects(self):
+        return self
+
+    def serviceAccounts(self):
+        return self
+
+    def keys(self):
+        return FakeKeys(self.server)
+
+    def list(self, name, pageSize):
+        accounts = [{'uniqueId': uid, 'name': '%s/serviceAccounts/%s' % (name, uid)} for uid in self.server['keys']]
+        return FakeRequest(lambda: {'accounts': accounts})
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self.server, callback)
+
+
+class FakeKeys:
+    def __init__(self, server):
+        self.server = server
+
+    def list(self, name, keyTypes):
+        uid = name.rsplit('/', 1)[1]
+        return FakeRequest(lambda: {'keys': [{'name': '%s/keys/%s' % (name, key)} for key in self.server['keys'][uid]]})
+
+    def create(self, name, body):
+        def run():
+            uid = name.rsplit('/', 1)[1]
+            key = 'key%s' % sum(len(keys) for keys in self.server['keys'].values())
+            self.server['keys'][uid].append(key)
+            data = base64.b64encode(json.dumps({'client_email': uid}).encode()).decode()
+            return {'name': '%s/keys/%s' % (name, key), 'privateKeyData': data}
+        return FakeRequest(run)
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+
+class FakeBatch:
+    def __init__(self, server, callback):
+        self.server = server
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        results = [(request_id, request.run()) for request_id, request in self.requests]
+        if self.server['lose_batches']:
+            self.server['lose_batches'] -= 1
+            raise ConnectionResetError('connection reset')
+        for request_id, resp in results:
+            self.callback(request_id, resp, None)
+
+
+def test_keys_are_created_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(batchexec, 'backoff_time', 0.001)
+    server = {'keys': dict(('sa%s' % i, []) for i in range(5)), 'lose_batches': 0}
+    monkeypatch.setattr(multifactory, '_build_client', lambda name, version, creds: FakeIam(server))
+    iam = multifactory._get_executors(None)['iam']
+
+    # The answer of the key requests is lost, they aren't sent again
+    execute = iam.execute
+
+    def lose_creates(keys, make_request, idempotent=False):
+        if not idempotent:
+            server['lose_batches'] = 1
+        return execute(keys, make_request, idempotent)
+    monkeypatch.setattr(iam, 'execute', lose_creates)
+    assert multifactory._create_sa_keys(iam, 'proj', str(tmp_path)) == 0
+    assert all(len(keys) == 1 for keys in server['keys'].values())
+    assert os.listdir(str(tmp_path)) == []
+
+    # The next run creates a key for every account without a downloaded one, and only for them
+    monkeypatch.setattr(iam, 'execute', execute)
+    assert multifactory._create_sa_keys(iam, 'proj', str(tmp_path)) == 5
+    assert len(os.listdir(str(tmp_path))) == 5
+    assert multifactory._create_sa_keys(iam, 'proj', str(tmp_path)) == 0
+    assert all(len(keys) == 2 for keys in server['keys'].values())
+
+
+# A project which fails with any error is reported, the other projects are still set up
+def test_failed_project_does_not_stop_the_others(tmp_path, monkeypatch, capsys):
+    credentials = tmp_path / 'credentials.json'
+    credentials.write_text(json.dumps({'installed': {'project_id': 'proj0'}}))
+    token = tmp_path / 'token.pickle'
+    with open(str(token), 'wb') as f:
+        pickle.dump(Credentials(token='fake-token'), f)
+    monkeypatch.setattr(multifactory, '_build_client', lambda name, version, creds: None)
+    monkeypatch.setattr(multifactory, '_get_executors', lambda creds: {})
+    monkeypatch.setattr(multifactory, '_get_projects', lambda cloud: ['proj1', 'proj2', 'proj3'])
+    done = []
+
+    def setup_project(executors, project, services=None, create_sas=False, path=None, delete_sas=False):
+        if project == 'proj2':
+            raise ConnectionResetError('connection reset')
+        done.append(project)
+    monkeypatch.setattr(multifactory, '_setup_project', setup_project)
+    multifactory.serviceaccountfactory(credentials=str(credentials), token=str(token), create_sas='*', threads=1)
+    assert done == ['proj1', 'proj3']
+    assert "Can't set up proj2: connection reset" in capsys.readouterr().out
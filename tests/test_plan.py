@@ -0,0 +1,107 @@
+import json
+import array
+import itertools
+
+import pytest
+
+import autorclone
+
+
+@pytest.fixture
+def model(monkeypatch):
+    # 10 bytes a second, no limit of files per second, a quota of 100 bytes
+    for name, value in (('sa_daily_quota', 100), ('plan_sa_speed', 10), ('plan_files_per_second', 0),
+                        ('plan_start_time', 0), ('plan_batch_start_time', 5), ('sa_quota_window', 1000),
+                        ('check_interval', 10), ('log_follow_interval', 1)):
+        monkeypatch.setattr(autorclone, name, value)
+
+
+def get_prefix(sizes):
+    return array.array('q', itertools.accumulate(sizes))
+
+
+def test_read_plan_listing(tmp_path):
+    (tmp_path / 'local').mkdir()
+    (tmp_path / 'local' / 'a').write_bytes(b'x' * 3)
+    (tmp_path / 'local' / 'b').write_bytes(b'x' * 5)
+    assert sorted(autorclone.read_plan_listing(str(tmp_path / 'local'))) == [3, 5]
+
+    lsjson = tmp_path / 'lsjson.txt'
+    lsjson.write_text('[\n{"Path":"dir","Size":-1,"IsDir":true},\n{"Path":"dir/a","Size":10,"IsDir":false},\n'
+                      '{"Path":"doc","Size":-1,"IsDir":false}\n]\n')
+    assert list(autorclone.read_plan_listing(str(lsjson))) == [10, 0]
+
+    size = tmp_path / 'size.json'
+    size.write_text(json.dumps({'count': 4, 'bytes': 100}))
+    assert list(autorclone.read_plan_listing(str(size))) == [25] * 4
+
+    manifest = str(tmp_path / 'manifest.gz')
+    autorclone.save_manifest('src:', [['a', 7, '2024-01-01T00:00:00Z', None], ['b', 9, None, None]], manifest)
+    assert list(autorclone.read_plan_listing(manifest)) == [7, 9]
+
+
+def test_quota_switch_delay(model):
+    rules = [dict(rule, enabled=True) if rule['name'] == 'quota_forecast' else rule
+             for rule in autorclone.switch_sa_rules]
+    # quota_forecast switches a check before the quota runs out
+    assert autorclone.get_quota_switch_delay(autorclone.RuleEngine(rules, 1)) == (-10, ['quota_forecast'])
+    # Without it, the error in the log switches
+    assert autorclone.get_quota_switch_delay(autorclone.RuleEngine(autorclone.switch_sa_rules, 1)) == (
+        1, ['error_user_rate_limit'])
+    # Two rules are needed, the later one decides
+    assert autorclone.get_quota_switch_delay(autorclone.RuleEngine(autorclone.switch_sa_rules, 2)) == (
+        5, ['up_than_750', 'error_user_rate_limit'])
+    assert autorclone.get_quota_switch_delay(autorclone.RuleEngine([], 1)) == (None, [])
+
+
+def test_plan_worker_without_loss(model):
+    prefix = get_prefix([10] * 25)
+    runs, stuck = autorclone.plan_worker(prefix, 0, 25, 0, False, 1)
+    assert runs == [[0, 10, 100, 0, 0], [10, 20, 100, 0, 0], [20, 25, 50, 0, 0]]
+    assert stuck == []
+
+
+# The bytes of the files in progress at a switch are sent again, unless the drain lets them finish
+def test_plan_worker_loss_and_drain(model):
+    sizes = [30] * 10
+    prefix = get_prefix(sizes)
+    runs, stuck = autorclone.plan_worker(prefix, 0, 10, 0, False, 2)
+    assert sum(run[2] for run in runs) - sum(run[3] for run in runs) == sum(sizes)
+    assert sum(run[3] for run in runs) > 0 and stuck == []
+
+    # Switch 20 bytes before the quota runs out, the file in progress finishes in them
+    drained_runs, stuck = autorclone.plan_worker(prefix, 0, 10, -2, True, 2)
+    assert sum(run[2] for run in drained_runs) - sum(run[3] for run in drained_runs) == sum(sizes)
+    assert sum(run[3] for run in drained_runs) < sum(run[3] for run in runs)
+
+
+def test_plan_worker_stuck_file(model):
+    runs, stuck = autorclone.plan_worker(get_prefix([10, 150, 10]), 0, 3, 0, False, 1)
+    assert stuck == [150]
+    assert runs[-1][2] == 10
+
+
+def test_plan_batches(model):
+    assert autorclone.plan_batches([60, 50, 40, 30, 20]) == [[100, 2], [100, 3]]
+    assert autorclone.plan_batches([]) == []
+
+
+def test_accounts_needed(model):
+    # An account is free again 1000 seconds after its run
+    assert autorclone.get_plan_accounts_needed([[0, 10], [10, 20], [20, 30]]) == 3
+    assert autorclone.get_plan_accounts_needed([[0, 10], [1010, 1020], [2020, 2030]]) == 1
+
+
+def test_plan_transfer(model, tmp_path, capsys):
+    listing = tmp_path / 'size.json'
+    listing.write_text(json.dumps({'count': 10, 'bytes': 500}))
+    engine = autorclone.RuleEngine(autorclone.switch_sa_rules, 1)
+    autorclone.plan_transfer(str(listing), engine, workers=1, manifest=True)
+    out = capsys.readouterr().out
+    assert 'Service Accounts: 5 runs' in out
+    assert 'Switch overhead: 4 switches' in out
+
+    autorclone.plan_transfer(str(listing), engine, workers=1, manifest=True, warm_standby=True)
+    out = capsys.readouterr().out
+    assert 'batches with a warm standby' in out
+    assert '0.00 hours in all' in out
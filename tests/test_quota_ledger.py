@@ -0,0 +1,67 @@
+import time
+import asyncio
+
+import autorclone
+
+
+# A pool of accounts with a ledger and leases of their own
+def setup_pool(tmp_path, monkeypatch, count=3):
+    paths = []
+    for i in range(count):
+        path = tmp_path / ('sa%s.json' % i)
+        path.write_text('{}')
+        paths.append(str(path))
+    pool = autorclone.SaPool([(path, {'client_email': 'sa%s@example.com' % i}) for i, path in enumerate(paths)])
+    ledger = autorclone.QuotaLedger(str(tmp_path / 'ledger'), window=3600)
+    monkeypatch.setattr(autorclone, 'sa_pool', pool)
+    monkeypatch.setattr(autorclone, 'quota_ledger', ledger)
+    monkeypatch.setattr(autorclone, 'sa_leases', autorclone.FileSaLeases(str(tmp_path / 'leases'), 'node1', 60))
+    monkeypatch.setattr(autorclone, 'sa_in_use', set())
+    return paths, ledger
+
+
+def test_account_with_most_quota_left_first(tmp_path, monkeypatch):
+    paths, ledger = setup_pool(tmp_path, monkeypatch)
+    ledger.record('sa0@example.com', 500 * 1024 ** 3)
+    ledger.record('sa1@example.com', 100 * 1024 ** 3)
+    ledger.mark_exhausted('sa2@example.com')
+    assert autorclone.acquire_next_sa_json_path('') == paths[1]
+    # The next one skips the account in use and gives back the last one
+    assert autorclone.acquire_next_sa_json_path(paths[1], release_last=False) == paths[0]
+    assert autorclone.sa_in_use == {paths[0], paths[1]}
+    # The last account is taken again when no other one is left, never the exhausted one
+    assert autorclone.acquire_next_sa_json_path(paths[0]) == paths[0]
+
+
+def test_exhausted_accounts_are_not_used(tmp_path, monkeypatch):
+    paths, ledger = setup_pool(tmp_path, monkeypatch, count=2)
+    for i in range(2):
+        ledger.mark_exhausted('sa%s@example.com' % i)
+    assert autorclone.acquire_next_sa_json_path('') is None
+    assert autorclone.acquire_next_sa_json_path('', allow_exhausted=True) in paths
+
+
+def test_waits_until_an_exhausted_account_is_back(tmp_path, monkeypatch):
+    paths, ledger = setup_pool(tmp_path, monkeypatch, count=2)
+    ledger.mark_exhausted('sa0@example.com', until=time.time() + 1000)
+    ledger.mark_exhausted('sa1@example.com', until=time.time() + 500)
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        ledger._db.execute('DELETE FROM exhausted WHERE sa = ?', ('sa1@example.com',))
+
+    monkeypatch.setattr(autorclone.asyncio, 'sleep', sleep)
+    sa = asyncio.run(autorclone.acquire_next_sa_json_path_waiting('', autorclone.logger))
+    assert sa == paths[1]
+    assert len(sleeps) == 1 and 490 < sleeps[0] <= 500
+
+
+def test_mark_exhausted_keeps_the_later_time(tmp_path):
+    ledger = autorclone.QuotaLedger(str(tmp_path / 'ledger'), window=3600)
+    until = time.time() + 7200
+    ledger.mark_exhausted('sa0@example.com', until=until)
+    ledger.mark_exhausted('sa0@example.com')
+    assert ledger.get_exhausted() == {'sa0@example.com': until}
+    ledger.mark_exhausted('sa0@example.com', until=until + 10)
+    assert ledger.get_exhausted() == {'sa0@example.com': until + 10}
@@ -0,0 +1,64 @@
+import autorclone
+
+
+# Run a rclone of `seconds` at `speed` bytes per second through the controller, with a rate limit error if asked
+def run_process(controller, seconds, speed, rate_limit=False):
+    controller.start_process()
+    window = autorclone.StatsWindow(3600)
+    for t in range(0, seconds + 1, 10):
+        log = {'rate_limit': 1 if rate_limit and t == seconds else 0}
+        window.add({'bytes': speed * t, 'transfers': t // 10}, log, ts=1000 + t)
+        controller.update(window)
+
+
+def test_values_change_from_one_rclone_to_the_next():
+    controller = autorclone.RateController(['rclone', 'copy', 'a:', 'b:', '--tpslimit', '10', '--transfers', '4'])
+    assert controller.pick_values() is False  # Nothing measured before the first rclone
+    assert controller.get_cmd(['rclone', 'copy', 'a:', 'b:', '--tpslimit=10'])[-4:] == [
+        '--tpslimit', '10', '--transfers', '4']
+
+    # A rclone without rate limit errors, the next one gets a step more
+    run_process(controller, 120, 1000)
+    assert controller.pick_values() is True
+    assert (controller.tpslimit, controller.transfers) == (11, 5)
+    assert controller.pick_values() is False  # Once per rclone
+
+    # It wasn't faster, go back
+    run_process(controller, 120, 1010)
+    assert controller.pick_values() is True
+    assert (controller.tpslimit, controller.transfers) == (10, 4)
+
+    # A rate limit error halves the values of the next rclone
+    run_process(controller, 30, 1000, rate_limit=True)
+    assert controller.pick_values() is True
+    assert (controller.tpslimit, controller.transfers) == (5, 2)
+
+
+# A rate limit error restarts the running rclone at once, not more often than rate_control_restart_after
+def test_rate_limit_error_restarts_rclone(monkeypatch):
+    monkeypatch.setattr(autorclone, 'rate_control_restart_after', 30)
+    controller = autorclone.RateController(['rclone', 'copy', 'a:', 'b:', '--tpslimit', '10', '--transfers', '4'])
+    run_process(controller, 120, 1000)
+    assert not controller.should_restart()
+    run_process(controller, 30, 1000, rate_limit=True)
+    assert controller.should_restart()
+    assert controller.pick_values()
+    assert (controller.tpslimit, controller.transfers) == (5, 2)
+
+    # Another error right after the restart waits for the next rclone
+    run_process(controller, 10, 1000, rate_limit=True)
+    assert not controller.should_restart()
+    controller.time_decrease -= 30
+    assert controller.should_restart()
+
+
+# The default rules keep no window, the check before the last one is still there to see a new error
+def test_rate_limit_error_seen_without_window():
+    controller = autorclone.RateController(['rclone', 'copy', 'a:', 'b:'])
+    window = autorclone.StatsWindow(0)
+    error = 'googleapi: Error 403: Rate Limit Exceeded, rateLimitExceeded'
+    for t, errors in enumerate([0, 0, 1]):
+        window.add({'bytes': 1000 * t, 'errors': errors, 'lastError': error if errors else ''}, {}, ts=1000 + t)
+        controller.update(window)
+    assert len(window.samples) == 2
+    assert controller.rate_limited
@@ -0,0 +1,34 @@
+import autorclone
+
+
+# Every path is an argument of its own, a space in it must not split it
+def test_paths_with_spaces_stay_one_argument():
+    job = autorclone.Job(None, '/data/my photos', 'remote:my backup', 5572, flags='--transfers 8 --exclude "*.tmp"')
+    assert job.cmd_rclone[2:4] == ['/data/my photos', 'remote:my backup']
+    assert job.cmd_rclone[-4:] == ['--transfers', '8', '--exclude', '*.tmp']
+
+    cmd = autorclone.get_cmd_rclone_for_sa(job.cmd_rclone, '/opt/auto rclone/service_accounts/sa1.json', 5572,
+                                           ['--filter-from', '/tmp/my state/autorclone.filter.5572.txt'])
+    assert cmd[-4:] == ['--filter-from', '/tmp/my state/autorclone.filter.5572.txt',
+                        '--drive-service-account-file', '/opt/auto rclone/service_accounts/sa1.json']
+    assert '--rc-addr=:5572' in cmd
+
+
+def test_flags_of_the_command():
+    cmd = ['rclone', 'sync', 'a:', 'b:', '--tpslimit=5', '--transfers', '8', '--bwlimit', '10M']
+    assert autorclone.get_rclone_flag(cmd, '--tpslimit') == '5'
+    assert autorclone.get_rclone_flag(cmd, '--transfers') == '8'
+    assert autorclone.get_rclone_flag(cmd, '--checkers') is None
+    assert autorclone.remove_rclone_flags(cmd, ('--tpslimit', '--transfers')) == [
+        'rclone', 'sync', 'a:', 'b:', '--bwlimit', '10M']
+    assert autorclone.get_copy_cmd(cmd)[:4] == ['rclone', 'copy', 'a:', 'b:']
+
+
+# A standby gets a batch of its own and writes to its own log
+def test_warm_standby_uses_batches_and_its_own_log():
+    job = autorclone.Job(None, 'src:', 'dst:', 5572, warm_standby=True)
+    assert job.manifest
+    cmd = job.cmd_rclone + ['--log-file', '/tmp/rclone.log', '--use-json-log']
+    standby = autorclone.StandbyRclone(cmd, 'sa1.json', 5672, '/tmp/rclone.standby.log')
+    assert autorclone.get_rclone_flag(standby.cmd, '--log-file') == '/tmp/rclone.standby.log'
+    assert standby.cmd.count('--log-file') == 1
@@ -0,0 +1,17 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+pytest.importorskip('googleapiclient')
+pytest.importorskip('google_auth_oauthlib')
+
+check_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark', 'check_reconcile.py')
+
+
+# reconcile.py against the stand-in of the Drive API, with --dry-run, --prune and a run with nothing to change
+def test_reconcile_against_fake_drive_api():
+    result = subprocess.run([sys.executable, check_path, '--accounts', '120', '--rate-limit', '0.05'],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
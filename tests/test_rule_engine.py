@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import autorclone
+
+
+# A window with a sample every 10 seconds from `stats`, a list of (bytes, errors, log events)
+def make_window(stats, keep_time=3600, **last):
+    window = autorclone.StatsWindow(keep_time)
+    for i, (transferred, errors, log) in enumerate(stats):
+        response_json = {'bytes': transferred, 'errors': errors}
+        if i == len(stats) - 1:
+            response_json.update(last)
+        window.add(response_json, log, ts=1000 + 10 * i)
+    return window
+
+
+def test_stats_window_keeps_one_sample_before_the_window():
+    window = make_window([(i, 0, {}) for i in range(10)], keep_time=30)
+    assert [sample['t'] for sample in window.samples] == [1060, 1070, 1080, 1090]
+    assert window.since(30)['t'] == 1060
+    assert window.since(60) is None
+    assert [sample['t'] for sample in window.within(20)] == [1070, 1080, 1090]
+
+
+def test_stats_window_max_samples():
+    window = autorclone.StatsWindow(3600, max_samples=3)
+    for i in range(5):
+        window.add({}, {}, ts=1000 + i)
+    assert [sample['t'] for sample in window.samples] == [1002, 1003, 1004]
+
+
+def test_quota_rules():
+    window = make_window([(0, 0, {}), (100, 0, {})], speed=1)
+    assert autorclone.QuotaUsedRule('used').check(window, -1)
+    assert not autorclone.QuotaUsedRule('used').check(window, 0)
+    # 10 bytes a second between the last two samples, whatever the speed given by rclone
+    rule = autorclone.QuotaForecastRule('forecast', polls=2)
+    assert rule.check(window, 10 * autorclone.check_interval * 2)
+    assert not rule.check(window, 10 * autorclone.check_interval * 2 + 1)
+
+
+def test_error_message_rule():
+    rule = autorclone.ErrorMessageRule('rate', pattern='userRateLimitExceeded', log_events=['quota'], window=20)
+    assert rule.check(make_window([(0, 0, {})], lastError='googleapi: Error 403: userRateLimitExceeded'), 0)
+    # Only the events of the window count
+    assert rule.check(make_window([(0, 0, {'quota': 0}), (0, 0, {'quota': 1})]), 0)
+    assert not rule.check(make_window([(0, 0, {'quota': 1}), (0, 0, {'quota': 1}), (0, 0, {'quota': 1})]), 0)
+
+
+def test_error_rate_rule():
+    rule = autorclone.ErrorRateRule('errors', rate=30, window=60)
+    # No sample from 60 seconds ago yet
+    assert not rule.check(make_window([(0, 0, {}), (0, 100, {})]), 0)
+    assert rule.check(make_window([(0, 10 * i, {}) for i in range(7)]), 0)
+    assert not rule.check(make_window([(0, 5 * i, {}) for i in range(7)]), 0)
+    rule = autorclone.ErrorRateRule('log_errors', rate=1, window=60, log_events=['error'])
+    assert rule.check(make_window([(0, 0, {'error': i}) for i in range(7)]), 0)
+
+
+def test_speed_below_and_idle_rules():
+    rule = autorclone.SpeedBelowRule('stalled', speed=10, window=60)
+    assert rule.check(make_window([(10 * i, 0, {}) for i in range(7)]), 0)
+    assert not rule.check(make_window([(1000 * i, 0, {}) for i in range(7)]), 0)
+    rule = autorclone.TransfersIdleRule('idle')
+    assert rule.check(make_window([(0, 0, {})], transferring=[{'bytes': 0, 'speed': 0}]), 0)
+    assert not rule.check(make_window([(0, 0, {})], transferring=[{'bytes': 10, 'speed': 1}]), 0)
+
+
+def test_rule_engine_weighs_the_rules_hit():
+    engine = autorclone.RuleEngine([
+        {'name': 'used', 'kind': 'quota_used', 'weight': 2},
+        {'name': 'rate', 'kind': 'error_message', 'log_events': ['quota']},
+        {'name': 'stalled', 'kind': 'speed_below', 'speed': 0, 'window': 120, 'enabled': False},
+    ], 2)
+    assert [rule.name for rule in engine.rules] == ['used', 'rate']
+    assert engine.max_window == 0
+    assert engine.log_event_types == {'quota'}
+    window = make_window([(0, 0, {'quota': 1})])
+    assert engine.evaluate(window, 1) == (1, ['rate'])
+    assert not engine.should_switch(1)
+    assert engine.evaluate(window, -1) == (3, ['used', 'rate'])
+    assert engine.should_switch(3)
+
+
+def test_rule_engine_unknown_kind():
+    with pytest.raises(ValueError):
+        autorclone.RuleEngine([{'name': 'bad', 'kind': 'nope'}], 1)
+
+
+def test_load_rule_engine_from_json(tmp_path):
+    path = tmp_path / 'switch_rules.json'
+    path.write_text(json.dumps({'switch_sa_level': 3, 'switch_sa_rules': [
+        {'name': 'errors', 'kind': 'error_rate_above', 'rate': 5, 'window': 300, 'weight': 3}]}))
+    engine = autorclone.load_rule_engine(str(path))
+    assert engine.level == 3
+    assert engine.max_window == 300
+    assert engine.new_window().keep_time == 300
+    assert [rule.name for rule in autorclone.load_rule_engine(None).rules] == \
+        [rule['name'] for rule in autorclone.switch_sa_rules if rule.get('enabled', True)]
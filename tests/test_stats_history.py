@@ -0,0 +1,23 @@
+import autorclone
+
+
+def test_report_without_runs(tmp_path, capsys):
+    # What a rclone which failed to start leaves behind
+    recorder = autorclone.StatsRecorder(str(tmp_path))
+    recorder.add('E', 'w0', 'sa1@example.com', name='failed')
+    recorder.close()
+    autorclone.report_stats_history(str(tmp_path))
+    assert 'No rclone runs recorded' in capsys.readouterr().out
+
+
+def test_report_of_a_run(tmp_path, capsys):
+    recorder = autorclone.StatsRecorder(str(tmp_path))
+    recorder.add('S', 'w0', 'sa1@example.com')
+    recorder.add('C', 'w0', 'sa1@example.com', {'bytes': pow(1024, 3), 'speed': pow(1024, 2)})
+    recorder.add('E', 'w0', 'sa1@example.com', {'bytes': pow(1024, 3)}, name='finished')
+    recorder.add('E', 'w1', 'sa2@example.com', name='failed')
+    recorder.close()
+    autorclone.report_stats_history(str(tmp_path))
+    output = capsys.readouterr().out
+    assert 'by 1 rclone runs of 1 Service Accounts' in output
+    assert 'sa1@example.com' in output and 'sa2@example.com' not in output
@@ -0,0 +1,76 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+import autorclone
+
+repo_location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fake_rclone_path = os.path.join(repo_location, 'benchmark', 'fake_rclone.py')
+
+
+# A job with its journal and two accounts, `rclone check` is the fake rclone where the files `differ` are different
+@pytest.fixture
+def make_job(tmp_path, monkeypatch):
+    jobs = []
+    paths = []
+    for i in range(2):
+        path = tmp_path / ('sa%s.json' % i)
+        path.write_text('{}')
+        paths.append(str(path))
+    monkeypatch.setattr(autorclone, 'sa_pool', autorclone.SaPool(
+        [(path, {'client_email': 'sa%s@example.com' % i}) for i, path in enumerate(paths)]))
+    monkeypatch.setattr(autorclone, 'quota_ledger', autorclone.QuotaLedger(str(tmp_path / 'ledger')))
+    monkeypatch.setattr(autorclone, 'sa_leases', autorclone.SaLeases(None, 'node1', 60))
+    monkeypatch.setattr(autorclone, 'sa_in_use', set())
+    monkeypatch.setattr(autorclone, 'rclone_bin', fake_rclone_path)
+    monkeypatch.setattr(autorclone, 'verify_processes', 2)
+
+    def make(files, differ, mode='copy'):
+        scenario = tmp_path / 'scenario.json'
+        scenario.write_text(json.dumps({'files': {'src:': [[path, 10] for path in files]}, 'differ': differ}))
+        monkeypatch.setenv('FAKE_RCLONE_SCENARIO', str(scenario))
+        job = autorclone.Job('job', 'src:', 'dst:', 5572, state_dir=str(tmp_path / 'state'), mode=mode, verify=True)
+        job.open()
+        jobs.append(job)
+        for path in files:
+            job.journal.record(path, 10)
+        return job
+    yield make
+    for job in jobs:
+        job.close()
+    autorclone.quota_ledger.close()
+
+
+def read_retry_list(job):
+    with open(job.path(autorclone.verify_retry_path)) as f:
+        return f.read().split()
+
+
+def test_files_which_differ_are_transferred_again(make_job):
+    job = make_job(['a', 'b', 'c', 'd', 'e'], ['b', 'e'])
+    assert asyncio.run(autorclone.verify_job(job)) == 2
+    assert read_retry_list(job) == ['b', 'e']
+    assert job.journal.get_transferred() == {}
+    assert autorclone.sa_in_use == set()
+
+
+# A failed verification leaves the retry list for the next run, the job ends with the code of the transfer
+def test_failed_verification_keeps_the_exit_code(make_job, monkeypatch):
+    job = make_job(['a', 'b'], ['a'])
+
+    async def transfer_job(job):
+        return 0
+    monkeypatch.setattr(autorclone, 'transfer_job', transfer_job)
+    assert asyncio.run(autorclone.run_job(job)) == 0
+    assert job.state == 'done'
+    assert read_retry_list(job) == ['a']
+
+
+# The source files of a move are gone, they aren't checked
+def test_move_is_not_verified(make_job, monkeypatch):
+    job = make_job(['a'], ['a'], mode='move')
+    monkeypatch.setattr(autorclone, 'rclone_bin', '/nonexistent/rclone')
+    assert asyncio.run(autorclone.verify_job(job)) == 0
+    assert not os.path.exists(job.path(autorclone.verify_retry_path))